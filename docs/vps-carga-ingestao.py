@@ -0,0 +1,932 @@
+#!/usr/bin/env python3
+"""
+Gerador de Carga de Ingestão + Edge Function Local (SQLite)
+===========================================================
+
+Mede throughput, latência de cauda e o comportamento de fila do envio do
+leitor (vps-modbus-reader.py) de ponta a ponta, sem rede e sem tocar o
+banco de produção.
+
+Componentes:
+- servidor: implementa o contrato da edge function modbus-receiver sobre
+  SQLite: auto-cadastro por porta_vps, insert em leituras_tempo_real,
+  alertas por parametros_alerta (quando a VPS não avaliou), tipo "alertas",
+  tipo "rollups" (upsert), tipo "leituras" (lote) e GET ?recurso=parametros_alerta;
+  leituras com (id_fluxo, seq) e alertas com chave são idempotentes e a
+  resposta traz ack_seq, como na edge function v2.29.0
+- carga: N geradores simulados usando as funções de envio, alertas e
+  rollups do próprio leitor, apontadas para o servidor local
+- broker: broker MQTT mínimo para testar o sink mqtt do leitor (conta as
+  mensagens por tópico; --atraso-ms simula um broker lento)
+
+Formas de carga (--forma):
+  estavel            Rede OK, valores com ruído
+  queda_rede         No 2º terço todos perdem a rede juntos: partida do GMG,
+                     transitório de tensão/frequência e rajada de alertas
+  rajada_reconexao   No 2º terço os links caem; no 3º voltam juntos e todos
+                     os geradores fazem polling no mesmo instante
+
+Uso:
+    python vps-carga-ingestao.py servidor --porta 8787 --banco /tmp/carga.db
+    python vps-carga-ingestao.py carga --url http://127.0.0.1:8787 --geradores 50 --forma queda_rede
+    python vps-carga-ingestao.py tudo --geradores 50 --intervalo 1 --duracao 60 --forma rajada_reconexao
+    python vps-carga-ingestao.py broker --porta 1883
+
+    --latencia-ms e --taxa-erro no servidor simulam o RTT e as falhas da
+    edge function real. --taxa-perda-resposta grava e mesmo assim responde
+    504 (resposta perdida, como um timeout do gateway): com --tentativas > 1 na carga o reenvio deve
+    voltar como duplicada, sem linha a mais no banco.
+    --json grava o relatório da carga em arquivo.
+    --formato msgpack envia no formato compacto do leitor (requer msgpack);
+    o relatório mostra os bytes recebidos pelo servidor para comparar.
+"""
+
+import os
+import json
+import math
+import time
+import random
+import struct
+import sqlite3
+import argparse
+import socketserver
+import logging
+import threading
+import importlib.util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Any, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s'
+)
+logger = logging.getLogger("carga")
+
+# ============ CONFIGURAÇÃO ============
+PORTA_SERVIDOR = 8787
+PORTA_BROKER = 1883
+BANCO_PADRAO = "carga-ingestao.db"
+GERADORES_PADRAO = 20
+INTERVALO_PADRAO = 1.0    # Segundos entre pollings de cada gerador
+DURACAO_PADRAO = 60       # Segundos de carga
+PORTA_VPS_INICIAL = 30000  # porta_vps dos geradores simulados: 30000, 30001, ...
+TIPOS_MSGPACK = ("application/x-msgpack", "application/msgpack", "application/vnd.msgpack")
+# ======================================
+
+# Mesmo insert de leituras_tempo_real da edge function
+COLUNAS_LEITURA = (
+    "tensao_rede_rs", "tensao_rede_st", "tensao_rede_tr", "tensao_gmg",
+    "corrente_fase1", "frequencia_gmg", "rpm_motor", "temperatura_agua",
+    "tensao_bateria", "horas_trabalhadas", "numero_partidas", "nivel_combustivel",
+    "motor_funcionando", "rede_ok", "gmg_alimentando", "aviso_ativo", "falha_ativa",
+    "horimetro_horas", "horimetro_minutos", "horimetro_segundos",
+    "capturado_em", "trace_id", "seq", "id_fluxo", "leitura_parcial",
+)
+
+# parameterMap da edge function (nome em parametros_alerta → campo da leitura)
+MAPA_PARAMETROS = {
+    "Tensão GMG": "tensao_gmg",
+    "Tensão Rede R-S": "tensao_rede_rs",
+    "Tensão Rede S-T": "tensao_rede_st",
+    "Tensão Rede T-R": "tensao_rede_tr",
+    "Corrente Fase 1": "corrente_fase1",
+    "Frequência GMG": "frequencia_gmg",
+    "RPM Motor": "rpm_motor",
+    "Temperatura Água": "temperatura_agua",
+    "Tensão Bateria": "tensao_bateria",
+    "Nível Combustível": "nivel_combustivel",
+}
+
+# Em produção os parametros_alerta são configurados no app; aqui são criados
+# no auto-cadastro para o caminho de alertas participar da carga.
+PARAMETROS_PADRAO = (
+    ("Tensão Rede R-S", 190, 240, "warning"),
+    ("Tensão Rede S-T", 190, 240, "warning"),
+    ("Temperatura Água", None, 95, "critical"),
+    ("Tensão Bateria", 11.5, None, "warning"),
+    ("Nível Combustível", 20, None, "warning"),
+)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS geradores (
+    id TEXT PRIMARY KEY, user_id TEXT, marca TEXT, modelo TEXT, controlador TEXT,
+    potencia_nominal TEXT, tensao_nominal TEXT, frequencia_nominal TEXT, combustivel TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE TABLE IF NOT EXISTS equipamentos_hf (
+    id TEXT PRIMARY KEY, gerador_id TEXT, modelo TEXT, porta_vps TEXT UNIQUE, ip_vps TEXT,
+    porta_tcp_local TEXT, endereco_modbus TEXT, status TEXT, updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS leituras_tempo_real (
+    id TEXT PRIMARY KEY, gerador_id TEXT, {colunas},
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    UNIQUE (gerador_id, id_fluxo, seq)
+);
+CREATE TABLE IF NOT EXISTS fluxos_envio (
+    gerador_id TEXT, id_fluxo TEXT, ack_seq INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (gerador_id, id_fluxo)
+);
+CREATE TABLE IF NOT EXISTS parametros_alerta (
+    id TEXT PRIMARY KEY, gerador_id TEXT, parametro TEXT, valor_minimo REAL, valor_maximo REAL,
+    nivel TEXT, habilitado INTEGER DEFAULT 1,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE TABLE IF NOT EXISTS alertas (
+    id TEXT PRIMARY KEY, gerador_id TEXT, leitura_id TEXT, nivel TEXT, mensagem TEXT, origem TEXT,
+    chave_envio TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    UNIQUE (gerador_id, chave_envio)
+);
+CREATE TABLE IF NOT EXISTS leituras_agregadas (
+    id TEXT PRIMARY KEY, gerador_id TEXT, janela TEXT, inicio TEXT, fim TEXT, amostras INTEGER,
+    estatisticas TEXT, UNIQUE (gerador_id, janela, inicio)
+);
+""".replace("{colunas}", ", ".join(COLUNAS_LEITURA))
+
+
+def novo_id() -> str:
+    return os.urandom(16).hex()
+
+
+def percentil(valores: list, p: float) -> Optional[float]:
+    """Percentil por posição (nearest-rank) de uma lista já ordenada"""
+    if not valores:
+        return None
+    indice = min(len(valores) - 1, max(0, math.ceil(p / 100 * len(valores)) - 1))
+    return round(valores[indice], 2)
+
+
+def resumo_latencias(latencias_ms: list) -> Dict[str, Any]:
+    ordenadas = sorted(latencias_ms)
+    return {
+        "amostras": len(ordenadas),
+        "p50_ms": percentil(ordenadas, 50),
+        "p95_ms": percentil(ordenadas, 95),
+        "p99_ms": percentil(ordenadas, 99),
+        "max_ms": ordenadas[-1] if ordenadas else None,
+    }
+
+
+# =============================================================================
+# EDGE FUNCTION LOCAL (SQLite)
+# =============================================================================
+
+class BancoLocal:
+    """Tabelas usadas pela modbus-receiver, com uma conexão serializada"""
+
+    def __init__(self, caminho: str):
+        self.conn = sqlite3.connect(caminho, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(ESQUEMA)
+        self.lock = threading.Lock()
+
+    def gerador_por_porta(self, porta_vps: str) -> Optional[str]:
+        linha = self.conn.execute(
+            "SELECT gerador_id FROM equipamentos_hf WHERE porta_vps = ?", (porta_vps,)
+        ).fetchone()
+        return linha[0] if linha else None
+
+    def cadastrar(self, porta_vps: str) -> str:
+        """Auto-cadastro igual ao da edge function (gerador + HF2211 + parâmetros)"""
+        gerador_id = novo_id()
+        self.conn.execute(
+            "INSERT INTO geradores (id, user_id, marca, modelo, controlador, potencia_nominal,"
+            " tensao_nominal, frequencia_nominal, combustivel) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (gerador_id, "00000000-0000-0000-0000-000000000000", "MWM", "D229-4",
+             "STEMAC K30XL", "75 kVA", "220V", "60Hz", "Diesel"),
+        )
+        self.conn.execute(
+            "INSERT INTO equipamentos_hf (id, gerador_id, modelo, porta_vps, ip_vps, porta_tcp_local,"
+            " endereco_modbus, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (novo_id(), gerador_id, "HF2211", porta_vps, "127.0.0.1", "502", "001", "online"),
+        )
+        self.conn.executemany(
+            "INSERT INTO parametros_alerta (id, gerador_id, parametro, valor_minimo, valor_maximo, nivel)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(novo_id(), gerador_id, *parametro) for parametro in PARAMETROS_PADRAO],
+        )
+        return gerador_id
+
+    def parametros(self, gerador_id: str) -> list:
+        cursor = self.conn.execute(
+            "SELECT parametro, valor_minimo, valor_maximo, nivel, habilitado, updated_at"
+            " FROM parametros_alerta WHERE gerador_id = ? AND habilitado = 1",
+            (gerador_id,),
+        )
+        colunas = [c[0] for c in cursor.description]
+        return [
+            {**dict(zip(colunas, linha)), "habilitado": bool(linha[4])}
+            for linha in cursor.fetchall()
+        ]
+
+    def avancar_ack(self, gerador_id: str, id_fluxo: str, seq_min: Optional[int]) -> int:
+        """Mesma regra de avancar_ack_fluxo: maior seq contíguo a partir de max(ack, seq_min - 1)"""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO fluxos_envio (gerador_id, id_fluxo) VALUES (?, ?)", (gerador_id, id_fluxo)
+        )
+        ack = self.conn.execute(
+            "SELECT ack_seq FROM fluxos_envio WHERE gerador_id = ? AND id_fluxo = ?", (gerador_id, id_fluxo)
+        ).fetchone()[0]
+        ack = max(ack, (seq_min or 1) - 1)
+        for (seq,) in self.conn.execute(
+            "SELECT seq FROM leituras_tempo_real WHERE gerador_id = ? AND id_fluxo = ? AND seq > ? ORDER BY seq",
+            (gerador_id, id_fluxo, ack),
+        ):
+            if seq != ack + 1:
+                break
+            ack = seq
+        self.conn.execute(
+            "UPDATE fluxos_envio SET ack_seq = ? WHERE gerador_id = ? AND id_fluxo = ?", (ack, gerador_id, id_fluxo)
+        )
+        return ack
+
+    def inserir_leitura(self, gerador_id: str, leitura: Dict[str, Any]) -> Optional[str]:
+        """Insert em leituras_tempo_real; None se (id_fluxo, seq) já estava gravado"""
+        leitura_id = novo_id()
+        valores = [leitura.get(coluna) for coluna in COLUNAS_LEITURA]
+        valores[-1] = bool(leitura.get("leitura_parcial", False))
+        cursor = self.conn.execute(
+            f"INSERT OR IGNORE INTO leituras_tempo_real (id, gerador_id, {', '.join(COLUNAS_LEITURA)})"
+            f" VALUES (?, ?, {', '.join('?' * len(COLUNAS_LEITURA))})",
+            (leitura_id, gerador_id, *valores),
+        )
+        return leitura_id if cursor.rowcount else None
+
+    def gerar_alertas(self, gerador_id: str, leitura_id: str, corpo: Dict[str, Any]):
+        """Alertas por parametros_alerta e bits de status, como a edge function"""
+        alertas = []
+        for param in self.parametros(gerador_id):
+            valor = corpo.get(MAPA_PARAMETROS.get(param["parametro"], ""))
+            if valor is None:
+                continue
+            if param["valor_minimo"] is not None and valor < param["valor_minimo"]:
+                alertas.append((param["nivel"], f"{param['parametro']} abaixo do limite: {valor} (mínimo: {param['valor_minimo']})"))
+            elif param["valor_maximo"] is not None and valor > param["valor_maximo"]:
+                alertas.append((param["nivel"], f"{param['parametro']} acima do limite: {valor} (máximo: {param['valor_maximo']})"))
+        if corpo.get("aviso_ativo"):
+            alertas.append(("warning", "Aviso ativo no controlador K30XL"))
+        if corpo.get("falha_ativa"):
+            alertas.append(("critical", "Falha ativa no controlador K30XL"))
+        self.conn.executemany(
+            "INSERT INTO alertas (id, gerador_id, leitura_id, nivel, mensagem, origem) VALUES (?, ?, ?, ?, ?, 'rule')",
+            [(novo_id(), gerador_id, leitura_id, nivel, mensagem) for nivel, mensagem in alertas],
+        )
+
+    def contagens(self) -> Dict[str, int]:
+        tabelas = ("geradores", "equipamentos_hf", "leituras_tempo_real", "alertas", "leituras_agregadas")
+        with self.lock:
+            return {
+                tabela: self.conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+                for tabela in tabelas
+            }
+
+
+class EstatisticasServidor:
+    """Tempo de processamento e concorrência observados pelo servidor local"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.em_andamento = 0
+        self.max_em_andamento = 0
+        self.processamento_ms: list = []
+        self.respostas: Dict[int, int] = {}
+        self.bytes_recebidos = 0
+        self.duplicadas = 0  # leituras reenviadas que já estavam no banco
+
+    def entrou(self):
+        with self.lock:
+            self.em_andamento += 1
+            self.max_em_andamento = max(self.max_em_andamento, self.em_andamento)
+
+    def duplicada(self, quantidade: int = 1):
+        with self.lock:
+            self.duplicadas += quantidade
+
+    def saiu(self, status: int, duracao_ms: float, tamanho: int = 0):
+        with self.lock:
+            self.em_andamento -= 1
+            self.bytes_recebidos += tamanho
+            self.processamento_ms.append(duracao_ms)
+            self.respostas[status] = self.respostas.get(status, 0) + 1
+
+    def resumo(self) -> Dict[str, Any]:
+        with self.lock:
+            latencias = list(self.processamento_ms)
+            respostas = dict(self.respostas)
+            maximo = self.max_em_andamento
+            recebidos = self.bytes_recebidos
+            duplicadas = self.duplicadas
+        return {
+            "processamento": resumo_latencias(latencias),
+            "respostas": respostas,
+            "max_requisicoes_simultaneas": maximo,
+            "bytes_recebidos": recebidos,
+            "bytes_por_requisicao": round(recebidos / len(latencias), 1) if latencias else 0,
+            "leituras_duplicadas": duplicadas,
+        }
+
+
+class ReceptorHandler(BaseHTTPRequestHandler):
+    """Contrato HTTP da supabase/functions/modbus-receiver"""
+
+    banco: BancoLocal = None
+    estatisticas: EstatisticasServidor = None
+    latencia_ms = 0.0
+    taxa_erro = 0.0
+    taxa_perda_resposta = 0.0
+
+    def _responder(self, status: int, corpo: Dict[str, Any]):
+        dados = json.dumps(corpo, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _simular_rede(self) -> bool:
+        """RTT e falhas da edge function real. False se deve responder 500."""
+        if self.latencia_ms:
+            time.sleep(random.expovariate(1.0 / self.latencia_ms) / 1000)
+        return random.random() >= self.taxa_erro
+
+    def do_POST(self):
+        inicio = time.monotonic()
+        self.estatisticas.entrou()
+        status = 500
+        tamanho = 0
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            bruto = self.rfile.read(tamanho)
+            tipo = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+            if tipo in TIPOS_MSGPACK:
+                leitor = leitor_compartilhado()
+                if leitor.msgpack is None:
+                    status = 415
+                    self._responder(415, {"error": "MessagePack indisponível (pip install msgpack)"})
+                    return
+                corpo = leitor.decodificar_compacto(bruto, self.headers.get("Content-Encoding") == "gzip")
+                for item in [corpo, *corpo.get("leituras", [])]:
+                    if isinstance(item.get("capturado_em"), (int, float)):
+                        item["capturado_em"] = leitor.iso_utc(item["capturado_em"])
+            elif tipo and tipo != "application/json":
+                status = 415
+                self._responder(415, {"error": f"Unsupported Content-Type: {tipo}"})
+                return
+            else:
+                corpo = json.loads(bruto or b"{}")
+            if not self._simular_rede():
+                self._responder(500, {"error": "Erro simulado (--taxa-erro)"})
+                return
+            status, resposta = self.processar_post(corpo)
+            if status == 200 and random.random() < self.taxa_perda_resposta:
+                # Gravou, mas a resposta não chega ao leitor
+                status, resposta = 504, {"error": "Resposta perdida simulada (--taxa-perda-resposta)"}
+            self._responder(status, resposta)
+        except ValueError:
+            status = 400
+            self._responder(400, {"error": "Corpo inválido"})
+        finally:
+            self.estatisticas.saiu(status, (time.monotonic() - inicio) * 1000, tamanho)
+
+    def processar_post(self, corpo: Dict[str, Any]):
+        porta_vps = corpo.get("porta_vps")
+        if not porta_vps:
+            return 400, {"error": "porta_vps is required to identify the generator"}
+
+        banco = self.banco
+        with banco.lock, banco.conn:
+            gerador_id = banco.gerador_por_porta(porta_vps) or banco.cadastrar(porta_vps)
+            banco.conn.execute(
+                "UPDATE equipamentos_hf SET status = 'online', updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+                " WHERE porta_vps = ?",
+                (porta_vps,),
+            )
+
+            if corpo.get("tipo") == "alertas":
+                alertas = corpo.get("alertas") or []
+                banco.conn.executemany(
+                    "INSERT OR IGNORE INTO alertas (id, gerador_id, nivel, mensagem, origem, chave_envio)"
+                    " VALUES (?, ?, ?, ?, 'rule', ?)",
+                    [(novo_id(), gerador_id, a.get("nivel"), a.get("mensagem"), a.get("chave")) for a in alertas],
+                )
+                return 200, {"success": True, "gerador_id": gerador_id, "alerts": len(alertas)}
+
+            if corpo.get("tipo") == "rollups":
+                rollups = corpo.get("rollups") or []
+                banco.conn.executemany(
+                    "INSERT INTO leituras_agregadas (id, gerador_id, janela, inicio, fim, amostras, estatisticas)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (gerador_id, janela, inicio) DO UPDATE SET"
+                    " fim = excluded.fim, amostras = excluded.amostras, estatisticas = excluded.estatisticas",
+                    [
+                        (novo_id(), gerador_id, r.get("janela"), r.get("inicio"), r.get("fim"),
+                         r.get("amostras"), json.dumps(r.get("estatisticas")))
+                        for r in rollups
+                    ],
+                )
+                return 200, {"success": True, "gerador_id": gerador_id, "rollups": len(rollups)}
+
+            if corpo.get("tipo") == "leituras":
+                leituras = corpo.get("leituras") or []
+                id_fluxo = corpo.get("id_fluxo")
+                if not id_fluxo or not leituras or any(not isinstance(l.get("seq"), int) for l in leituras):
+                    return 400, {"error": "id_fluxo and seq are required in reading batches"}
+                inseridas = 0
+                for leitura in leituras:
+                    leitura = {**leitura, "id_fluxo": id_fluxo}
+                    leitura_id = banco.inserir_leitura(gerador_id, leitura)
+                    if leitura_id is None:
+                        continue
+                    inseridas += 1
+                    if not leitura.get("alertas_avaliados_na_vps"):
+                        banco.gerar_alertas(gerador_id, leitura_id, leitura)
+                seq_min = corpo.get("seq_min") or min(l["seq"] for l in leituras)
+                ack_seq = banco.avancar_ack(gerador_id, id_fluxo, seq_min)
+                duplicadas = len(leituras) - inseridas
+                if duplicadas:
+                    self.estatisticas.duplicada(duplicadas)
+                return 200, {"success": True, "gerador_id": gerador_id, "leituras": inseridas,
+                             "duplicadas": duplicadas, "ack_seq": ack_seq}
+
+            leitura_id = banco.inserir_leitura(gerador_id, corpo)
+            idempotente = isinstance(corpo.get("seq"), int) and corpo.get("id_fluxo")
+            ack_seq = banco.avancar_ack(gerador_id, corpo["id_fluxo"], corpo.get("seq_min")) if idempotente else None
+            if leitura_id is None:
+                self.estatisticas.duplicada()
+                return 200, {"success": True, "gerador_id": gerador_id, "reading_id": None,
+                             "duplicada": True, "ack_seq": ack_seq}
+
+            if not corpo.get("alertas_avaliados_na_vps"):
+                banco.gerar_alertas(gerador_id, leitura_id, corpo)
+
+        return 200, {
+            "success": True,
+            "gerador_id": gerador_id,
+            "reading_id": leitura_id,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "ack_seq": ack_seq,
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == "/_estatisticas":
+            self._responder(200, {**self.estatisticas.resumo(), "tabelas": self.banco.contagens()})
+            return
+
+        porta_vps = params.get("porta_vps", [None])[0]
+        if not porta_vps:
+            self._responder(400, {"error": "porta_vps or gerador_id is required"})
+            return
+        if not self._simular_rede():
+            self._responder(500, {"error": "Erro simulado (--taxa-erro)"})
+            return
+
+        with self.banco.lock:
+            gerador_id = self.banco.gerador_por_porta(porta_vps)
+            if gerador_id is None:
+                self._responder(404, {"error": f"No generator found for VPS port {porta_vps}"})
+                return
+            if params.get("recurso", [None])[0] == "parametros_alerta":
+                self._responder(200, {"gerador_id": gerador_id, "parametros": self.banco.parametros(gerador_id)})
+                return
+            linha = self.banco.conn.execute(
+                "SELECT * FROM leituras_tempo_real WHERE gerador_id = ? ORDER BY created_at DESC LIMIT 1",
+                (gerador_id,),
+            )
+            colunas = [c[0] for c in linha.description]
+            ultima = linha.fetchone()
+        self._responder(200, {"success": True, "data": dict(zip(colunas, ultima)) if ultima else None})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServidorReceptor(ThreadingHTTPServer):
+    daemon_threads = True
+    # Backlog padrão (5) descarta SYN nas rajadas e soma 1 s de retransmissão
+    request_queue_size = 256
+
+
+def iniciar_servidor(porta: int, banco: str, latencia_ms: float = 0.0, taxa_erro: float = 0.0,
+                     taxa_perda_resposta: float = 0.0) -> ThreadingHTTPServer:
+    ReceptorHandler.banco = BancoLocal(banco)
+    ReceptorHandler.estatisticas = EstatisticasServidor()
+    ReceptorHandler.latencia_ms = latencia_ms
+    ReceptorHandler.taxa_erro = taxa_erro
+    ReceptorHandler.taxa_perda_resposta = taxa_perda_resposta
+    servidor = ServidorReceptor(("127.0.0.1", porta), ReceptorHandler)
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="Receptor").start()
+    logger.info(f"Edge function local em http://127.0.0.1:{porta} (banco {banco}, "
+                f"latência {latencia_ms} ms, erro {taxa_erro:.0%}, resposta perdida {taxa_perda_resposta:.0%})")
+    return servidor
+
+
+# =============================================================================
+# BROKER MQTT LOCAL (stand-in para o sink mqtt do leitor)
+# =============================================================================
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    """
+    Subconjunto do MQTT 3.1.1 usado pelo sink do leitor: CONNECT/CONNACK,
+    PUBLISH (QoS 0 e 1, com PUBACK), PINGREQ/PINGRESP e DISCONNECT.
+    Não repassa mensagens: só conta por tópico e guarda a última.
+    """
+
+    atraso_ms = 0.0
+    lock = threading.Lock()
+    mensagens: Dict[str, int] = {}
+    ultimas: Dict[str, bytes] = {}
+    conexoes = 0
+
+    def _receber(self, tamanho: int) -> bytes:
+        dados = bytearray()
+        while len(dados) < tamanho:
+            chunk = self.request.recv(tamanho - len(dados))
+            if not chunk:
+                raise ConnectionError
+            dados.extend(chunk)
+        return bytes(dados)
+
+    def handle(self):
+        with self.lock:
+            BrokerHandler.conexoes += 1
+        try:
+            while True:
+                primeiro = self._receber(1)[0]
+                tamanho, multiplicador = 0, 1
+                while True:
+                    byte = self._receber(1)[0]
+                    tamanho += (byte & 0x7F) * multiplicador
+                    multiplicador *= 128
+                    if not byte & 0x80:
+                        break
+                corpo = self._receber(tamanho)
+                tipo, flags = primeiro >> 4, primeiro & 0x0F
+
+                if tipo == 1:  # CONNECT
+                    self.request.sendall(bytes([0x20, 2, 0, 0]))
+                elif tipo == 3:  # PUBLISH
+                    qos = (flags >> 1) & 0x03
+                    tamanho_topico = struct.unpack(">H", corpo[:2])[0]
+                    topico = corpo[2:2 + tamanho_topico].decode()
+                    posicao = 2 + tamanho_topico
+                    if qos:
+                        id_pacote = corpo[posicao:posicao + 2]
+                        posicao += 2
+                    with self.lock:
+                        self.mensagens[topico] = self.mensagens.get(topico, 0) + 1
+                        self.ultimas[topico] = corpo[posicao:]
+                    if self.atraso_ms:
+                        time.sleep(self.atraso_ms / 1000)
+                    if qos:
+                        self.request.sendall(bytes([0x40, 2]) + id_pacote)
+                elif tipo == 12:  # PINGREQ
+                    self.request.sendall(bytes([0xD0, 0]))
+                elif tipo == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    @classmethod
+    def resumo(cls) -> Dict[str, Any]:
+        with cls.lock:
+            return {
+                "conexoes": cls.conexoes,
+                "mensagens": sum(cls.mensagens.values()),
+                "por_topico": dict(cls.mensagens),
+            }
+
+
+class ServidorBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def iniciar_broker(porta: int, atraso_ms: float = 0.0) -> ServidorBroker:
+    BrokerHandler.atraso_ms = atraso_ms
+    servidor = ServidorBroker(("127.0.0.1", porta), BrokerHandler)
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="Broker").start()
+    logger.info(f"Broker MQTT local em 127.0.0.1:{porta} (atraso {atraso_ms} ms por mensagem)")
+    return servidor
+
+
+# =============================================================================
+# GERADOR DE CARGA
+# =============================================================================
+
+def carregar_leitor():
+    """Importa o vps-modbus-reader.py ao lado deste arquivo"""
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vps-modbus-reader.py")
+    spec = importlib.util.spec_from_file_location("vps_modbus_reader", caminho)
+    leitor = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(leitor)
+    return leitor
+
+
+_leitor = None
+_leitor_lock = threading.Lock()
+
+
+def leitor_compartilhado():
+    """Leitor carregado uma vez pelo servidor (decodificador do formato compacto)"""
+    global _leitor
+    with _leitor_lock:
+        if _leitor is None:
+            _leitor = carregar_leitor()
+        return _leitor
+
+
+def fase_da_carga(forma: str, decorrido: float, duracao: float) -> str:
+    """'normal', 'sem_rede' ou 'offline' conforme a forma e o instante"""
+    terco = int(decorrido * 3 // duracao)
+    if forma == "queda_rede" and terco == 1:
+        return "sem_rede"
+    if forma == "rajada_reconexao" and terco == 1:
+        return "offline"
+    return "normal"
+
+
+def leitura_sintetica(leitor, estado: Dict[str, Any], fase: str, desde_queda: float):
+    """Leitura plausível do K30XL para a fase atual"""
+    leitura = leitor.Leitura()
+    ruido = random.uniform
+    if fase == "sem_rede":
+        # Partida do GMG: tensão e frequência sobem nos primeiros segundos
+        rampa = min(desde_queda / 8.0, 1.0)
+        for campo in ("tensao_rede_rs", "tensao_rede_st", "tensao_rede_tr"):
+            leitura[campo] = 0.0
+        leitura["tensao_gmg"] = round(220 * rampa + ruido(-2, 2), 1)
+        leitura["frequencia_gmg"] = round(60 * rampa + ruido(-0.2, 0.2), 2)
+        leitura["rpm_motor"] = int(1800 * rampa)
+        leitura["corrente_fase1"] = round(80 * rampa + ruido(-3, 3), 1)
+        leitura["temperatura_agua"] = round(75 + 10 * rampa + ruido(-1, 1), 1)
+    else:
+        for campo in ("tensao_rede_rs", "tensao_rede_st", "tensao_rede_tr"):
+            leitura[campo] = round(218 + ruido(-3, 3), 1)
+        leitura["tensao_gmg"] = 0.0
+        leitura["frequencia_gmg"] = 0.0
+        leitura["rpm_motor"] = 0
+        leitura["corrente_fase1"] = 0.0
+        leitura["temperatura_agua"] = round(30 + ruido(-1, 1), 1)
+    leitura["tensao_bateria"] = round(12.8 + ruido(-0.2, 0.2), 1)
+    leitura["nivel_combustivel"] = estado["combustivel"]
+    leitura["numero_partidas"] = estado["partidas"]
+    leitura["horimetro_horas"] = estado["horimetro"]
+    leitura["horimetro_minutos"] = 0
+    leitura["horimetro_segundos"] = 0
+    leitura["horas_trabalhadas"] = float(estado["horimetro"])
+    leitura["rede_ok"] = fase != "sem_rede"
+    leitura["motor_funcionando"] = fase == "sem_rede"
+    leitura["gmg_alimentando"] = fase == "sem_rede"
+    leitura["aviso_ativo"] = False
+    leitura["falha_ativa"] = False
+    leitura.capturado_em = time.time()
+    return leitura
+
+
+class ResultadoCarga:
+    """Latências e contadores agregados de todos os geradores simulados"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias: Dict[str, list] = {"normal": [], "sem_rede": [], "reconexao": []}
+        self.contadores: Dict[str, int] = {}
+        self.atrasos_ms: list = []
+        self.max_rollups_pendentes = 0
+
+    def registrar(self, fase: str, latencia_ms: float, ok: bool, atraso_ms: float, pendentes: int):
+        with self.lock:
+            self.latencias[fase].append(latencia_ms)
+            chave = "enviadas" if ok else "falhas"
+            self.contadores[chave] = self.contadores.get(chave, 0) + 1
+            self.atrasos_ms.append(atraso_ms)
+            self.max_rollups_pendentes = max(self.max_rollups_pendentes, pendentes)
+
+    def contar(self, nome: str, valor: int = 1):
+        with self.lock:
+            self.contadores[nome] = self.contadores.get(nome, 0) + valor
+
+
+def gerador_simulado(leitor, indice: int, args, inicio: float, resultado: ResultadoCarga):
+    """Um worker_gerador sem Modbus: leitura sintética → alertas → envio → rollups"""
+    porta_vps = str(PORTA_VPS_INICIAL + indice)
+    avaliador = leitor.AvaliadorAlertas(porta_vps)
+    agregador = leitor.AgregadorRollup(porta_vps)
+    estado = {"combustivel": random.randint(40, 95), "partidas": random.randint(100, 900),
+              "horimetro": random.randint(100, 9000)}
+    fase_anterior = "normal"
+    inicio_queda = 0.0
+    reconectou = False
+
+    # Fase inicial aleatória: em regime os pollings não estão alinhados
+    proximo = inicio + random.uniform(0, args.intervalo)
+    fim = inicio + args.duracao
+
+    while True:
+        agora = time.monotonic()
+        if proximo > agora:
+            time.sleep(proximo - agora)
+        agora = time.monotonic()
+        if agora >= fim:
+            return
+
+        fase = fase_da_carga(args.forma, agora - inicio, args.duracao)
+        if fase == "offline":
+            # Link caído: volta com todos os geradores alinhados no mesmo instante
+            resultado.contar("ciclos_offline")
+            reconectou = True
+            proximo = inicio + 2 * args.duracao / 3
+            continue
+        if fase == "sem_rede" and fase_anterior != "sem_rede":
+            inicio_queda = agora
+            estado["partidas"] += 1
+        fase_anterior = fase
+
+        atraso_ms = (agora - proximo) * 1000
+        dados = leitura_sintetica(leitor, estado, fase, agora - inicio_queda)
+        alertas_avaliados = leitor.AVALIAR_ALERTAS_NA_VPS and leitor.processar_alertas(avaliador, dados)
+
+        envio = time.monotonic()
+        ok = leitor.enviar_leitura(porta_vps, dados, alertas_avaliados)
+        for _ in range(args.tentativas - 1):
+            if ok:
+                break
+            # Mesma leitura (mesmo seq): se a 1ª chegou ao banco, volta como duplicada
+            resultado.contar("reenvios")
+            ok = leitor.enviar_leitura(porta_vps, dados, alertas_avaliados)
+        latencia_ms = (time.monotonic() - envio) * 1000
+
+        leitor.processar_rollups(agregador, dados)
+        fase_relatorio = "reconexao" if reconectou and fase == "normal" else fase
+        resultado.registrar(fase_relatorio, latencia_ms, ok, atraso_ms, len(agregador.pendentes))
+        reconectou = reconectou and time.monotonic() - (inicio + 2 * args.duracao / 3) < 2 * args.intervalo
+
+        # Próximo ciclo no relógio absoluto; ciclos perdidos contam como atraso
+        proximo += args.intervalo
+        perdidos = 0
+        while proximo < time.monotonic():
+            proximo += args.intervalo
+            perdidos += 1
+        if perdidos:
+            resultado.contar("ciclos_perdidos", perdidos)
+
+
+def executar_carga(args) -> Dict[str, Any]:
+    leitor = carregar_leitor()
+    leitor.EDGE_FUNCTION_URL = args.url
+    leitor.TRACE_HABILITADO = False
+    leitor.ENVIAR_ROLLUPS = True
+    leitor.JANELAS_ROLLUP = {"1m": 60}
+    leitor.FORMATO_ENVIO = args.formato
+    if not args.verboso:
+        logging.getLogger().setLevel(logging.ERROR)
+
+    ofertadas = args.geradores * args.duracao / args.intervalo
+    print(f"Carga '{args.forma}': {args.geradores} geradores a cada {args.intervalo}s "
+                   f"por {args.duracao}s (~{ofertadas:.0f} leituras) → {args.url}")
+
+    resultado = ResultadoCarga()
+    inicio = time.monotonic() + 0.5
+    threads = [
+        threading.Thread(target=gerador_simulado, args=(leitor, i, args, inicio, resultado), daemon=True)
+        for i in range(args.geradores)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.monotonic() - inicio
+
+    todas = [l for lista in resultado.latencias.values() for l in lista]
+    relatorio = {
+        "forma": args.forma,
+        "formato": "msgpack" if leitor.formato_compacto_ativo() else "json",
+        "geradores": args.geradores,
+        "intervalo_s": args.intervalo,
+        "duracao_s": round(duracao, 1),
+        "leituras_ofertadas": int(ofertadas),
+        **resultado.contadores,
+        "throughput_leituras_s": round(resultado.contadores.get("enviadas", 0) / duracao, 1),
+        "latencia_envio": resumo_latencias(todas),
+        "latencia_por_fase": {
+            fase: resumo_latencias(lista) for fase, lista in resultado.latencias.items() if lista
+        },
+        "atraso_inicio_ciclo": resumo_latencias(resultado.atrasos_ms),
+        "max_rollups_pendentes": resultado.max_rollups_pendentes,
+    }
+    try:
+        resposta = leitor.requests.get(args.url.rstrip("/") + "/_estatisticas", timeout=5)
+        if resposta.status_code == 200:
+            relatorio["servidor"] = resposta.json()
+    except leitor.requests.RequestException:
+        pass  # edge function real não tem /_estatisticas
+    return relatorio
+
+
+def imprimir_relatorio(relatorio: Dict[str, Any]):
+    def linha(nome: str, lat: Dict[str, Any]):
+        if not lat.get("amostras"):
+            return
+        print(f"  {nome:<22} n={lat['amostras']:<6} p50={lat['p50_ms']:.1f}  p95={lat['p95_ms']:.1f}  "
+              f"p99={lat['p99_ms']:.1f}  max={lat['max_ms']:.1f} ms")
+
+    print("=" * 70)
+    print(f"RELATÓRIO DE CARGA - forma '{relatorio['forma']}' ({relatorio['formato']})")
+    print("=" * 70)
+    print(f"  Geradores: {relatorio['geradores']}  intervalo: {relatorio['intervalo_s']}s  "
+          f"duração: {relatorio['duracao_s']}s")
+    print(f"  Ofertadas: {relatorio['leituras_ofertadas']}  enviadas: {relatorio.get('enviadas', 0)}  "
+          f"falhas: {relatorio.get('falhas', 0)}  ciclos perdidos: {relatorio.get('ciclos_perdidos', 0)}  "
+          f"offline: {relatorio.get('ciclos_offline', 0)}")
+    print(f"  Throughput: {relatorio['throughput_leituras_s']} leituras/s")
+    print("Latência do envio (leitor → edge function):")
+    linha("todas", relatorio["latencia_envio"])
+    for fase, lat in relatorio["latencia_por_fase"].items():
+        linha(fase, lat)
+    print("Fila:")
+    linha("atraso início do ciclo", relatorio["atraso_inicio_ciclo"])
+    print(f"  Máx. rollups pendentes por gerador: {relatorio['max_rollups_pendentes']}")
+    servidor = relatorio.get("servidor")
+    if servidor:
+        print("Servidor local:")
+        linha("processamento", servidor["processamento"])
+        print(f"  Requisições simultâneas (máx): {servidor['max_requisicoes_simultaneas']}  "
+              f"respostas: {servidor['respostas']}")
+        print(f"  Bytes recebidos: {servidor['bytes_recebidos']}  "
+              f"({servidor['bytes_por_requisicao']} por requisição)")
+        print(f"  Reenvios: {relatorio.get('reenvios', 0)}  "
+              f"duplicadas ignoradas: {servidor.get('leituras_duplicadas', 0)}")
+        print(f"  Tabelas: {servidor['tabelas']}")
+    print("=" * 70)
+
+
+# =============================================================================
+# ENTRY POINT
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga de ingestão e edge function local")
+    sub = parser.add_subparsers(dest="modo", required=True)
+
+    def opcoes_servidor(p):
+        p.add_argument("--porta", type=int, default=PORTA_SERVIDOR)
+        p.add_argument("--banco", default=BANCO_PADRAO)
+        p.add_argument("--latencia-ms", type=float, default=0.0, help="RTT médio simulado (exponencial)")
+        p.add_argument("--taxa-erro", type=float, default=0.0, help="Fração de respostas 500")
+        p.add_argument("--taxa-perda-resposta", type=float, default=0.0,
+                       help="Fração de requisições gravadas mas respondidas com 504")
+
+    def opcoes_carga(p):
+        p.add_argument("--geradores", type=int, default=GERADORES_PADRAO)
+        p.add_argument("--intervalo", type=float, default=INTERVALO_PADRAO)
+        p.add_argument("--duracao", type=float, default=DURACAO_PADRAO)
+        p.add_argument("--forma", choices=("estavel", "queda_rede", "rajada_reconexao"), default="estavel")
+        p.add_argument("--json", help="Grava o relatório neste arquivo")
+        p.add_argument("--formato", choices=("json", "msgpack"), default="json", help="Formato do envio")
+        p.add_argument("--verboso", action="store_true", help="Mantém os logs INFO do leitor")
+        p.add_argument("--tentativas", type=int, default=1, help="Envios da mesma leitura até dar certo")
+
+    opcoes_servidor(sub.add_parser("servidor", help="Só a edge function local"))
+    broker = sub.add_parser("broker", help="Broker MQTT local para o sink mqtt do leitor")
+    broker.add_argument("--porta", type=int, default=PORTA_BROKER)
+    broker.add_argument("--atraso-ms", type=float, default=0.0, help="Atraso por mensagem (broker lento)")
+    carga = sub.add_parser("carga", help="Só a carga, contra uma URL")
+    carga.add_argument("--url", default=f"http://127.0.0.1:{PORTA_SERVIDOR}")
+    opcoes_carga(carga)
+    tudo = sub.add_parser("tudo", help="Servidor local + carga no mesmo processo")
+    opcoes_servidor(tudo)
+    opcoes_carga(tudo)
+    args = parser.parse_args()
+
+    if args.modo == "broker":
+        iniciar_broker(args.porta, args.atraso_ms)
+        try:
+            while True:
+                time.sleep(5)
+                logger.info(f"Broker: {BrokerHandler.resumo()}")
+        except KeyboardInterrupt:
+            return
+
+    if args.modo in ("servidor", "tudo"):
+        iniciar_servidor(args.porta, args.banco, args.latencia_ms, args.taxa_erro, args.taxa_perda_resposta)
+        if args.modo == "servidor":
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                return
+        args.url = f"http://127.0.0.1:{args.porta}"
+
+    relatorio = executar_carga(args)
+    imprimir_relatorio(relatorio)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
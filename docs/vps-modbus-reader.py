@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Script VPS - Leitor Modbus K30XL (Modo Ativo) v2.5.0
+Script VPS - Leitor Modbus K30XL (Modo Ativo) v2.29.0
 =====================================================
 
 Este script roda na VPS (82.25.70.90) em MODO ATIVO:
@@ -24,6 +24,72 @@ CORREÇÃO v2.5.0: Horímetro correto em 0x000B
 - Novo payload: horimetro_horas, horimetro_minutos (0), horimetro_segundos (0)
 
 HISTÓRICO:
+- v2.29.0: Envio idempotente: cada leitura leva (id_fluxo, seq) e o
+           backend ignora reenvios e devolve ack_seq (maior seq contíguo);
+           o sink http só tira da fila o que foi confirmado e repete sem
+           limite; lotes opcionais (GMG_ENVIO_LOTE); chave nos alertas
+- v2.28.0: Estado do processo salvo a cada 30 s e no SIGTERM (filas dos
+           sinks, rollups, filtros, alertas, fases) e restaurado na
+           partida; 1º ciclo de cada conexão sem esperar o slot e tempo
+           até o primeiro upload em GET /metricas ("partida")
+- v2.27.0: Descoberta do endereço do escravo quando o configurado não
+           responde após a conexão (ordem por probabilidade, timeout
+           adaptativo) com cache por porta em dados/enderecos-escravo.json
+- v2.26.0: Exportação da série local para CSV ou Parquet (--exportar),
+           em lotes de colunas com memória constante e reamostragem
+           opcional por janela (média/min/max)
+- v2.25.0: Série temporal local comprimida por gerador (sink "serie"):
+           arquivos por hora só com append, delta-of-delta nos instantes e
+           XOR nos valores, leitura por intervalo e retenção em dias
+- v2.24.0: Uso do link serial por gerador (bytes no fio, tempo de
+           caractere a 19200 baud, turnaround medido) em GET /metricas e
+           planejador offline de capacidade (--planejar)
+- v2.23.0: Cache de registradores alimentado por toda resposta de leitura
+           (GET /registradores com idade_max); faltas viram uma leitura na
+           fila do link, compartilhada por consultas simultâneas da mesma faixa
+- v2.22.0: Snapshot da última leitura de cada gerador em arquivo mapeado
+           em memória (/dev/shm), layout fixo com seqlock por slot, para
+           IHM, relés e scripts locais lerem sem HTTP (--ler-snapshot)
+- v2.21.0: Sinks de saída plugáveis (GMG_SINKS=http,arquivo,mqtt): o
+           upload sai da thread de polling; cada sink tem fila, lote e
+           retentativas próprios, então um destino lento não atrasa os outros
+- v2.20.0: Diagnóstico no link em produção (POST /diagnostico): leituras
+           FC03/FC04 e sondagem de escravos intercaladas com o polling,
+           limitadas a uma fração do tempo do barramento
+- v2.19.0: Formato compacto opcional de envio (GMG_FORMATO_ENVIO=msgpack):
+           MessagePack com IDs de campo, lotes com gzip, volta para JSON se a
+           edge function responder 415
+- v2.18.0: Watchdog com prazo por ciclo (aborta o link de worker travado e
+           recria thread morta); /health por gerador pela idade da última
+           leitura ok, com 503 quando algum gerador não está saudável
+- v2.17.0: Agendador central de polling com prazos absolutos (sem deriva)
+           e fases espalhadas entre os geradores; slots estourados são
+           pulados e contados
+- v2.16.0: Filtro de plausibilidade antes de alertas e upload (faixa, taxa
+           de variação, contadores monotônicos, mediana de 3); valores
+           suspeitos ficam em quarentena (GET /quarentena)
+- v2.15.0: Sink opcional direto no Postgres (INSERT em lote, pool de
+           conexões, cache porta_vps → gerador_id)
+- v2.14.0: Stream ao vivo das leituras (GET /stream, Server-Sent Events)
+           com fan-out que não bloqueia os workers
+- v2.13.0: Comandos de escrita (FC06/FC16) via POST /comandos, com fila de
+           prioridade por link que preempta o polling, prazo, leitura de
+           volta e log de auditoria
+- v2.12.0: Erros Modbus classificados (timeout, CRC, framing, exceção,
+           conexão fechada) com retry por classe, leitura parcial quando
+           um bloco falha e reconexão só com o link morto; GET /metricas
+- v2.11.0: Transporte Modbus TCP (MBAP) por gerador, com transações em
+           pipeline casadas por transaction ID
+- v2.10.0: Leitura compacta (__slots__ + array), ConexaoHF enxuta e
+           orçamento de memória verificado com --benchmark-memoria
+- v2.9.0: Profiling sob demanda na Health API (CPU por amostragem de todas
+          as threads e diff de memória via tracemalloc)
+- v2.8.0: Tracing por ciclo (etapas com tempo monotônico, amostragem e
+          arquivo rotativo) e capturado_em enviado com cada leitura
+- v2.7.0: Rollups por minuto/hora (min/max/média/último/amostras) enviados
+          separadamente das leituras brutas
+- v2.6.0: Alertas avaliados na VPS com parametros_alerta em cache (TTL),
+          histerese e dedupe; alertas enviados imediatamente
 - v2.4.1: Corrige race condition no scan
 - v2.4.0: Scan extendido para descoberta
 - v2.3.0: Mapeamento partidas corrigido
@@ -31,26 +97,78 @@ HISTÓRICO:
 
 Requisitos:
     pip install requests
+    pip install psycopg2-binary   # opcional, sink Postgres direto (v2.15.0)
+    pip install msgpack           # opcional, GMG_FORMATO_ENVIO=msgpack (v2.19.0)
+    pip install pyarrow           # opcional, --exportar para Parquet (v2.26.0)
 
 Uso:
     python vps-modbus-reader.py          # Modo produção (envia para backend)
     python vps-modbus-reader.py --debug  # Modo debug (NÃO envia para backend)
     python vps-modbus-reader.py --teste  # Enviar dados simulados
     python vps-modbus-reader.py --scan   # Scan EXTENDIDO 0x0000-0x003F (64 regs)
+    python vps-modbus-reader.py --benchmark-memoria  # Verifica orçamento de memória
+    python vps-modbus-reader.py --teste-postgres     # Sink Postgres (GMG_POSTGRES_DSN)
+    python vps-modbus-reader.py --teste-sinks        # Sinks arquivo/mqtt de GMG_SINKS
+    python vps-modbus-reader.py --ler-snapshot [porta]  # Snapshot em memória (outro processo)
+    python vps-modbus-reader.py --teste-serie        # Série temporal local (bytes/leitura)
+    python vps-modbus-reader.py --exportar saida.parquet 15001,15002 2026-10-01 2026-10-08 [passo_s]
+    python vps-modbus-reader.py --planejar [plano.json]  # Capacidade do link serial (offline)
+    python vps-modbus-reader.py --reenviar-dead-letter [15001,15002]  # Leituras recusadas pelo backend
 
 Autor: Sistema de Monitoramento GMG
 Baseado no Manual STEMAC K30XL versão 1.0 a 3.01
 """
 
+import os
+import sys
 import time
 import json
+import math
+import gzip
+import heapq
+import random
 import socket
+import struct
+import csv
+import mmap
+import shutil
+import tempfile
 import logging
+import logging.handlers
+import signal
 import threading
+import contextlib
+import hmac
+import tracemalloc
+from array import array
 import requests
-from typing import Dict, Any, Optional
+from collections import Counter, deque
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
 
+# Opcional (v2.15.0): sink direto no Postgres
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+# Opcional (v2.19.0): formato compacto de envio
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Opcional (v2.26.0): exportação da série local em Parquet
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # Configuração de logging
 logging.basicConfig(
     level=logging.INFO,
@@ -62,9 +180,16 @@ logger = logging.getLogger(__name__)
 # CONFIGURAÇÕES
 # =============================================================================
 
+# Versão do leitor (reportada no log e na Health API)
+VERSAO = "2.29.0"
+
 # URL da Edge Function
 EDGE_FUNCTION_URL = "https://hwloajvxjsysutqfqpal.supabase.co/functions/v1/modbus-receiver"
 
+# NOVO v2.19.0: Formato do corpo enviado à edge function: "json" ou "msgpack"
+# (IDs inteiros no lugar das chaves; lotes com gzip). Requer pip install msgpack.
+FORMATO_ENVIO = os.environ.get("GMG_FORMATO_ENVIO", "json")
+
 # Modo debug: não envia para backend, só mostra logs
 MODO_DEBUG = False
 
@@ -76,6 +201,11 @@ VPS_IP = "0.0.0.0"  # Escuta em todas as interfaces
 
 # Configurações dos geradores - MODO ATIVO
 # A VPS escuta nessas portas e os HF2211 conectam como TCP Clients
+#
+# NOVO v2.11.0: "transporte" por gerador
+#   "rtu" - HF2211 em modo transparente (RTU sobre TCP, padrão)
+#   "tcp" - Gateway configurado como Modbus TCP (MBAP com transaction ID,
+#           várias requisições pendentes por conexão)
 GERADORES_CONFIG = {
     "15001": {
         "nome": "Gerador 1 - SmartGen",
@@ -83,6 +213,7 @@ GERADORES_CONFIG = {
         "porta_escuta": 15001,
         "endereco_modbus": 1,
         "timeout": 5.0,  # Aumentado para sincronização
+        "transporte": "rtu",
         "habilitado": False,
     },
     "15002": {
@@ -91,6 +222,7 @@ GERADORES_CONFIG = {
         "porta_escuta": 15002,
         "endereco_modbus": 1,
         "timeout": 5.0,  # Aumentado para sincronização
+        "transporte": "rtu",
         "habilitado": True,
     },
     "15003": {
@@ -99,6 +231,7 @@ GERADORES_CONFIG = {
         "porta_escuta": 15003,
         "endereco_modbus": 1,
         "timeout": 5.0,
+        "transporte": "rtu",
         "habilitado": False,
     },
 }
@@ -106,12 +239,234 @@ GERADORES_CONFIG = {
 # Intervalo entre leituras (segundos)
 INTERVALO_LEITURA = 10
 
+# NOVO v2.17.0: Turno consumido mais que isso após o prazo conta como ciclo atrasado
+TOLERANCIA_ATRASO_CICLO = 1.0
+
+# NOVO v2.18.0: Watchdog dos workers
+PRAZO_CICLO = 30.0            # Ciclo (polling + upload) mais longo que isso é abortado
+WATCHDOG_INTERVALO = 5.0      # Período de verificação do watchdog
+IDADE_MAX_SUCESSO = 120.0     # Sem leitura ok há mais que isso: gerador não saudável no /health
+WORKER_BACKOFF_MAX = 60       # Espera máxima após erros seguidos no worker (s)
+
 # CORREÇÃO: Delay entre leitura dos blocos (ms)
 DELAY_ENTRE_BLOCOS = 0.5  # 500ms
 
+# NOVO v2.24.0: Linha serial atrás do HF2211 (uso do link em GET /metricas e --planejar)
+BAUDRATE_SERIAL = 19200           # Conforme manual STEMAC K30XL
+BITS_POR_CARACTERE = 10           # 8N1: start + 8 dados + stop
+SILENCIO_RTU_CARACTERES = 3.5     # Silêncio mínimo antes de cada frame RTU
+JANELA_USO_SERIAL = 60.0          # Janela da utilização em GET /metricas (s)
+BALDES_USO_SERIAL = 6
+TURNAROUND_PLANEJAMENTO_MS = 80.0  # Turnaround assumido pelo planejador se não informado
+
+# Function codes de escrita suportados (v2.13.0): FC06 e FC16
+FUNCOES_ESCRITA = (0x06, 0x10)
+
+# NOVO v2.11.0: Máximo de transações MBAP pendentes por conexão (transporte "tcp")
+MAX_TRANSACOES_PENDENTES = 4
+
+# NOVO v2.12.0: Política de retry por classe de erro Modbus
+# tentativas = repetições após a primeira falha; backoff = espera inicial (s),
+# dobrada a cada nova tentativa. Timeout esgota o prazo do link e não é
+# repetido no mesmo ciclo; exceção Modbus é resposta válida do controlador
+# (ex: endereço ilegal) e repetir não muda o resultado.
+POLITICAS_RETRY = {
+    "crc": {"tentativas": 2, "backoff": 0.2},
+    "framing": {"tentativas": 2, "backoff": 0.2},
+    "timeout": {"tentativas": 0, "backoff": 0.0},
+    "excecao_modbus": {"tentativas": 0, "backoff": 0.0},
+    "conexao_fechada": {"tentativas": 0, "backoff": 0.0},
+}
+# Timeouts seguidos (sem nenhum byte válido) até considerar o link morto e
+# fechar o socket para o HF2211 reconectar
+LIMITE_TIMEOUTS_CONSECUTIVOS = 3
+
+# NOVO v2.13.0: Comandos de escrita (FC06/FC16) via POST /comandos
+# Exige GMG_API_TOKEN definido; sem token a rota fica desabilitada.
+PRAZO_COMANDO_PADRAO = 5.0        # Segundos até o comando expirar na fila
+PRAZO_COMANDO_MAX = 30.0
+MAX_COMANDOS_PENDENTES = 16       # Por link
+
+# NOVO v2.20.0: Diagnóstico no link em produção (POST /diagnostico)
+ORCAMENTO_BARRAMENTO_DIAGNOSTICO = 0.25  # Fração máxima do tempo do link para diagnóstico
+TIMEOUT_SONDA = 0.3               # Timeout por endereço na sondagem de escravos (s)
+PRAZO_DIAGNOSTICO_PADRAO = 60.0
+PRAZO_DIAGNOSTICO_MAX = 600.0
+MAX_PASSOS_DIAGNOSTICO = 256      # Transações por pedido
+
+# NOVO v2.27.0: Descoberta do endereço do escravo quando o configurado não responde
+DESCOBERTA_ENDERECO = os.environ.get("GMG_DESCOBERTA_ENDERECO", "1") != "0"
+DESCOBERTA_ARQUIVO = os.environ.get("GMG_DESCOBERTA_ARQUIVO", "dados/enderecos-escravo.json")
+DESCOBERTA_TIMEOUT_MIN = 0.05     # Piso do timeout adaptativo por endereço (s)
+DESCOBERTA_FATOR_TIMEOUT = 4      # Timeout = fator x tempo de resposta conhecido (teto: TIMEOUT_SONDA)
+DESCOBERTA_PAUSA_FALHA = 600      # Nenhum endereço respondeu: espera antes de varrer de novo (s)
+
+# NOVO v2.23.0: Cache de registradores (GET /registradores)
+CACHE_REGISTRADORES_MAX_BLOCOS = 16   # Blocos de resposta guardados por link
+CACHE_IDADE_MAX_PADRAO = 2 * INTERVALO_LEITURA  # Idade aceita quando a consulta não informa
+PRAZO_LEITURA_CACHE = 10.0            # Espera máxima por uma leitura sob demanda (s)
+MAX_REGISTRADORES_ESCRITA = 123   # Limite do FC16 (Modbus Application Protocol)
+AUDITORIA_ARQUIVO = "logs/auditoria-comandos.ndjson"
+AUDITORIA_ARQUIVO_MAX_BYTES = 5 * 1024 * 1024
+AUDITORIA_ARQUIVO_BACKUPS = 10
+
 # Limite máximo razoável para horímetro (em horas)
 MAX_HORIMETRO_HORAS = 500000  # ~57 anos
 
+# NOVO v2.16.0: Filtro de plausibilidade antes de alertas e upload
+FILTRO_PLAUSIBILIDADE = True
+LIMITES_PLAUSIBILIDADE = {
+    "tensao_rede_rs": (0, 300),
+    "tensao_rede_st": (0, 300),
+    "tensao_rede_tr": (0, 300),
+    "tensao_gmg": (0, 300),
+    "corrente_fase1": (0, 1000),
+    "frequencia_gmg": (0, 70),
+    "rpm_motor": (0, 3000),
+    "tensao_bateria": (0, 32),
+    "temperatura_agua": (-20, 150),
+    "horimetro_horas": (0, MAX_HORIMETRO_HORAS),
+    "horimetro_minutos": (0, 59),
+    "horimetro_segundos": (0, 59),
+    "horas_trabalhadas": (0, MAX_HORIMETRO_HORAS),
+    "numero_partidas": (0, 65535),
+    "nivel_combustivel": (0, 100),
+}
+# Variação máxima por segundo (tensões, frequência e RPM mudam em degrau na transferência)
+TAXAS_MAXIMAS = {
+    "temperatura_agua": 2.0,
+    "tensao_bateria": 1.0,
+    "nivel_combustivel": 2.0,
+}
+# Contadores: nunca diminuem; crescimento máximo por segundo (+1 de tolerância)
+CONTADORES_MONOTONICOS = {
+    "horimetro_horas": 1 / 3600,
+    "horas_trabalhadas": 1 / 3600,
+    "numero_partidas": 1 / 60,
+}
+CAMPOS_MEDIANA = (
+    "tensao_rede_rs", "tensao_rede_st", "tensao_rede_tr", "tensao_gmg",
+    "corrente_fase1", "frequencia_gmg", "rpm_motor", "tensao_bateria",
+    "temperatura_agua", "nivel_combustivel",
+)
+FILTRO_CONFIRMACOES = 3           # Leituras seguidas no novo patamar para aceitá-lo
+FILTRO_MAX_SUSPEITOS = 3          # Campos suspeitos para descartar a leitura inteira
+FILTRO_REFERENCIA_MAX_S = 600     # Referência mais antiga que isso não limita a taxa
+FILTRO_QUARENTENA_MAX = 20        # Amostras guardadas por gerador (GET /quarentena)
+
+# NOVO v2.6.0: Avaliação de alertas na própria VPS
+# Os parametros_alerta de cada gerador ficam em cache local e são avaliados
+# a cada polling. Com isso a edge function não consulta parametros_alerta
+# a cada leitura recebida.
+AVALIAR_ALERTAS_NA_VPS = True
+TTL_PARAMETROS_ALERTA = 300       # Segundos até recarregar os parâmetros
+RETRY_PARAMETROS_ALERTA = 30      # Segundos até nova tentativa após falha
+HISTERESE_ALERTA = 0.02           # Faixa de retorno: 2% do limite
+INTERVALO_MIN_REALERTA = 300      # Segundos antes de repetir o mesmo alerta
+
+# NOVO v2.7.0: Agregação local (rollups) por minuto e por hora
+# Com ENVIAR_LEITURAS_BRUTAS = False o polling pode rodar a 1 s e o backend
+# recebe apenas uma linha por janela fechada (61 linhas/hora por gerador).
+ENVIAR_LEITURAS_BRUTAS = True
+ENVIAR_ROLLUPS = True
+JANELAS_ROLLUP = {"1m": 60, "1h": 3600}
+MAX_ROLLUPS_PENDENTES = 500       # Rollups guardados enquanto o backend falha (envio síncrono, sem o sink de eventos)
+
+# NOVO v2.15.0: Sink direto no Postgres (opcional, requer psycopg2)
+# Com GMG_POSTGRES_DSN definido as leituras brutas são gravadas em lote em
+# leituras_tempo_real, sem um POST na edge function por leitura.
+# Ex: postgresql://postgres.<projeto>:<senha>@aws-0-sa-east-1.pooler.supabase.com:6543/postgres
+POSTGRES_DSN = os.environ.get("GMG_POSTGRES_DSN")
+POSTGRES_POOL_MAX = 4
+POSTGRES_LOTE_MAX = 200           # Leituras por INSERT
+POSTGRES_INTERVALO_LOTE = 2.0     # Segundos máximos até gravar um lote
+POSTGRES_FILA_MAX = 20000         # Leituras guardadas enquanto o banco falha
+POSTGRES_TTL_GERADOR = 600        # Cache porta_vps → gerador_id (segundos)
+POSTGRES_RETRY_GERADOR = 30       # Banco indisponível: edge function até nova consulta (segundos)
+
+# NOVO v2.8.0: Tracing por ciclo (Chrome Trace Event Format)
+# Abrir o arquivo em https://ui.perfetto.dev ou chrome://tracing
+TRACE_HABILITADO = True
+TRACE_TAXA_AMOSTRAGEM = 0.1       # Fração dos ciclos gravados (0.0 a 1.0)
+TRACE_ARQUIVO = "logs/trace-ciclos.json"
+TRACE_ARQUIVO_MAX_BYTES = 5 * 1024 * 1024
+TRACE_ARQUIVO_BACKUPS = 3
+
+# NOVO v2.9.0: Profiling sob demanda via Health API (/debug/perfil, /debug/memoria)
+# Sem custo quando ocioso: nenhuma thread nem tracemalloc ativos até a chamada.
+PERFIL_MAX_SEGUNDOS = 60          # Duração máxima de uma coleta
+PERFIL_INTERVALO_MS = 10          # Intervalo entre amostras das threads
+PERFIL_TOP = 30                   # Linhas retornadas por agrupamento
+
+# Porta da Health API
+PORTA_HEALTH_API = 3001
+
+# NOVO v2.14.0: Stream de leituras ao vivo (GET /stream, Server-Sent Events)
+STREAM_MAX_ASSINANTES = 20        # Conexões simultâneas (cada uma ocupa uma thread)
+STREAM_FILA_ASSINANTE = 100       # Mensagens guardadas por consumidor lento
+STREAM_KEEPALIVE = 15             # Segundos entre comentários de keepalive
+
+# NOVO v2.21.0: Sinks de saída (lista separada por vírgula: http, arquivo, mqtt, serie)
+SINKS = [n.strip() for n in os.environ.get("GMG_SINKS", "http").split(",") if n.strip()]
+SINK_FILA_MAX = 10000             # Leituras guardadas por sink (somando os geradores) enquanto ele falha
+SINK_TENTATIVAS = 5               # Falhas seguidas de um gerador antes de descartar suas leituras
+SINK_BACKOFF_MAX = 60             # Espera máxima entre tentativas (s)
+SINK_ARQUIVO = os.environ.get("GMG_SINK_ARQUIVO", "logs/leituras.ndjson")
+SINK_ARQUIVO_MAX_BYTES = 50 * 1024 * 1024
+SINK_ARQUIVO_BACKUPS = 10
+MQTT_HOST = os.environ.get("GMG_MQTT_HOST")
+MQTT_PORTA = int(os.environ.get("GMG_MQTT_PORTA", "1883"))
+MQTT_USUARIO = os.environ.get("GMG_MQTT_USUARIO")
+MQTT_SENHA = os.environ.get("GMG_MQTT_SENHA")
+MQTT_PREFIXO = os.environ.get("GMG_MQTT_PREFIXO", "gmg")
+MQTT_QOS = 1
+MQTT_RETER = False                # retain: broker guarda a última leitura por tópico
+MQTT_KEEPALIVE = 60
+
+# NOVO v2.22.0: Snapshot da última leitura em memória compartilhada (vazio = desativado)
+SNAPSHOT_ARQUIVO = os.environ.get(
+    "GMG_SNAPSHOT_ARQUIVO",
+    "/dev/shm/gmg-leituras" if os.path.isdir("/dev/shm") else "logs/gmg-leituras.snap",
+)
+SNAPSHOT_MAX_GERADORES = 64       # Slots fixos no arquivo (um por porta_vps)
+
+# NOVO v2.25.0: Série temporal local comprimida (sink "serie" em GMG_SINKS)
+SERIE_DIRETORIO = os.environ.get("GMG_SERIE_DIR", "dados/series")
+SERIE_PARTICAO_S = 3600           # Um arquivo por gerador por hora (UTC)
+SERIE_BLOCO_S = 300               # Bloco em memória gravado a cada 5 min (perda máxima num crash)
+SERIE_RETENCAO_DIAS = int(os.environ.get("GMG_SERIE_RETENCAO_DIAS", "180"))
+
+# NOVO v2.26.0: Exportação da série local (--exportar), linhas por lote gravado
+EXPORTAR_LOTE = 16384
+
+# NOVO v2.28.0: Estado do processo salvo periodicamente e no SIGTERM, restaurado na partida
+ESTADO_ARQUIVO = os.environ.get("GMG_ESTADO_ARQUIVO", "dados/estado-leitor.json.gz")  # vazio = desativado
+ESTADO_INTERVALO = 30             # Segundos entre gravações periódicas
+ESTADO_IDADE_MAX = 3600           # Filtros, alertas e fases mais velhos que isso não são restaurados (s)
+PARTIDA_ORCAMENTO_MS = 1000       # Meta da partida até o primeiro upload (ms), conferida no log
+INICIO_PROCESSO = time.monotonic()
+
+# NOVO v2.29.0: Envio idempotente (seq por gerador dentro do fluxo do processo, ack do backend)
+ENVIO_LOTE_MAX = int(os.environ.get("GMG_ENVIO_LOTE", "1"))  # Leituras por POST; > 1 exige a edge function v2.29.0
+ENVIO_INTERVALO_LOTE = 0.5        # Espera para acumular um lote após a 1ª leitura (s)
+# Sem resposta, 408, 429 e 502-504 são repetidos sem limite; outro 5xx conta para
+# ENVIO_TENTATIVAS_ERRO e 4xx vai direto: a leitura sai da fila para o dead-letter
+# (um NDJSON por gerador, reenviado com --reenviar-dead-letter)
+ENVIO_TENTATIVAS_ERRO = 10        # Erros seguidos do backend num gerador antes do dead-letter
+DEAD_LETTER_DIRETORIO = os.environ.get("GMG_DEAD_LETTER_DIR", "dados/dead-letter")
+
+# NOVO v2.10.0: Orçamento de memória por conexão (bytes, heap Python)
+# Conexão + última leitura, sem contar buffers de socket do kernel.
+# Verificado com: python vps-modbus-reader.py --benchmark-memoria
+ORCAMENTO_MEMORIA_CONEXAO = 1024
+# Estado completo por gerador (conexão, leitura, alertas e rollups abertos)
+ORCAMENTO_MEMORIA_GERADOR = 8192
+
+# Token da Health API (header X-API-Key). As rotas /debug/* e POST /comandos
+# exigem o token: sem ele respondem 403. As demais rotas protegidas ficam
+# abertas se não definido.
+TOKEN_API = os.environ.get("GMG_API_TOKEN")
+
 # =============================================================================
 # MAPEAMENTO DE REGISTRADORES K30XL - CORRIGIDO v2.5.0
 # =============================================================================
@@ -180,273 +535,1706 @@ BLOCO2_QUANTIDADE = 4
 
 
 # =============================================================================
-# GERENCIADOR DE CONEXÕES TCP (MODO ATIVO)
+# LEITURA COMPACTA (v2.10.0)
 # =============================================================================
+#
+# Uma leitura ocupa um objeto com __slots__ e um array('d') de tamanho fixo
+# (NaN = campo ausente); os booleanos ficam em um único inteiro (bit i =
+# presente, bit i+16 = valor). O instante de captura é um float epoch e só
+# vira string ISO no envio. A interface de mapeamento (get, [], keys, len)
+# é mantida para o restante do código e para o payload (**leitura).
 
-class ConexaoHF:
-    """Gerencia uma conexão TCP de um HF2211"""
-    
-    def __init__(self, porta_vps: str, config: Dict[str, Any]):
+CAMPOS_NUMERICOS = (
+    "tensao_rede_rs",
+    "tensao_rede_st",
+    "tensao_rede_tr",
+    "tensao_gmg",
+    "corrente_fase1",
+    "frequencia_gmg",
+    "rpm_motor",
+    "tensao_bateria",
+    "temperatura_agua",
+    "horimetro_horas",
+    "horimetro_minutos",
+    "horimetro_segundos",
+    "horas_trabalhadas",
+    "numero_partidas",
+    "nivel_combustivel",
+)
+
+CAMPOS_BOOLEANOS = (
+    "rede_ok",
+    "motor_funcionando",
+    "gmg_alimentando",
+    "aviso_ativo",
+    "falha_ativa",
+)
+
+# Campos enviados como inteiros (colunas INTEGER no backend)
+CAMPOS_INTEIROS = frozenset({
+    "rpm_motor",
+    "horimetro_horas",
+    "horimetro_minutos",
+    "horimetro_segundos",
+    "numero_partidas",
+    "nivel_combustivel",
+})
+
+_INDICE_NUMERICO = {nome: i for i, nome in enumerate(CAMPOS_NUMERICOS)}
+_INDICE_BOOLEANO = {nome: i for i, nome in enumerate(CAMPOS_BOOLEANOS)}
+_VALORES_VAZIOS = array("d", [float("nan")] * len(CAMPOS_NUMERICOS))
+
+
+def iso_utc(instante: float) -> str:
+    """Epoch em string ISO UTC com milissegundos (ex: 2026-01-28T18:35:19.123Z)"""
+    return datetime.fromtimestamp(instante, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class Leitura:
+    """Leitura decodificada de um gerador em representação compacta"""
+
+    __slots__ = ("valores", "booleanos", "capturado_em", "trace_id", "parcial", "seq", "id_fluxo")
+
+    def __init__(self):
+        self.valores = array("d", _VALORES_VAZIOS)
+        self.booleanos = 0
+        self.capturado_em: Optional[float] = None  # epoch (time.time())
+        self.trace_id: Optional[str] = None
+        self.parcial = False  # v2.12.0: algum bloco falhou neste ciclo
+        self.seq: Optional[int] = None  # v2.29.0: identidade no envio (numerar_leitura)
+        self.id_fluxo: Optional[str] = None
+
+    def __setitem__(self, nome: str, valor):
+        i = _INDICE_NUMERICO.get(nome)
+        if i is not None:
+            self.valores[i] = valor
+            return
+        i = _INDICE_BOOLEANO.get(nome)
+        if i is None:
+            raise KeyError(nome)
+        self.booleanos |= 1 << i
+        if valor:
+            self.booleanos |= 1 << (i + 16)
+        else:
+            self.booleanos &= ~(1 << (i + 16))
+
+    def __delitem__(self, nome: str):
+        """Torna o campo ausente (NaN ou bit de presença zerado)"""
+        i = _INDICE_NUMERICO.get(nome)
+        if i is not None:
+            self.valores[i] = _VALORES_VAZIOS[i]
+            return
+        i = _INDICE_BOOLEANO.get(nome)
+        if i is None:
+            raise KeyError(nome)
+        self.booleanos &= ~((1 << i) | (1 << (i + 16)))
+
+    def get(self, nome: str, padrao=None):
+        i = _INDICE_NUMERICO.get(nome)
+        if i is not None:
+            valor = self.valores[i]
+            if valor != valor:  # NaN
+                return padrao
+            return int(valor) if nome in CAMPOS_INTEIROS else valor
+        i = _INDICE_BOOLEANO.get(nome)
+        if i is not None:
+            if not self.booleanos & (1 << i):
+                return padrao
+            return bool(self.booleanos & (1 << (i + 16)))
+        if nome == "capturado_em":
+            return iso_utc(self.capturado_em) if self.capturado_em is not None else padrao
+        if nome == "trace_id":
+            return self.trace_id if self.trace_id is not None else padrao
+        if nome == "leitura_parcial":
+            return True if self.parcial else padrao
+        if nome == "seq":
+            return self.seq if self.seq is not None else padrao
+        if nome == "id_fluxo":
+            return self.id_fluxo if self.id_fluxo is not None else padrao
+        return padrao
+
+    def __getitem__(self, nome: str):
+        valor = self.get(nome)
+        if valor is None:
+            raise KeyError(nome)
+        return valor
+
+    def __contains__(self, nome: str) -> bool:
+        return self.get(nome) is not None
+
+    def keys(self):
+        for nome, valor in zip(CAMPOS_NUMERICOS, self.valores):
+            if valor == valor:
+                yield nome
+        for i, nome in enumerate(CAMPOS_BOOLEANOS):
+            if self.booleanos & (1 << i):
+                yield nome
+        if self.capturado_em is not None:
+            yield "capturado_em"
+        if self.trace_id is not None:
+            yield "trace_id"
+        if self.parcial:
+            yield "leitura_parcial"
+        if self.seq is not None:
+            yield "seq"
+            yield "id_fluxo"
+
+    def items(self):
+        for nome in self.keys():
+            yield nome, self.get(nome)
+
+    def para_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.keys())
+
+    def __bool__(self) -> bool:
+        return any(v == v for v in self.valores) or self.booleanos != 0
+
+    def __repr__(self) -> str:
+        return f"Leitura({self.para_dict()})"
+
+    def para_estado(self) -> list:
+        """v2.28.0: forma compacta (listas JSON) para o estado persistido"""
+        return [self.valores.tolist(), self.booleanos, self.capturado_em, self.trace_id, self.parcial,
+                self.seq, self.id_fluxo]
+
+    @classmethod
+    def de_estado(cls, estado: list) -> "Leitura":
+        leitura = cls()
+        valores, leitura.booleanos, leitura.capturado_em, leitura.trace_id, leitura.parcial = estado[:5]
+        if len(estado) > 5:  # estado salvo pela v2.28.0 não tem seq
+            leitura.seq, leitura.id_fluxo = estado[5:7]
+        leitura.valores = array("d", valores)
+        return leitura
+
+
+# =============================================================================
+# CLASSIFICAÇÃO DE ERROS MODBUS (v2.12.0)
+# =============================================================================
+
+class ErroModbus(Exception):
+    """Falha de uma transação Modbus; `classe` indexa POLITICAS_RETRY"""
+    classe = "framing"
+
+
+class ErroTimeout(ErroModbus):
+    classe = "timeout"
+
+
+class ErroCRC(ErroModbus):
+    classe = "crc"
+
+
+class ErroFraming(ErroModbus):
+    classe = "framing"
+
+
+class ErroExcecaoModbus(ErroModbus):
+    """Resposta de exceção do escravo: [ADDR][FC|0x80][EC]"""
+    classe = "excecao_modbus"
+
+    def __init__(self, funcao: int, codigo: int):
+        super().__init__(f"Exceção Modbus: FC=0x{funcao:02X}, EC=0x{codigo:02X}")
+        self.funcao = funcao
+        self.codigo = codigo
+
+
+class ErroConexaoFechada(ErroModbus):
+    classe = "conexao_fechada"
+
+
+# =============================================================================
+# MÉTRICAS (v2.12.0)
+# =============================================================================
+
+class Metricas:
+    """Contadores por gerador expostos em GET /metricas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores: Dict[str, Counter] = {}
+
+    def incrementar(self, porta_vps: str, nome: str, valor: int = 1):
+        with self._lock:
+            self._contadores.setdefault(porta_vps, Counter())[nome] += valor
+
+    def instantaneo(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {porta: dict(c) for porta, c in self._contadores.items()}
+
+
+metricas = Metricas()
+
+
+class _Hex:
+    """Formata bytes/valores em hexadecimal só quando o log é de fato emitido"""
+
+    __slots__ = ("dados",)
+
+    def __init__(self, dados):
+        self.dados = dados
+
+    def __str__(self) -> str:
+        if isinstance(self.dados, (bytes, bytearray)):
+            return self.dados.hex(' ').upper()
+        return str([f"0x{v:04X}" for v in self.dados])
+
+
+# =============================================================================
+# TRACING POR CICLO (v2.8.0)
+# =============================================================================
+#
+# Cada ciclo amostrado grava eventos "X" (complete) do Chrome Trace Event
+# Format, um por linha, em arquivo rotativo. Cada arquivo começa com "[" e
+# não é fechado com "]" (formato aceito pelo Perfetto/chrome://tracing).
+#
+# Etapas registradas:
+#   ciclo                 Ciclo completo (args: capturado_em, trace_id)
+#   bloco1 / bloco2       Leitura de cada bloco
+#   limpar_buffer         Dreno de bytes residuais antes do TX
+#   tx                    Envio do frame
+#   ttfb                  Espera até o primeiro byte do HF2211
+#   sincronizacao         Do primeiro byte ao frame completo (args: lixo_descartado)
+#   delay_entre_blocos    Pausa DELAY_ENTRE_BLOCOS (atende comandos pendentes)
+#   comando / verificacao Escrita FC06/FC16 e leitura de volta
+#   alertas / upload      Avaliação de alertas e POST para o backend
+#
+# O relógio dos eventos é monotônico (µs). O instante de captura em UTC
+# (capturado_em) viaja junto com a leitura para o backend calcular o atraso
+# de ingestão ponta a ponta.
+
+_trace_local = threading.local()
+_logger_trace: Optional[logging.Logger] = None
+_logger_trace_lock = threading.Lock()
+_SPAN_NULO = contextlib.nullcontext()
+
+
+def agora_iso_utc() -> str:
+    """Instante atual em UTC com milissegundos (ex: 2026-01-28T18:35:19.123Z)"""
+    return iso_utc(time.time())
+
+
+class _HandlerTraceRotativo(logging.handlers.RotatingFileHandler):
+    """Arquivo rotativo que abre cada novo arquivo com "[" (JSON Array Format)"""
+
+    def _open(self):
+        stream = super()._open()
+        if stream.tell() == 0:
+            stream.write("[\n")
+        return stream
+
+
+def _obter_logger_trace() -> logging.Logger:
+    """Cria o logger de trace no primeiro ciclo amostrado"""
+    global _logger_trace
+    with _logger_trace_lock:
+        if _logger_trace is None:
+            diretorio = os.path.dirname(TRACE_ARQUIVO)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            handler = _HandlerTraceRotativo(
+                TRACE_ARQUIVO,
+                maxBytes=TRACE_ARQUIVO_MAX_BYTES,
+                backupCount=TRACE_ARQUIVO_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s,"))
+            log_trace = logging.getLogger("trace-ciclos")
+            log_trace.propagate = False
+            log_trace.setLevel(logging.INFO)
+            log_trace.addHandler(handler)
+            _logger_trace = log_trace
+        return _logger_trace
+
+
+class _Span:
+    """Context manager que registra uma etapa no trace do ciclo"""
+
+    __slots__ = ("trace", "nome", "args", "inicio_ns")
+
+    def __init__(self, trace: "TraceCiclo", nome: str, args: Dict[str, Any]):
+        self.trace = trace
+        self.nome = nome
+        self.args = args
+
+    def __enter__(self):
+        self.inicio_ns = time.monotonic_ns()
+        return self
+
+    def __exit__(self, tipo_erro, erro, tb):
+        if tipo_erro is not None:
+            self.args["erro"] = tipo_erro.__name__
+        self.trace.registrar(self.nome, self.inicio_ns, time.monotonic_ns(), **self.args)
+        return False
+
+
+class TraceCiclo:
+    """Etapas de um ciclo de polling, gravadas ao final do ciclo"""
+
+    __slots__ = ("porta_vps", "trace_id", "eventos")
+
+    def __init__(self, porta_vps: str):
         self.porta_vps = porta_vps
-        self.config = config
-        self.socket_servidor: Optional[socket.socket] = None
-        self.socket_cliente: Optional[socket.socket] = None
-        self.cliente_conectado = False
-        self.ultimo_dado = None
-        self.logger = logging.getLogger(f"HF-{porta_vps}")
-    
-    def iniciar_servidor(self) -> bool:
-        """Inicia o servidor TCP na porta especificada"""
-        try:
-            self.socket_servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket_servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket_servidor.settimeout(5.0)
-            self.socket_servidor.bind((VPS_IP, self.config["porta_escuta"]))
-            self.socket_servidor.listen(1)
-            
-            self.logger.info(f"Servidor TCP iniciado na porta {self.config['porta_escuta']}")
-            return True
-            
-        except Exception as e:
-            self.logger.error(f"Erro ao iniciar servidor: {e}")
-            return False
-    
-    def aceitar_conexao(self) -> bool:
-        """Aceita conexão de um HF2211"""
-        try:
-            self.socket_cliente, endereco = self.socket_servidor.accept()
-            self.socket_cliente.settimeout(self.config["timeout"])
-            self.cliente_conectado = True
-            self.logger.info(f"HF2211 conectado de {endereco}")
-            return True
-            
-        except socket.timeout:
-            return False
-        except Exception as e:
-            self.logger.error(f"Erro ao aceitar conexão: {e}")
-            return False
-    
-    def calcular_crc16(self, dados: bytes) -> int:
-        """
-        Calcula CRC-16 Modbus (polinômio 0xA001).
-        Usado para frames Modbus RTU.
-        """
-        crc = 0xFFFF
-        for byte in dados:
-            crc ^= byte
-            for _ in range(8):
-                if crc & 0x0001:
-                    crc = (crc >> 1) ^ 0xA001
-                else:
-                    crc >>= 1
-        return crc
-    
-    def limpar_buffer_socket(self):
-        """
-        Limpa bytes residuais do socket antes de nova leitura.
-        """
-        if not self.socket_cliente:
+        self.trace_id = os.urandom(8).hex()
+        self.eventos: list = []
+
+    def registrar(self, nome: str, inicio_ns: int, fim_ns: int, **args):
+        self.eventos.append({
+            "name": nome,
+            "cat": "ciclo",
+            "ph": "X",
+            "ts": inicio_ns // 1000,
+            "dur": max(fim_ns - inicio_ns, 0) // 1000,
+            "pid": os.getpid(),
+            "tid": int(self.porta_vps) if self.porta_vps.isdigit() else 0,
+            "args": {"trace_id": self.trace_id, **args},
+        })
+
+    def span(self, nome: str, **args) -> _Span:
+        return _Span(self, nome, args)
+
+    def gravar(self):
+        if not self.eventos:
             return
-        
+        log_trace = _obter_logger_trace()
+        for evento in self.eventos:
+            log_trace.info(json.dumps(evento, ensure_ascii=False))
+
+
+def iniciar_trace(porta_vps: str) -> Optional[TraceCiclo]:
+    """Inicia o trace do ciclo na thread atual, respeitando a amostragem"""
+    if not TRACE_HABILITADO or random.random() >= TRACE_TAXA_AMOSTRAGEM:
+        _trace_local.atual = None
+        return None
+    trace = TraceCiclo(porta_vps)
+    _trace_local.atual = trace
+    return trace
+
+
+def trace_atual() -> Optional[TraceCiclo]:
+    return getattr(_trace_local, "atual", None)
+
+
+def span(nome: str, **args):
+    """Etapa do ciclo atual; não faz nada se o ciclo não foi amostrado"""
+    trace = getattr(_trace_local, "atual", None)
+    if trace is None:
+        return _SPAN_NULO
+    return trace.span(nome, **args)
+
+
+def registrar_span(nome: str, inicio_ns: int, fim_ns: int, **args):
+    """Registra uma etapa com instantes já medidos (time.monotonic_ns)"""
+    trace = getattr(_trace_local, "atual", None)
+    if trace is not None:
+        trace.registrar(nome, inicio_ns, fim_ns, **args)
+
+
+def finalizar_trace():
+    """Grava os eventos do ciclo atual e limpa o contexto da thread"""
+    trace = getattr(_trace_local, "atual", None)
+    _trace_local.atual = None
+    if trace is not None:
         try:
-            self.socket_cliente.setblocking(False)
-            bytes_descartados = 0
-            while True:
-                try:
-                    lixo = self.socket_cliente.recv(256)
-                    if lixo:
-                        bytes_descartados += len(lixo)
-                        self.logger.warning(f"Lixo no buffer (pré-comando): {lixo.hex(' ').upper()}")
-                    else:
-                        break
-                except BlockingIOError:
-                    break
-            
-            self.socket_cliente.setblocking(True)
-            self.socket_cliente.settimeout(self.config["timeout"])
-            
-            if bytes_descartados > 0:
-                self.logger.warning(f"Total de {bytes_descartados} bytes residuais limpos")
-                
+            trace.gravar()
         except Exception as e:
-            self.logger.debug(f"Erro ao limpar buffer: {e}")
+            logger.debug(f"Erro ao gravar trace: {e}")
+
+
+# =============================================================================
+# FILA DE TRABALHO E COMANDOS DE ESCRITA (v2.13.0)
+# =============================================================================
+#
+# Cada link (ConexaoHF) tem uma FilaTrabalho consumida apenas pelo seu worker,
+# então o socket continua tendo um único dono. O worker atende a fila no
+# intervalo entre ciclos de polling e na janela entre os blocos RTU; um
+# comando que chega durante o polling espera no máximo a transação em curso.
+#
+# Itens da fila implementam: executar(conexao), expirado() e cancelar(status).
+
+PRIORIDADE_COMANDO = 0
+PRIORIDADE_DIAGNOSTICO = 1
+PRIORIDADE_POLLING = 2
+
+_logger_auditoria: Optional[logging.Logger] = None
+_logger_auditoria_lock = threading.Lock()
+
+
+def _obter_logger_auditoria() -> logging.Logger:
+    """Cria o logger de auditoria (NDJSON rotativo) no primeiro comando"""
+    global _logger_auditoria
+    with _logger_auditoria_lock:
+        if _logger_auditoria is None:
+            diretorio = os.path.dirname(AUDITORIA_ARQUIVO)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                AUDITORIA_ARQUIVO,
+                maxBytes=AUDITORIA_ARQUIVO_MAX_BYTES,
+                backupCount=AUDITORIA_ARQUIVO_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log_auditoria = logging.getLogger("auditoria-comandos")
+            log_auditoria.propagate = False
+            log_auditoria.setLevel(logging.INFO)
+            log_auditoria.addHandler(handler)
+            _logger_auditoria = log_auditoria
+        return _logger_auditoria
+
+
+class FilaTrabalho:
+    """
+    Fila por prioridade (menor primeiro, FIFO entre iguais) de um link.
+
+    O consumidor espera num Lock usado como sinal binário em vez de uma
+    Condition, que custaria ~700 bytes por conexão (ORCAMENTO_MEMORIA_CONEXAO).
+    """
+
+    __slots__ = ("_itens", "_lock", "_sinal", "_seq")
 
-    def sincronizar_resposta(self, slave_addr: int, tamanho_dados: int) -> Optional[bytes]:
+    def __init__(self):
+        self._itens: list = []
+        self._lock = threading.Lock()
+        self._sinal = threading.Lock()  # liberado quando chega um item
+        self._sinal.acquire()
+        self._seq = 0
+
+    def colocar(self, prioridade: int, item) -> int:
+        """Enfileira e retorna o tamanho da fila após a inserção"""
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._itens, (prioridade, self._seq, item))
+            tamanho = len(self._itens)
+        try:
+            self._sinal.release()
+        except RuntimeError:
+            pass  # já sinalizado
+        return tamanho
+
+    def retirar(self, limite: float, prioridade_max: int = PRIORIDADE_POLLING):
         """
-        CORREÇÃO v2.2.0: Sincroniza a leitura buscando o padrão de início Modbus.
-        Descarta bytes de lixo até encontrar: [ADDR][FC=03][BYTECOUNT]
-        
-        Args:
-            slave_addr: Endereço do escravo Modbus (geralmente 1)
-            tamanho_dados: Quantidade de bytes de dados esperados (qty * 2)
-        
-        Returns:
-            Frame Modbus completo ou None em caso de erro
+        Retira o próximo item com prioridade <= prioridade_max, aguardando
+        até `limite` (time.monotonic). Retorna None se nada chegou a tempo.
         """
-        if not self.socket_cliente:
-            return None
-        
-        buffer = bytearray()
-        lixo_descartado = 0
-        tempo_inicio = time.time()
-        tamanho_total = 3 + tamanho_dados + 2  # ADDR + FC + BYTECOUNT + DATA + CRC
-        
-        self.logger.debug(f"Sincronizando resposta (esperando {tamanho_total} bytes)...")
-        
-        while time.time() - tempo_inicio < self.config["timeout"]:
-            try:
-                byte = self.socket_cliente.recv(1)
-                if not byte:
-                    time.sleep(0.01)
-                    continue
-                    
-                buffer.append(byte[0])
-                
-                # Procura padrão de início: [ADDR] [0x03]
-                if len(buffer) >= 2:
-                    # Verifica se os últimos 2 bytes são o início válido
-                    if buffer[-2] == slave_addr and buffer[-1] == 0x03:
-                        # Calcula lixo descartado
-                        if len(buffer) > 2:
-                            lixo_descartado = len(buffer) - 2
-                            lixo_bytes = bytes(buffer[:-2])
-                            self.logger.warning(f"Bytes de LIXO descartados ({lixo_descartado}): {lixo_bytes.hex(' ').upper()}")
-                            buffer = bytearray([slave_addr, 0x03])
-                        
-                        # Lê o byte count
-                        byte_count_raw = self.socket_cliente.recv(1)
-                        if not byte_count_raw:
-                            self.logger.error("Falha ao ler byte count")
-                            return None
-                        
-                        byte_count = byte_count_raw[0]
-                        buffer.append(byte_count)
-                        
-                        # Verifica se byte count faz sentido
-                        if byte_count != tamanho_dados:
-                            self.logger.warning(f"Byte count diferente: recebido={byte_count}, esperado={tamanho_dados}")
-                        
-                        # Lê dados + CRC
-                        restante = byte_count + 2  # dados + 2 bytes CRC
-                        dados_crc = b''
-                        tempo_dados = time.time()
-                        
-                        while len(dados_crc) < restante and time.time() - tempo_dados < 2.0:
-                            chunk = self.socket_cliente.recv(restante - len(dados_crc))
-                            if chunk:
-                                dados_crc += chunk
-                            else:
-                                time.sleep(0.01)
-                        
-                        if len(dados_crc) < restante:
-                            self.logger.error(f"Dados incompletos: {len(dados_crc)}/{restante}")
-                            return None
-                        
-                        buffer.extend(dados_crc)
-                        frame_completo = bytes(buffer)
-                        
-                        self.logger.info(f"RX RTU ({len(frame_completo)} bytes): {frame_completo.hex(' ').upper()}")
-                        
-                        if lixo_descartado > 0:
-                            self.logger.info(f">>> Frame sincronizado após descartar {lixo_descartado} bytes de lixo")
-                        
-                        return frame_completo
-                
-                # Limite de segurança
-                if len(buffer) > 100:
-                    self.logger.error(f"Muitos bytes ({len(buffer)}) sem encontrar padrão válido")
-                    self.logger.error(f"Buffer: {bytes(buffer).hex(' ').upper()}")
-                    return None
-                    
-            except socket.timeout:
-                continue
-            except Exception as e:
-                self.logger.error(f"Erro na sincronização: {e}")
+        while True:
+            with self._lock:
+                if self._itens and self._itens[0][0] <= prioridade_max:
+                    return heapq.heappop(self._itens)[2]
+            restante = limite - time.monotonic()
+            if restante <= 0:
                 return None
-        
-        self.logger.error("Timeout na sincronização")
+            self._sinal.acquire(timeout=restante)
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+
+class Comando:
+    """Escrita FC06/FC16 pedida via API e executada pelo worker do link"""
+
+    __slots__ = (
+        "id", "porta_vps", "funcao", "endereco", "valores", "verificar",
+        "origem", "recebido_em", "prazo", "resultado", "concluido", "_lock",
+    )
+
+    def __init__(self, porta_vps: str, endereco: int, valores: list, funcao: int,
+                 prazo_s: float, verificar: bool = True, origem: str = ""):
+        self.id = os.urandom(8).hex()
+        self.porta_vps = porta_vps
+        self.funcao = funcao
+        self.endereco = endereco
+        self.valores = valores
+        self.verificar = verificar
+        self.origem = origem
+        self.recebido_em = time.time()
+        self.prazo = time.monotonic() + prazo_s
+        self.resultado: Optional[Dict[str, Any]] = None
+        self.concluido = threading.Event()
+        self._lock = threading.Lock()
+
+    def expirado(self) -> bool:
+        return time.monotonic() > self.prazo
+
+    def executar(self, conexao: "ConexaoHF"):
+        conexao.executar_comando(self)
+
+    def cancelar(self, status: str):
+        self.concluir(status)
+
+    def concluir(self, status: str, **detalhes) -> bool:
+        """Registra o resultado (uma única vez), grava a auditoria e libera quem espera"""
+        with self._lock:
+            if self.resultado is not None:
+                return False
+            agora = time.time()
+            self.resultado = {
+                "id": self.id,
+                "porta_vps": self.porta_vps,
+                "funcao": self.funcao,
+                "endereco": self.endereco,
+                "valores": self.valores,
+                "verificar": self.verificar,
+                "origem": self.origem,
+                "recebido_em": iso_utc(self.recebido_em),
+                "concluido_em": iso_utc(agora),
+                "latencia_ms": round((agora - self.recebido_em) * 1000, 1),
+                "status": status,
+                **detalhes,
+            }
+        _obter_logger_auditoria().info(json.dumps(self.resultado, ensure_ascii=False))
+        metricas.incrementar(self.porta_vps, f"comandos_{status}")
+        self.concluido.set()
+        return True
+
+
+def criar_comando(corpo: Dict[str, Any], origem: str = "") -> Comando:
+    """
+    Valida o JSON de POST /comandos e cria o Comando. Levanta ValueError.
+
+    {"porta_vps": "15002", "endereco": 16, "valor": 1}             → FC06
+    {"porta_vps": "15002", "endereco": 16, "valores": [1, 2, 3]}   → FC16
+    Opcionais: "funcao" (6 ou 16), "prazo_s", "verificar" (padrão true)
+    """
+    if not isinstance(corpo, dict) or "porta_vps" not in corpo or "endereco" not in corpo:
+        raise ValueError("Campos obrigatórios: porta_vps, endereco, valor/valores")
+
+    valores = corpo.get("valores")
+    if valores is None:
+        if "valor" not in corpo:
+            raise ValueError("Informe valor ou valores")
+        valores = [corpo["valor"]]
+    if not isinstance(valores, list) or not 1 <= len(valores) <= MAX_REGISTRADORES_ESCRITA:
+        raise ValueError(f"valores deve ter de 1 a {MAX_REGISTRADORES_ESCRITA} registradores")
+    valores = [int(v) for v in valores]
+
+    endereco = int(corpo["endereco"])
+    funcao = int(corpo.get("funcao") or (0x06 if len(valores) == 1 else 0x10))
+    prazo_s = float(corpo.get("prazo_s", PRAZO_COMANDO_PADRAO))
+
+    if funcao not in FUNCOES_ESCRITA:
+        raise ValueError("funcao deve ser 6 (FC06) ou 16 (FC16)")
+    if funcao == 0x06 and len(valores) != 1:
+        raise ValueError("FC06 escreve um único registrador")
+    if not 0 <= endereco <= 0xFFFF or endereco + len(valores) > 0x10000:
+        raise ValueError("endereco fora da faixa 0x0000-0xFFFF")
+    if any(not 0 <= v <= 0xFFFF for v in valores):
+        raise ValueError("valores devem estar entre 0 e 65535")
+    if not 0 < prazo_s <= PRAZO_COMANDO_MAX:
+        raise ValueError(f"prazo_s deve estar entre 0 e {PRAZO_COMANDO_MAX}")
+
+    return Comando(
+        str(corpo["porta_vps"]), endereco, valores, funcao, prazo_s,
+        verificar=bool(corpo.get("verificar", True)), origem=origem,
+    )
+
+
+# =============================================================================
+# AGENDADOR DE POLLING (v2.17.0)
+# =============================================================================
+#
+# Um único thread mantém um heap (prazo, porta) com prazos absolutos em
+# time.monotonic(): o próximo prazo é prazo + INTERVALO_LEITURA, e não
+# "fim do ciclo + intervalo", então o intervalo de amostragem não deriva com
+# a duração do polling e do upload. Cada gerador tem uma fase própria
+# espalhada pelo intervalo, para os uploads não chegarem em rajada.
+#
+# No prazo, o agendador coloca um TurnoPolling na FilaTrabalho do link
+# (PRIORIDADE_POLLING, atrás de comandos e diagnósticos). Se o turno anterior
+# ainda não foi retirado (ciclo estourou o intervalo, link caído), o slot é
+# pulado em vez de enfileirado: nunca há mais de um turno pendente por link.
+
+
+class TurnoPolling:
+    """Item da FilaTrabalho que libera um ciclo de polling do worker"""
+
+    __slots__ = ("prazo", "retirado")
+
+    def __init__(self, prazo: float):
+        self.prazo = prazo
+        self.retirado = False
+
+    def expirado(self) -> bool:
+        return False
+
+    def cancelar(self, status: str):
+        pass
+
+    def executar(self, conexao):
+        pass  # consumido por ConexaoHF.atender_fila
+
+
+class AgendadorPolling:
+    """Emite os turnos de polling de todos os geradores em prazos absolutos"""
+
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self._origem = time.monotonic()
+        self._heap: list = []  # (prazo, porta)
+        self._adiados: list = []  # (prazo, seq, fila, prioridade, item), v2.20.0
+        self._seq = 0
+        self._geradores: Dict[str, list] = {}  # porta → [fila, turno pendente]
+        self._fases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def definir_fases(self, portas: List[str]):
+        """Espalha as fases das portas uniformemente pelo intervalo"""
+        with self._lock:
+            for i, porta in enumerate(portas):
+                self._fases[porta] = self.intervalo * i / len(portas)
+
+    def registrar(self, porta_vps: str, fila: FilaTrabalho):
+        """Passa a emitir turnos para o link, a partir do próximo slot da sua fase"""
+        with self._lock:
+            fase = self._fases.get(porta_vps, 0.0)
+            decorrido = time.monotonic() - self._origem - fase
+            prazo = self._origem + fase + max(0, math.ceil(decorrido / self.intervalo)) * self.intervalo
+            self._geradores[porta_vps] = [fila, None]
+            # Worker recriado (v2.18.0): descarta o prazo anterior da porta
+            self._heap = [(p, porta) for p, porta in self._heap if porta != porta_vps]
+            heapq.heapify(self._heap)
+            heapq.heappush(self._heap, (prazo, porta_vps))
+        self._acordar.set()
+
+    def remover(self, porta_vps: str):
+        with self._lock:
+            self._geradores.pop(porta_vps, None)
+
+    def exportar_fases(self) -> Dict[str, float]:
+        """v2.28.0: fase de cada porta como deslocamento no relógio (epoch % intervalo)"""
+        origem = self._origem - time.monotonic() + time.time()
+        with self._lock:
+            return {porta: (origem + fase) % self.intervalo for porta, fase in self._fases.items()}
+
+    def restaurar_fases(self, fases: Dict[str, float]):
+        """Mantém os slots de cada porta no mesmo ponto do relógio de antes do reinício"""
+        origem = self._origem - time.monotonic() + time.time()
+        with self._lock:
+            for porta, deslocamento in fases.items():
+                if porta in self._fases:
+                    self._fases[porta] = (deslocamento - origem) % self.intervalo
+
+    def adiar(self, prazo: float, fila: FilaTrabalho, prioridade: int, item):
+        """Coloca `item` na fila do link só a partir de `prazo` (time.monotonic)"""
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._adiados, (prazo, self._seq, fila, prioridade, item))
+        self._acordar.set()
+
+    @property
+    def ativo(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="AgendadorPolling")
+        self._thread.start()
+        logger.info(f"Agendador de polling iniciado (intervalo {self.intervalo}s)")
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                proximos = [fila[0][0] for fila in (self._heap, self._adiados) if fila]
+                espera = min(proximos) - time.monotonic() if proximos else None
+            if espera is None or espera > 0:
+                self._acordar.wait(espera)
+                self._acordar.clear()
+                continue
+
+            with self._lock:
+                while self._adiados and self._adiados[0][0] <= time.monotonic():
+                    _, _, fila, prioridade, item = heapq.heappop(self._adiados)
+                    fila.colocar(prioridade, item)
+                if not self._heap or self._heap[0][0] > time.monotonic():
+                    continue
+
+                prazo, porta = heapq.heappop(self._heap)
+                estado = self._geradores.get(porta)
+                if estado is None:
+                    continue  # worker encerrado
+                pendente = estado[1]
+                if pendente is not None and not pendente.retirado:
+                    metricas.incrementar(porta, "slots_pulados")
+                else:
+                    estado[1] = TurnoPolling(prazo)
+                    estado[0].colocar(PRIORIDADE_POLLING, estado[1])
+
+                # Próximo slot; slots que já passaram (processo suspenso) são pulados
+                proximo = prazo + self.intervalo
+                atrasados = int((time.monotonic() - proximo) // self.intervalo) + 1
+                if atrasados > 0:
+                    proximo += atrasados * self.intervalo
+                    metricas.incrementar(porta, "slots_pulados", atrasados)
+                heapq.heappush(self._heap, (proximo, porta))
+
+
+agendador = AgendadorPolling(INTERVALO_LEITURA)
+
+
+# =============================================================================
+# DIAGNÓSTICO NO LINK EM PRODUÇÃO (v2.20.0)
+# =============================================================================
+#
+# Leituras FC03/FC04 arbitrárias e sondagem de endereços de escravo pela
+# Health API (POST /diagnostico), sem parar o serviço: o pedido vira um
+# Diagnostico na FilaTrabalho do link (PRIORIDADE_DIAGNOSTICO) e o worker
+# executa um passo (uma transação) por vez, entre os turnos de polling.
+#
+# Orçamento de barramento: após um passo que ocupou o link por t segundos, o
+# próximo passo de diagnóstico daquela porta só é liberado depois de
+# t * (1 - ORCAMENTO) / ORCAMENTO, via agendador.adiar. Com ORCAMENTO = 0.25
+# o diagnóstico usa no máximo ~25% do tempo do link.
+#
+# Passos de diagnóstico não passam pelos retries nem contam timeouts para o
+# link_morto: sondar um endereço inexistente não derruba a conexão.
+
+_diagnostico_liberado_em: Dict[str, float] = {}
+
+
+class Diagnostico:
+    """Leitura ou sondagem pedida via API, executada em passos pelo worker do link"""
+
+    __slots__ = (
+        "id", "porta_vps", "operacao", "funcao", "passos", "timeout_s",
+        "origem", "recebido_em", "prazo", "resultados", "tempo_barramento",
+        "resultado", "concluido", "_lock",
+    )
+
+    def __init__(self, porta_vps: str, operacao: str, funcao: int, passos: list,
+                 timeout_s: Optional[float], prazo_s: float, origem: str = ""):
+        self.id = os.urandom(8).hex()
+        self.porta_vps = porta_vps
+        self.operacao = operacao
+        self.funcao = funcao
+        self.passos = passos  # [(escravo ou None, endereco, quantidade)]
+        self.timeout_s = timeout_s
+        self.origem = origem
+        self.recebido_em = time.time()
+        self.prazo = time.monotonic() + prazo_s
+        self.resultados: list = []
+        self.tempo_barramento = 0.0
+        self.resultado: Optional[Dict[str, Any]] = None
+        self.concluido = threading.Event()
+        self._lock = threading.Lock()
+
+    def expirado(self) -> bool:
+        return time.monotonic() > self.prazo
+
+    def cancelar(self, status: str):
+        self.concluir(status)
+
+    def executar(self, conexao: "ConexaoHF"):
+        if self.resultado is not None:
+            return
+        agora = time.monotonic()
+        liberado_em = _diagnostico_liberado_em.get(self.porta_vps, 0.0)
+        if agora < liberado_em:
+            agendador.adiar(liberado_em, conexao.fila, PRIORIDADE_DIAGNOSTICO, self)
+            return
+
+        escravo, endereco, quantidade = self.passos[len(self.resultados)]
+        resultado = {"escravo": escravo or conexao.endereco_modbus, "endereco": endereco}
+        try:
+            valores = conexao.ler_bloco_diagnostico(endereco, quantidade, self.funcao, escravo, self.timeout_s)
+            resultado["valores"] = list(valores)
+        except ErroModbus as e:
+            resultado["erro"] = e.classe
+            resultado["detalhe"] = str(e)
+        if self.operacao == "sondar":
+            # Exceção Modbus também prova que há um escravo no endereço
+            resultado["presente"] = "valores" in resultado or resultado.get("erro") == "excecao_modbus"
+        self.resultados.append(resultado)
+
+        gasto = time.monotonic() - agora
+        self.tempo_barramento += gasto
+        metricas.incrementar(self.porta_vps, "diagnostico_passos")
+        metricas.incrementar(self.porta_vps, "diagnostico_ms", int(gasto * 1000))
+        liberado_em = time.monotonic() + gasto * (1 - ORCAMENTO_BARRAMENTO_DIAGNOSTICO) / ORCAMENTO_BARRAMENTO_DIAGNOSTICO
+        _diagnostico_liberado_em[self.porta_vps] = liberado_em
+
+        if len(self.resultados) >= len(self.passos):
+            self.concluir("ok")
+        elif conexao.link_morto:
+            self.concluir("erro", detalhe="Link caiu durante o diagnóstico")
+        else:
+            agendador.adiar(liberado_em, conexao.fila, PRIORIDADE_DIAGNOSTICO, self)
+
+    def concluir(self, status: str, **detalhes) -> bool:
+        """Registra o resultado (uma única vez) e libera quem espera"""
+        with self._lock:
+            if self.resultado is not None:
+                return False
+            agora = time.time()
+            self.resultado = {
+                "id": self.id,
+                "porta_vps": self.porta_vps,
+                "operacao": self.operacao,
+                "funcao": self.funcao,
+                "origem": self.origem,
+                "recebido_em": iso_utc(self.recebido_em),
+                "concluido_em": iso_utc(agora),
+                "duracao_s": round(agora - self.recebido_em, 2),
+                "tempo_barramento_ms": round(self.tempo_barramento * 1000, 1),
+                "passos": len(self.passos),
+                "concluidos": len(self.resultados),
+                "status": status,
+                "resultados": list(self.resultados),
+                **detalhes,
+            }
+        metricas.incrementar(self.porta_vps, f"diagnosticos_{status}")
+        self.concluido.set()
+        return True
+
+
+def criar_diagnostico(corpo: Dict[str, Any], origem: str = "") -> Diagnostico:
+    """
+    Valida o JSON de POST /diagnostico e cria o Diagnostico. Levanta ValueError.
+
+    {"porta_vps": "15002", "operacao": "ler", "endereco": 0, "quantidade": 16}
+        Opcionais: "ate" (varre até este endereço em blocos de `quantidade`),
+        "funcao" (3 ou 4), "escravo" (padrão: endereco_modbus do gerador)
+    {"porta_vps": "15002", "operacao": "sondar", "escravos": [1, 2, 3]}
+        Opcionais: "endereco" (registrador lido em cada escravo, padrão 0),
+        "funcao", "timeout_s" (padrão TIMEOUT_SONDA)
+    Comuns: "prazo_s"
+    """
+    if not isinstance(corpo, dict) or "porta_vps" not in corpo:
+        raise ValueError("Campo obrigatório: porta_vps")
+
+    operacao = corpo.get("operacao", "ler")
+    funcao = int(corpo.get("funcao", 0x03))
+    endereco = int(corpo.get("endereco", 0))
+    prazo_s = float(corpo.get("prazo_s", PRAZO_DIAGNOSTICO_PADRAO))
+
+    if funcao not in (0x03, 0x04):
+        raise ValueError("funcao deve ser 3 (FC03) ou 4 (FC04)")
+    if not 0 <= endereco <= 0xFFFF:
+        raise ValueError("endereco fora da faixa 0x0000-0xFFFF")
+    if not 0 < prazo_s <= PRAZO_DIAGNOSTICO_MAX:
+        raise ValueError(f"prazo_s deve estar entre 0 e {PRAZO_DIAGNOSTICO_MAX}")
+
+    if operacao == "ler":
+        quantidade = int(corpo.get("quantidade", 16))
+        ate = int(corpo.get("ate", endereco + quantidade - 1))
+        escravo = int(corpo["escravo"]) if corpo.get("escravo") is not None else None
+        timeout_s = None
+        if not 1 <= quantidade <= 125:
+            raise ValueError("quantidade deve estar entre 1 e 125")
+        if not endereco <= ate <= 0xFFFF:
+            raise ValueError("ate deve estar entre endereco e 0xFFFF")
+        if escravo is not None and not 1 <= escravo <= 247:
+            raise ValueError("escravo deve estar entre 1 e 247")
+        passos = [
+            (escravo, inicio, min(quantidade, ate - inicio + 1))
+            for inicio in range(endereco, ate + 1, quantidade)
+        ]
+    elif operacao == "sondar":
+        escravos = corpo.get("escravos")
+        if not isinstance(escravos, list) or not escravos:
+            raise ValueError("Informe escravos (lista de endereços 1-247)")
+        escravos = [int(e) for e in escravos]
+        if any(not 1 <= e <= 247 for e in escravos):
+            raise ValueError("escravos devem estar entre 1 e 247")
+        timeout_s = float(corpo.get("timeout_s", TIMEOUT_SONDA))
+        if not 0 < timeout_s <= 5:
+            raise ValueError("timeout_s deve estar entre 0 e 5")
+        passos = [(e, endereco, 1) for e in escravos]
+    else:
+        raise ValueError("operacao deve ser 'ler' ou 'sondar'")
+
+    if len(passos) > MAX_PASSOS_DIAGNOSTICO:
+        raise ValueError(f"Máximo de {MAX_PASSOS_DIAGNOSTICO} transações por diagnóstico")
+
+    return Diagnostico(str(corpo["porta_vps"]), operacao, funcao, passos, timeout_s, prazo_s, origem)
+
+
+# =============================================================================
+# DESCOBERTA DO ENDEREÇO DO ESCRAVO (v2.27.0)
+# =============================================================================
+#
+# endereco_modbus errado é a primeira causa de "conecta mas não lê" (ver
+# docs/vps-modbus-scanner.py). Quando um HF2211 conecta e o ciclo termina
+# só com timeouts, sem nenhuma leitura desde a conexão, o próprio worker
+# sonda endereços (FC03 de 1 registrador em BLOCO1_ENDERECO, como a
+# sondagem do diagnóstico: sem retries e sem contar para o link_morto), do
+# mais provável para o menos provável:
+#
+#   1. o endereco_modbus configurado (se o link estava usando outro)
+#   2. endereços que responderam nos outros geradores (frota configurada igual)
+#   3. 1..10 (faixa do scanner), 247, 11..246
+#
+# Timeout adaptativo: DESCOBERTA_FATOR_TIMEOUT x o tempo de resposta já
+# medido (da porta; senão a mediana das outras), entre DESCOBERTA_TIMEOUT_MIN
+# e TIMEOUT_SONDA. O buffer é limpo antes de cada envio; resposta corrompida
+# (CRC/framing) indica resposta atrasada: o timeout dobra e o endereço é
+# sondado de novo. O link não está lendo nada nesse meio tempo, então a
+# varredura não usa o orçamento de barramento do diagnóstico.
+#
+# O endereço encontrado é confirmado com uma leitura no timeout normal e
+# gravado em DESCOBERTA_ARQUIVO (JSON por porta, com o endereco_modbus
+# configurado na época): reconexões e reinícios já começam nele, sem sondar.
+# Mudar o endereco_modbus do gerador invalida a entrada. Se nenhum endereço
+# responde, a porta só é varrida de novo após DESCOBERTA_PAUSA_FALHA.
+
+
+class CacheEnderecos:
+    """Endereços de escravo descobertos por porta, persistidos em JSON"""
+
+    def __init__(self, caminho: str = None):
+        self.caminho = caminho or DESCOBERTA_ARQUIVO
+        self._lock = threading.Lock()
+        self._entradas: Optional[Dict[str, Dict[str, Any]]] = None  # lido no primeiro uso
+
+    def _carregar(self) -> Dict[str, Dict[str, Any]]:
+        if self._entradas is None:
+            try:
+                with open(self.caminho, encoding="utf-8") as arquivo:
+                    self._entradas = json.load(arquivo)
+            except FileNotFoundError:
+                self._entradas = {}
+            except (OSError, ValueError) as e:
+                logger.warning(f"[Descoberta] {self.caminho} ignorado: {e}")
+                self._entradas = {}
+        return self._entradas
+
+    def endereco(self, porta_vps: str, configurado: int) -> Optional[int]:
+        """Endereço descoberto, se ainda vale para o endereco_modbus configurado"""
+        with self._lock:
+            entrada = self._carregar().get(porta_vps)
+        if entrada and entrada.get("configurado") == configurado:
+            return entrada["endereco"]
+        return None
+
+    def tempo_resposta(self, porta_vps: str) -> Optional[float]:
+        """Tempo de resposta medido na porta, ou a mediana das outras (s)"""
+        with self._lock:
+            entradas = self._carregar()
+            proprio = entradas.get(porta_vps, {}).get("resposta_ms")
+            tempos = sorted(e["resposta_ms"] for e in entradas.values() if e.get("resposta_ms"))
+        if proprio:
+            return proprio / 1000
+        return tempos[len(tempos) // 2] / 1000 if tempos else None
+
+    def enderecos_frota(self) -> List[int]:
+        """Endereços que responderam nos geradores, do mais comum ao menos comum"""
+        with self._lock:
+            contagem = Counter(e["endereco"] for e in self._carregar().values())
+        return [endereco for endereco, _ in contagem.most_common()]
+
+    def gravar(self, porta_vps: str, endereco: int, configurado: int, resposta_s: float):
+        with self._lock:
+            entradas = self._carregar()
+            entradas[porta_vps] = {
+                "endereco": endereco,
+                "configurado": configurado,
+                "resposta_ms": round(resposta_s * 1000, 1),
+                "descoberto_em": agora_iso_utc(),
+            }
+            diretorio = os.path.dirname(self.caminho)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            temporario = f"{self.caminho}.tmp"
+            with open(temporario, "w", encoding="utf-8") as arquivo:
+                json.dump(entradas, arquivo, indent=2, sort_keys=True)
+            os.replace(temporario, self.caminho)
+
+
+enderecos_escravo = CacheEnderecos()
+_descoberta_pausada_ate: Dict[str, float] = {}
+
+
+def ordem_sondagem(atual: int, configurado: int) -> List[int]:
+    """Endereços a sondar, do mais provável ao menos provável (sem o atual)"""
+    candidatos = [configurado, *enderecos_escravo.enderecos_frota(), *range(1, 11), 247, *range(11, 247)]
+    vistos = {atual}
+    ordem = []
+    for endereco in candidatos:
+        if endereco not in vistos:
+            vistos.add(endereco)
+            ordem.append(endereco)
+    return ordem
+
+
+def _sondar_endereco(conexao: "ConexaoHF", endereco: int, timeout: Optional[float]) -> bool:
+    """Um FC03 de 1 registrador; exceção Modbus também prova que o escravo existe"""
+    try:
+        conexao.ler_bloco_diagnostico(BLOCO1_ENDERECO, 1, 0x03, endereco, timeout)
+        return True
+    except ErroExcecaoModbus:
+        return True
+
+
+def descobrir_endereco(conexao: "ConexaoHF", configurado: int) -> Optional[int]:
+    """
+    Sonda endereços no link até um responder (chamado pelo worker, que é
+    dono do link). Atualiza conexao.endereco_modbus e o cache em disco.
+    """
+    porta_vps = conexao.porta_vps
+    if time.monotonic() < _descoberta_pausada_ate.get(porta_vps, 0.0):
+        return None
+    log = conexao.logger
+    referencia = enderecos_escravo.tempo_resposta(porta_vps)
+    timeout = TIMEOUT_SONDA if referencia is None else min(
+        max(referencia * DESCOBERTA_FATOR_TIMEOUT, DESCOBERTA_TIMEOUT_MIN), TIMEOUT_SONDA)
+    ordem = ordem_sondagem(conexao.endereco_modbus, configurado)
+    log.warning(f"Escravo {conexao.endereco_modbus} sem resposta: sondando {len(ordem)} endereço(s), "
+                f"timeout inicial {timeout * 1000:.0f}ms")
+
+    inicio = time.monotonic()
+    sondas = 0
+    encontrado = None
+    for endereco in ordem:
+        while True:
+            sondas += 1
+            try:
+                presente = _sondar_endereco(conexao, endereco, timeout)
+            except (ErroCRC, ErroFraming):
+                if timeout < TIMEOUT_SONDA:
+                    timeout = min(timeout * 2, TIMEOUT_SONDA)
+                    continue
+                presente = False
+            except ErroModbus:
+                presente = False
+            break
+        if not conexao.cliente_conectado:
+            log.warning("Link caiu durante a sondagem de endereços")
+            metricas.incrementar(porta_vps, "descoberta_sondas", sondas)
+            return None
+        if not presente:
+            continue
+        # Confirmação no timeout normal do link, que também mede a resposta
+        antes = time.monotonic()
+        try:
+            sondas += 1
+            if _sondar_endereco(conexao, endereco, None):
+                encontrado = endereco
+                resposta_s = time.monotonic() - antes
+                break
+        except ErroModbus as e:
+            log.warning(f"Escravo {endereco} respondeu à sonda mas não à confirmação [{e.classe}]")
+
+    duracao = time.monotonic() - inicio
+    metricas.incrementar(porta_vps, "descoberta_sondas", sondas)
+    if encontrado is None:
+        _descoberta_pausada_ate[porta_vps] = time.monotonic() + DESCOBERTA_PAUSA_FALHA
+        metricas.incrementar(porta_vps, "descobertas_sem_resposta")
+        log.error(f"Nenhum escravo respondeu ({sondas} sondas em {duracao:.1f}s); "
+                  f"nova varredura em {DESCOBERTA_PAUSA_FALHA}s. Verifique cabo, baudrate e Modbus no K30XL")
         return None
+
+    conexao.endereco_modbus = encontrado
+    conexao.timeouts_consecutivos = 0
+    conexao.ultimo_erro = None
+    metricas.incrementar(porta_vps, "descobertas_endereco")
+    try:
+        enderecos_escravo.gravar(porta_vps, encontrado, configurado, resposta_s)
+    except OSError as e:
+        log.error(f"[Descoberta] Falha ao gravar {enderecos_escravo.caminho}: {e}")
+    log.warning(f"Escravo encontrado no endereço {encontrado} ({sondas} sondas em {duracao:.1f}s, "
+                f"resposta {resposta_s * 1000:.0f}ms). Ajuste endereco_modbus de {configurado} para "
+                f"{encontrado} em GERADORES_CONFIG; até lá vale o cache {enderecos_escravo.caminho}")
+    return encontrado
+
+
+# =============================================================================
+# CACHE DE REGISTRADORES (v2.23.0)
+# =============================================================================
+#
+# Toda resposta de leitura do link (polling, retries, diagnóstico, leitura de
+# volta de comandos) fica guardada como bloco bruto, inclusive registradores
+# que o polling só loga (0x000A, 0x000C, reservados 0x0011/0x0012). Consultas
+# (GET /registradores, consultar_registradores) informam a idade máxima
+# aceitável: o que estiver no cache e dentro da idade volta sem tocar o
+# barramento. O resto vira uma LeituraCache na fila do link; pedidos
+# concorrentes cobertos pela mesma faixa esperam a mesma transação.
+#
+# Os blocos são trocados por cópia (copy-on-write) só pela thread do worker;
+# as consultas das threads HTTP leem a lista sem lock.
+
+_leituras_cache_lock = threading.Lock()
+# LeituraCache em andamento por porta (fora da conexão: ORCAMENTO_MEMORIA_CONEXAO)
+_leituras_pendentes: Dict[str, list] = {}
+
+
+class CacheRegistradores:
+    """Blocos lidos de um link: (escravo, funcao, inicio, valores, instante), o mais novo primeiro"""
+
+    __slots__ = ("blocos",)
+
+    def __init__(self):
+        self.blocos: tuple = ()
+
+    def atualizar(self, escravo: int, funcao: int, inicio: int, valores: array):
+        """Chamado pela thread do worker a cada resposta de leitura"""
+        chave = (escravo, funcao, inicio, len(valores))
+        antigos = [b for b in self.blocos if (b[0], b[1], b[2], len(b[3])) != chave]
+        self.blocos = ((escravo, funcao, inicio, valores, time.monotonic()),
+                       *antigos[:CACHE_REGISTRADORES_MAX_BLOCOS - 1])
+
+    def invalidar(self, escravo: int, endereco: int, quantidade: int):
+        """Descarta os blocos FC03 que cobrem registradores escritos"""
+        fim = endereco + quantidade
+        self.blocos = tuple(
+            b for b in self.blocos
+            if not (b[0] == escravo and b[1] == 0x03 and b[2] < fim and endereco < b[2] + len(b[3]))
+        )
+
+    def consultar(self, escravo: int, funcao: int, endereco: int, quantidade: int) -> list:
+        """[(valor, instante) ou None] por registrador, do bloco mais novo que o cobre"""
+        blocos = [b for b in self.blocos if b[0] == escravo and b[1] == funcao]
+        resultado = []
+        for registrador in range(endereco, endereco + quantidade):
+            for _, _, inicio, valores, instante in blocos:
+                if inicio <= registrador < inicio + len(valores):
+                    resultado.append((valores[registrador - inicio], instante))
+                    break
+            else:
+                resultado.append(None)
+        return resultado
+
+
+class LeituraCache:
+    """Leitura de uma faixa ausente ou velha no cache, compartilhada por pedidos concorrentes"""
+
+    __slots__ = ("cache", "porta_vps", "funcao", "endereco", "quantidade",
+                 "pedido_em", "prazo", "erro", "compartilhada", "concluido")
+
+    def __init__(self, cache: CacheRegistradores, porta_vps: str, funcao: int,
+                 endereco: int, quantidade: int, prazo_s: float):
+        self.cache = cache
+        self.porta_vps = porta_vps
+        self.funcao = funcao
+        self.endereco = endereco
+        self.quantidade = quantidade
+        self.pedido_em = time.monotonic()
+        self.prazo = self.pedido_em + prazo_s
+        self.erro: Optional[str] = None
+        self.compartilhada = 0  # pedidos que aproveitaram esta leitura
+        self.concluido = threading.Event()
+
+    def expirado(self) -> bool:
+        return time.monotonic() > self.prazo
+
+    def cancelar(self, status: str):
+        self.erro = status
+        self._encerrar()
+
+    def executar(self, conexao: "ConexaoHF"):
+        # Um polling pode ter renovado a faixa enquanto o pedido esperava na fila
+        valores = self.cache.consultar(conexao.endereco_modbus, self.funcao, self.endereco, self.quantidade)
+        if all(v is not None and v[1] >= self.pedido_em for v in valores):
+            self._encerrar()
+            return
+
+        agora = time.monotonic()
+        liberado_em = _diagnostico_liberado_em.get(self.porta_vps, 0.0)
+        if agora < liberado_em:
+            agendador.adiar(liberado_em, conexao.fila, PRIORIDADE_DIAGNOSTICO, self)
+            return
+
+        try:
+            conexao.ler_bloco_diagnostico(self.endereco, self.quantidade, self.funcao)
+        except ErroModbus as e:
+            self.erro = e.classe
+        gasto = time.monotonic() - agora
+        metricas.incrementar(self.porta_vps, "cache_leituras")
+        _diagnostico_liberado_em[self.porta_vps] = (
+            time.monotonic() + gasto * (1 - ORCAMENTO_BARRAMENTO_DIAGNOSTICO) / ORCAMENTO_BARRAMENTO_DIAGNOSTICO
+        )
+        self._encerrar()
+
+    def _encerrar(self):
+        with _leituras_cache_lock:
+            pendentes = _leituras_pendentes.get(self.porta_vps, [])
+            if self in pendentes:
+                pendentes.remove(self)
+        self.concluido.set()
+
+
+def consultar_registradores(conexao: "ConexaoHF", endereco: int, quantidade: int, idade_max: float,
+                            funcao: int = 0x03, prazo_s: float = PRAZO_LEITURA_CACHE) -> Dict[str, Any]:
+    """
+    Valores de `quantidade` registradores a partir de `endereco` com no máximo
+    `idade_max` segundos. "origem": cache (sem transação), leitura (este pedido
+    leu o link) ou compartilhada (aproveitou a leitura de outro pedido).
+    "status": ok, sem_conexao, fila_cheia, prazo_expirado ou a classe do erro
+    Modbus; fora do ok, os valores do cache voltam mesmo velhos.
+    """
+    cache = conexao.cache
+    escravo = conexao.endereco_modbus
+
+    def resultado(status: str, origem: str, **detalhes) -> Dict[str, Any]:
+        agora = time.monotonic()
+        registradores = []
+        for registrador, valor in zip(range(endereco, endereco + quantidade),
+                                      cache.consultar(escravo, funcao, endereco, quantidade)):
+            item = {"endereco": registrador, "hex": f"0x{registrador:04X}"}
+            if valor is not None:
+                item["valor"] = valor[0]
+                item["idade_s"] = round(agora - valor[1], 3)
+            registradores.append(item)
+        return {"porta_vps": conexao.porta_vps, "escravo": escravo, "funcao": funcao,
+                "status": status, "origem": origem, "registradores": registradores, **detalhes}
+
+    agora = time.monotonic()
+    valores = cache.consultar(escravo, funcao, endereco, quantidade)
+    if all(v is not None and agora - v[1] <= idade_max for v in valores):
+        metricas.incrementar(conexao.porta_vps, "cache_hits")
+        return resultado("ok", "cache")
+    metricas.incrementar(conexao.porta_vps, "cache_misses")
+    if conexao.link_morto:
+        return resultado("sem_conexao", "cache")
+
+    fim = endereco + quantidade
+    with _leituras_cache_lock:
+        pendentes = _leituras_pendentes.setdefault(conexao.porta_vps, [])
+        leitura = next((p for p in pendentes
+                        if p.funcao == funcao and p.endereco <= endereco and fim <= p.endereco + p.quantidade), None)
+        if leitura is not None:
+            leitura.compartilhada += 1
+            origem = "compartilhada"
+        elif len(conexao.fila) >= MAX_COMANDOS_PENDENTES:
+            return resultado("fila_cheia", "cache")
+        else:
+            leitura = LeituraCache(cache, conexao.porta_vps, funcao, endereco, quantidade, prazo_s)
+            pendentes.append(leitura)
+            origem = "leitura"
+    if origem == "leitura":
+        conexao.fila.colocar(PRIORIDADE_DIAGNOSTICO, leitura)
+    else:
+        metricas.incrementar(conexao.porta_vps, "cache_compartilhadas")
+
+    if not leitura.concluido.wait(max(leitura.prazo - time.monotonic(), 0) + 2 * conexao.timeout):
+        return resultado("prazo_expirado", origem)
+    if leitura.erro:
+        return resultado(leitura.erro, origem)
+    return resultado("ok", origem)
+
+
+# =============================================================================
+# USO DO LINK SERIAL (v2.24.0)
+# =============================================================================
+#
+# Cada HF2211 faz a ponte para uma linha RS-232 de BAUDRATE_SERIAL. Por
+# transação são contados os bytes no fio (frames RTU; no Modbus TCP, o
+# equivalente RTU que o gateway repassa: PDU + endereço + CRC) e o tempo em
+# que o link ficou ocupado, do envio até a resposta ou o timeout.
+#
+#   fio         caracteres * BITS_POR_CARACTERE / baud, mais o silêncio de
+#               3,5 caracteres antes de cada frame (requisição e resposta)
+#   ocupação    tempo medido da transação: fio + turnaround (processamento do
+#               escravo, ida e volta pela internet até o HF2211)
+#
+# GET /metricas → serial traz a fração do tempo de fio e de ocupação na
+# janela recente (JANELA_USO_SERIAL) e o turnaround médio por transação.
+# O planejador offline (--planejar) usa o mesmo modelo.
+
+def tempo_fio_s(tx: int, rx: int, transacoes: int = 1, baudrate: int = BAUDRATE_SERIAL) -> float:
+    """Segundos de linha serial para `tx` + `rx` bytes em `transacoes` pares de frames"""
+    caracteres = tx + rx + 2 * transacoes * SILENCIO_RTU_CARACTERES
+    return caracteres * BITS_POR_CARACTERE / baudrate
+
+
+class UsoLinkSerial:
+    """Fio e ocupação por link em baldes de tempo (janela deslizante)"""
+
+    CAMPOS = 4  # por balde: id do balde, transações, fio (s), ocupação (s)
+
+    def __init__(self, janela: float = JANELA_USO_SERIAL, baldes: int = BALDES_USO_SERIAL):
+        self.janela = janela
+        self._baldes = baldes
+        self._duracao_balde = janela / baldes
+        self._lock = threading.Lock()
+        self._links: Dict[str, tuple] = {}  # porta → (primeiro registro, array('d') dos baldes)
+
+    def registrar(self, porta_vps: str, tx: int, rx: int, ocupado_s: float, transacoes: int = 1):
+        fio = tempo_fio_s(tx, rx, transacoes)
+        agora = time.monotonic()
+        balde = agora // self._duracao_balde
+        with self._lock:
+            link = self._links.get(porta_vps)
+            if link is None:
+                link = self._links[porta_vps] = (agora, array("d", [-1.0, 0.0, 0.0, 0.0] * self._baldes))
+            valores = link[1]
+            i = int(balde % self._baldes) * self.CAMPOS
+            if valores[i] != balde:
+                valores[i:i + self.CAMPOS] = array("d", (balde, 0.0, 0.0, 0.0))
+            valores[i + 1] += transacoes
+            valores[i + 2] += fio
+            valores[i + 3] += ocupado_s
+
+        metricas.incrementar(porta_vps, "serial_transacoes", transacoes)
+        metricas.incrementar(porta_vps, "serial_bytes_tx", tx)
+        metricas.incrementar(porta_vps, "serial_bytes_rx", rx)
+        metricas.incrementar(porta_vps, "serial_fio_us", int(fio * 1e6))
+        metricas.incrementar(porta_vps, "serial_ocupado_us", int(ocupado_s * 1e6))
+
+    def instantaneo(self) -> Dict[str, Dict[str, Any]]:
+        agora = time.monotonic()
+        atual = agora // self._duracao_balde
+        resultado = {}
+        with self._lock:
+            links = [(porta, primeiro, array("d", valores)) for porta, (primeiro, valores) in self._links.items()]
+        for porta, primeiro, valores in links:
+            transacoes = fio = ocupado = 0.0
+            for i in range(0, len(valores), self.CAMPOS):
+                if valores[i] > atual - self._baldes:
+                    transacoes += valores[i + 1]
+                    fio += valores[i + 2]
+                    ocupado += valores[i + 3]
+            # Janela coberta: baldes completos + o atual, limitada ao tempo desde o 1º registro
+            duracao = min((self._baldes - 1) * self._duracao_balde + agora % self._duracao_balde,
+                          agora - primeiro) or 1e-9
+            resultado[porta] = {
+                "janela_s": round(duracao, 1),
+                "transacoes": int(transacoes),
+                "utilizacao_fio": round(fio / duracao, 4),
+                "ocupacao_link": round(ocupado / duracao, 4),
+                "folga": round(max(1 - ocupado / duracao, 0.0), 4),
+                "turnaround_medio_ms": round((ocupado - fio) / transacoes * 1000, 1) if transacoes else None,
+            }
+        return resultado
+
+
+uso_serial = UsoLinkSerial()
+
+
+# =============================================================================
+# GERENCIADOR DE CONEXÕES TCP (MODO ATIVO)
+# =============================================================================
+
+class ConexaoHF:
+    """
+    Gerencia uma conexão TCP de um HF2211.
+
+    v2.10.0: __slots__ e apenas os campos de config usados no polling; o
+    logger é obtido sob demanda (o módulo logging mantém o cache por nome).
+    """
+
+    __slots__ = (
+        "porta_vps",
+        "porta_escuta",
+        "endereco_modbus",
+        "timeout",
+        "socket_servidor",
+        "socket_cliente",
+        "cliente_conectado",
+        "ultimo_dado",
+        "transporte",
+        "_proximo_tid",
+        "ultimo_erro",
+        "timeouts_consecutivos",
+        "fila",
+        "cache",
+    )
     
-    def enviar_comando_modbus_rtu(self, funcao: int, endereco: int, quantidade: int) -> Optional[bytes]:
+    def __init__(self, porta_vps: str, config: Dict[str, Any]):
+        self.porta_vps = porta_vps
+        self.porta_escuta: int = config["porta_escuta"]
+        self.endereco_modbus: int = config["endereco_modbus"]
+        self.timeout: float = config["timeout"]
+        self.socket_servidor: Optional[socket.socket] = None
+        self.socket_cliente: Optional[socket.socket] = None
+        self.cliente_conectado = False
+        self.ultimo_dado: Optional[Leitura] = None
+        self.transporte: str = config.get("transporte", "rtu")
+        self._proximo_tid = 0
+        self.ultimo_erro: Optional[str] = None  # classe do último ErroModbus
+        self.timeouts_consecutivos = 0
+        self.fila = FilaTrabalho()  # v2.13.0: comandos e trabalhos do link
+        self.cache = CacheRegistradores()  # v2.23.0: toda resposta de leitura
+
+    @property
+    def logger(self) -> logging.Logger:
+        return logging.getLogger(f"HF-{self.porta_vps}")
+
+    @property
+    def link_morto(self) -> bool:
         """
-        Envia comando Modbus RTU e recebe resposta sincronizada.
-        
-        CORREÇÃO v2.2.0: Usa sincronização por marcador em vez de leitura direta.
+        NOVO v2.12.0: Só o socket fechado ou uma sequência de timeouts indica
+        link morto. Erros de CRC/framing/exceção provam que o HF2211 responde
+        e não derrubam a conexão.
         """
-        if not self.cliente_conectado or not self.socket_cliente:
-            return None
-        
-        slave_addr = self.config["endereco_modbus"]
-        
-        # Monta frame: Slave + FC + Addr(Hi) + Addr(Lo) + Qty(Hi) + Qty(Lo)
-        pdu = bytes([
-            slave_addr,
-            funcao,
-            (endereco >> 8) & 0xFF,
-            endereco & 0xFF,
-            (quantidade >> 8) & 0xFF,
-            quantidade & 0xFF,
-        ])
-        
-        # Calcula e adiciona CRC-16 (little-endian)
-        crc = self.calcular_crc16(pdu)
-        frame = pdu + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
-        
+        return (
+            not self.cliente_conectado
+            or self.timeouts_consecutivos >= LIMITE_TIMEOUTS_CONSECUTIVOS
+        )
+
+    def desconectar(self):
+        """Fecha o socket do cliente para aguardar nova conexão do HF2211"""
+        if self.socket_cliente:
+            try:
+                self.socket_cliente.close()
+            except OSError:
+                pass
+        self.socket_cliente = None
+        self.cliente_conectado = False
+    
+    def abortar(self):
+        """
+        NOVO v2.18.0: Chamado pelo watchdog (outra thread). O shutdown faz o
+        recv bloqueado do worker retornar; o próprio worker fecha o socket.
+        """
+        sock = self.socket_cliente
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.cliente_conectado = False
+    
+    def iniciar_servidor(self) -> bool:
+        """Inicia o servidor TCP na porta especificada"""
         try:
-            # Limpa buffer antes de enviar
-            self.limpar_buffer_socket()
-            
-            self.logger.info(f"TX RTU: {frame.hex(' ').upper()}")
-            self.socket_cliente.send(frame)
-            
-            # CORREÇÃO: Usa sincronização por marcador
-            resposta = self.sincronizar_resposta(slave_addr, quantidade * 2)
+            self.socket_servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket_servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket_servidor.settimeout(5.0)
+            self.socket_servidor.bind((VPS_IP, self.porta_escuta))
+            self.socket_servidor.listen(1)
             
-            return resposta
+            self.logger.info(f"Servidor TCP iniciado na porta {self.porta_escuta}")
+            return True
             
-        except socket.timeout:
-            self.logger.error("Erro Modbus: timed out")
-            return None
         except Exception as e:
-            self.logger.error(f"Erro na comunicação: {e}")
-            self.cliente_conectado = False
-            return None
+            self.logger.error(f"Erro ao iniciar servidor: {e}")
+            self.ultimo_erro = f"servidor: {e}"
+            if self.socket_servidor:
+                self.socket_servidor.close()
+                self.socket_servidor = None
+            return False
+    
+    def aceitar_conexao(self) -> bool:
+        """Aceita conexão de um HF2211"""
+        try:
+            novo_socket, endereco = self.socket_servidor.accept()
+            self.desconectar()
+            self.socket_cliente = novo_socket
+            self.socket_cliente.settimeout(self.timeout)
+            self.cliente_conectado = True
+            self.timeouts_consecutivos = 0
+            self.ultimo_erro = None
+            metricas.incrementar(self.porta_vps, "conexoes")
+            anterior = clientes_hf.get(self.porta_vps)
+            clientes_hf[self.porta_vps] = f"{endereco[0]}:{endereco[1]}"
+            self.logger.info(f"HF2211 conectado de {endereco}"
+                             + (f" (antes: {anterior})" if anterior and anterior.split(":")[0] != endereco[0] else ""))
+            marcar_partida("conexao")
+            return True
+            
+        except socket.timeout:
+            return False
+        except Exception as e:
+            self.logger.error(f"Erro ao aceitar conexão: {e}")
+            return False
+    
+    def calcular_crc16(self, dados: bytes) -> int:
+        """
+        Calcula CRC-16 Modbus (polinômio 0xA001).
+        Usado para frames Modbus RTU.
+        """
+        crc = 0xFFFF
+        for byte in dados:
+            crc ^= byte
+            for _ in range(8):
+                if crc & 0x0001:
+                    crc = (crc >> 1) ^ 0xA001
+                else:
+                    crc >>= 1
+        return crc
     
-    def ler_bloco_registradores(self, endereco_inicial: int, quantidade: int) -> Optional[list]:
+    def limpar_buffer_socket(self):
+        """
+        Limpa bytes residuais do socket antes de nova leitura.
         """
-        Lê um bloco de registradores holding (função 0x03) usando Modbus RTU.
-        Retorna lista de valores inteiros ou None em caso de erro.
+        if not self.socket_cliente:
+            return
         
-        CORREÇÃO v2.4.1: Verifica conexão antes de tentar ler
+        try:
+            self.socket_cliente.setblocking(False)
+            bytes_descartados = 0
+            while True:
+                try:
+                    lixo = self.socket_cliente.recv(256)
+                    if lixo:
+                        bytes_descartados += len(lixo)
+                        self.logger.warning(f"Lixo no buffer (pré-comando): {lixo.hex(' ').upper()}")
+                    else:
+                        break
+                except BlockingIOError:
+                    break
+            
+            self.socket_cliente.setblocking(True)
+            self.socket_cliente.settimeout(self.timeout)
+            
+            if bytes_descartados > 0:
+                self.logger.warning(f"Total de {bytes_descartados} bytes residuais limpos")
+                
+        except Exception as e:
+            self.logger.debug(f"Erro ao limpar buffer: {e}")
+
+    def _receber_rtu(self, tamanho: int, limite_s: float) -> bytes:
+        """Lê exatamente `tamanho` bytes do frame RTU em até `limite_s` segundos"""
+        recebido = bytearray()
+        tempo_inicio = time.time()
+        while len(recebido) < tamanho and time.time() - tempo_inicio < limite_s:
+            try:
+                chunk = self.socket_cliente.recv(tamanho - len(recebido))
+            except socket.timeout:
+                continue
+            except OSError as e:
+                raise ErroConexaoFechada(f"Erro na recepção: {e}")
+            if not chunk:
+                raise ErroConexaoFechada("Conexão fechada pelo HF2211")
+            recebido.extend(chunk)
+
+        if len(recebido) < tamanho:
+            raise ErroFraming(f"Dados incompletos: {len(recebido)}/{tamanho}")
+        return bytes(recebido)
+
+    def sincronizar_resposta(self, slave_addr: int, tamanho_dados: int, funcao: int = 0x03) -> bytes:
         """
-        # CORREÇÃO v2.4.1: Verificar conexão antes de tentar ler
-        if not self.cliente_conectado or not self.socket_cliente:
-            self.logger.warning("Sem conexão - aguardando HF2211...")
-            return None
+        CORREÇÃO v2.2.0: Sincroniza a leitura buscando o padrão de início Modbus.
+        Descarta bytes de lixo até encontrar: [ADDR][FC][BYTECOUNT]
         
-        resposta = self.enviar_comando_modbus_rtu(0x03, endereco_inicial, quantidade)
+        v2.12.0: Reconhece também a resposta de exceção [ADDR][FC|0x80][EC]
+        e levanta erros classificados em vez de retornar None.
         
-        if not resposta:
-            return None
+        Args:
+            slave_addr: Endereço do escravo Modbus (geralmente 1)
+            tamanho_dados: Quantidade de bytes de dados esperados (qty * 2)
+            funcao: Function code da requisição
         
-        # Resposta Modbus RTU: [Slave (1)] [FC (1)] [ByteCount (1)] [Data (N*2)] [CRC (2)]
-        if len(resposta) < 5:
-            self.logger.error(f"Resposta muito curta: {len(resposta)} bytes")
-            return None
+        Returns:
+            Frame Modbus completo (validação de CRC fica com o chamador)
         
-        slave_addr = resposta[0]
-        function_code = resposta[1]
+        Raises:
+            ErroTimeout, ErroFraming, ErroConexaoFechada
+        """
+        if not self.socket_cliente:
+            raise ErroConexaoFechada("Sem socket do HF2211")
         
-        # Verificar erro Modbus (function code com bit 7 setado)
-        if function_code & 0x80:
-            error_code = resposta[2] if len(resposta) > 2 else 0
-            self.logger.error(f"Exceção Modbus: FC=0x{function_code:02X}, EC=0x{error_code:02X}")
-            return None
+        buffer = bytearray()
+        lixo_descartado = 0
+        tempo_inicio = time.time()
+        espera_ns = time.monotonic_ns()
+        primeiro_byte_ns = 0
+        tamanho_total = 3 + tamanho_dados + 2  # ADDR + FC + BYTECOUNT + DATA + CRC
         
-        byte_count = resposta[2]
-        expected_bytes = quantidade * 2
+        self.logger.debug(f"Sincronizando resposta (esperando {tamanho_total} bytes)...")
         
-        self.logger.debug(f"Slave={slave_addr}, FC=0x{function_code:02X}, ByteCount={byte_count}")
+        while time.time() - tempo_inicio < self.timeout:
+            try:
+                byte = self.socket_cliente.recv(1)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                raise ErroConexaoFechada(f"Erro na sincronização: {e}")
+            
+            if not byte:
+                raise ErroConexaoFechada("Conexão fechada pelo HF2211")
+                
+            buffer.append(byte[0])
+            if not primeiro_byte_ns:
+                primeiro_byte_ns = time.monotonic_ns()
+                registrar_span("ttfb", espera_ns, primeiro_byte_ns)
+            
+            # Procura padrão de início: [ADDR] [FC] ou [ADDR] [FC | 0x80]
+            if len(buffer) >= 2 and buffer[-2] == slave_addr and buffer[-1] in (funcao, funcao | 0x80):
+                # Calcula lixo descartado
+                if len(buffer) > 2:
+                    lixo_descartado = len(buffer) - 2
+                    self.logger.warning(f"Bytes de LIXO descartados ({lixo_descartado}): {_Hex(bytes(buffer[:-2]))}")
+                    buffer = buffer[-2:]
+                
+                if buffer[1] & 0x80:
+                    # Exceção: [ADDR] [FC|0x80] [EC] [CRC (2)]
+                    buffer.extend(self._receber_rtu(3, 2.0))
+                elif funcao in FUNCOES_ESCRITA:
+                    # Eco da escrita: [ADDR] [FC] [Reg (2)] [Valor/Qtd (2)] [CRC (2)]
+                    buffer.extend(self._receber_rtu(6, 2.0))
+                else:
+                    # Lê o byte count
+                    byte_count = self._receber_rtu(1, 2.0)[0]
+                    buffer.append(byte_count)
+                    
+                    # Verifica se byte count faz sentido
+                    if byte_count != tamanho_dados:
+                        self.logger.warning(f"Byte count diferente: recebido={byte_count}, esperado={tamanho_dados}")
+                    
+                    # Lê dados + CRC
+                    buffer.extend(self._receber_rtu(byte_count + 2, 2.0))
+                
+                frame_completo = bytes(buffer)
+                registrar_span("sincronizacao", primeiro_byte_ns, time.monotonic_ns(),
+                               lixo_descartado=lixo_descartado)
+                
+                self.logger.info("RX RTU (%d bytes): %s", len(frame_completo), _Hex(frame_completo))
+                
+                if lixo_descartado > 0:
+                    self.logger.info(f">>> Frame sincronizado após descartar {lixo_descartado} bytes de lixo")
+                
+                return frame_completo
+            
+            # Limite de segurança
+            if len(buffer) > 100:
+                self.logger.error(f"Buffer: {_Hex(bytes(buffer))}")
+                raise ErroFraming(f"Muitos bytes ({len(buffer)}) sem encontrar padrão válido")
+        
+        raise ErroTimeout("Timeout na sincronização")
+    
+    def enviar_comando_modbus_rtu(self, funcao: int, endereco: int, quantidade: int) -> bytes:
+        """
+        Envia comando Modbus RTU e recebe resposta sincronizada.
+        
+        CORREÇÃO v2.2.0: Usa sincronização por marcador em vez de leitura direta.
+        v2.12.0: Levanta erros classificados (ErroModbus) em vez de retornar None.
+        """
+        # PDU: FC + Addr(Hi) + Addr(Lo) + Qty(Hi) + Qty(Lo)
+        pdu = struct.pack(">BHH", funcao, endereco, quantidade)
+        return self._transacao_rtu(pdu, quantidade * 2)
+    
+    def _transacao_rtu(self, pdu: bytes, tamanho_dados: int) -> bytes:
+        """Envia [Slave] + PDU + CRC e retorna o frame de resposta sincronizado"""
+        if not self.cliente_conectado or not self.socket_cliente:
+            raise ErroConexaoFechada("Sem conexão")
+        
+        slave_addr = self.endereco_modbus
+        
+        # Calcula e adiciona CRC-16 (little-endian)
+        frame = bytes([slave_addr]) + pdu
+        crc = self.calcular_crc16(frame)
+        frame += bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+        
+        # Limpa buffer antes de enviar
+        with span("limpar_buffer"):
+            self.limpar_buffer_socket()
+        
+        self.logger.info("TX RTU: %s", _Hex(frame))
+        inicio_ns = time.monotonic_ns()
+        recebidos = 0
+        try:
+            try:
+                with span("tx", bytes=len(frame)):
+                    self.socket_cliente.send(frame)
+            except socket.timeout:
+                raise ErroTimeout("Timeout no envio")
+            except OSError as e:
+                raise ErroConexaoFechada(f"Erro no envio: {e}")
+            
+            # CORREÇÃO: Usa sincronização por marcador
+            resposta = self.sincronizar_resposta(slave_addr, tamanho_dados, pdu[0])
+            recebidos = len(resposta)
+            return resposta
+        finally:
+            self._contabilizar_serial(len(frame), recebidos, inicio_ns)
+    
+    def _validar_frame_rtu(self, resposta: bytes) -> bytes:
+        """Confere tamanho, CRC e exceção Modbus do frame RTU. Levanta ErroModbus."""
+        if len(resposta) < 5:
+            raise ErroFraming(f"Resposta muito curta: {len(resposta)} bytes")
         
         # Verificar CRC da resposta
         dados_sem_crc = resposta[:-2]
@@ -454,23 +2242,405 @@ class ConexaoHF:
         crc_calculado = self.calcular_crc16(dados_sem_crc)
         
         if crc_recebido != crc_calculado:
-            self.logger.error(f"CRC INVÁLIDO: recebido=0x{crc_recebido:04X}, calculado=0x{crc_calculado:04X}")
-            self.logger.error(f"Resposta DESCARTADA: {resposta.hex(' ').upper()}")
-            return None
+            self.logger.error(f"Resposta DESCARTADA: {_Hex(resposta)}")
+            raise ErroCRC(f"CRC INVÁLIDO: recebido=0x{crc_recebido:04X}, calculado=0x{crc_calculado:04X}")
         
-        self.logger.info(f"CRC OK: 0x{crc_recebido:04X}")
+        # Verificar erro Modbus (function code com bit 7 setado)
+        if resposta[1] & 0x80:
+            raise ErroExcecaoModbus(resposta[1], resposta[2])
         
-        # Extrair valores (big-endian unsigned 16-bit)
-        valores = []
-        dados = resposta[3:3 + byte_count]
+        self.logger.info("CRC OK: 0x%04X", crc_recebido)
+        return resposta
+    
+    def _ler_bloco_rtu(self, endereco_inicial: int, quantidade: int, funcao: int) -> array:
+        """Uma tentativa de leitura RTU. Levanta ErroModbus em caso de falha."""
+        resposta = self._validar_frame_rtu(
+            self.enviar_comando_modbus_rtu(funcao, endereco_inicial, quantidade)
+        )
+        
+        # Resposta Modbus RTU: [Slave (1)] [FC (1)] [ByteCount (1)] [Data (N*2)] [CRC (2)]
+        slave_addr = resposta[0]
+        function_code = resposta[1]
+        byte_count = resposta[2]
+        
+        self.logger.debug(f"Slave={slave_addr}, FC=0x{function_code:02X}, ByteCount={byte_count}")
         
-        for i in range(0, len(dados), 2):
-            if i + 1 < len(dados):
-                valor = (dados[i] << 8) | dados[i + 1]
-                valores.append(valor)
+        # Extrair valores (big-endian unsigned 16-bit) em array compacto
+        dados = resposta[3:3 + byte_count]
+        valores = array("H", dados[:len(dados) & ~1])
+        if sys.byteorder == "little":
+            valores.byteswap()
         
         return valores
     
+    def _ler_bloco(self, endereco_inicial: int, quantidade: int, funcao: int) -> array:
+        if self.transporte == "tcp":
+            valores = self.ler_blocos_mbap([(endereco_inicial, quantidade)], funcao)[0]
+            if isinstance(valores, ErroModbus):
+                raise valores
+        else:
+            valores = self._ler_bloco_rtu(endereco_inicial, quantidade, funcao)
+        self.cache.atualizar(self.endereco_modbus, funcao, endereco_inicial, valores)
+        return valores
+    
+    def _contabilizar_serial(self, tx: int, rx: int, inicio_ns: int, transacoes: int = 1):
+        """NOVO v2.24.0: bytes no fio serial e ocupação do link (envio até resposta/timeout)"""
+        if transacoes:
+            uso_serial.registrar(self.porta_vps, tx, rx, (time.monotonic_ns() - inicio_ns) / 1e9, transacoes)
+    
+    def _registrar_sucesso(self):
+        self.timeouts_consecutivos = 0
+        self.ultimo_erro = None
+        metricas.incrementar(self.porta_vps, "blocos_ok")
+    
+    def _registrar_falha(self, erro: "ErroModbus"):
+        self.ultimo_erro = erro.classe
+        metricas.incrementar(self.porta_vps, f"erros_{erro.classe}")
+        if erro.classe == "timeout":
+            self.timeouts_consecutivos += 1
+        else:
+            # Houve resposta (mesmo inválida): o link está vivo
+            self.timeouts_consecutivos = 0
+        if erro.classe == "conexao_fechada":
+            self.cliente_conectado = False
+    
+    def ler_bloco_registradores(self, endereco_inicial: int, quantidade: int,
+                                funcao: int = 0x03, erro_inicial: "ErroModbus" = None) -> Optional[array]:
+        """
+        Lê um bloco de registradores (função 0x03 por padrão).
+        Retorna array('H') com os valores ou None em caso de erro.
+        
+        CORREÇÃO v2.4.1: Verifica conexão antes de tentar ler
+        v2.12.0: Repete a leitura conforme POLITICAS_RETRY da classe do erro.
+        `erro_inicial` conta como a primeira tentativa (ex: falha no pipeline MBAP).
+        """
+        # CORREÇÃO v2.4.1: Verificar conexão antes de tentar ler
+        if not self.cliente_conectado or not self.socket_cliente:
+            self.logger.warning("Sem conexão - aguardando HF2211...")
+            return None
+        
+        erro = erro_inicial
+        repeticoes = 0
+        
+        while True:
+            if erro is None:
+                try:
+                    valores = self._ler_bloco(endereco_inicial, quantidade, funcao)
+                    self._registrar_sucesso()
+                    return valores
+                except ErroModbus as e:
+                    erro = e
+            
+            self._registrar_falha(erro)
+            politica = POLITICAS_RETRY.get(erro.classe, POLITICAS_RETRY["framing"])
+            
+            if not self.cliente_conectado or repeticoes >= politica["tentativas"]:
+                self.logger.error(f"Falha no bloco 0x{endereco_inicial:04X} [{erro.classe}]: {erro}")
+                return None
+            
+            repeticoes += 1
+            espera = politica["backoff"] * (2 ** (repeticoes - 1))
+            self.logger.warning(
+                f"Bloco 0x{endereco_inicial:04X} [{erro.classe}]: {erro} - "
+                f"nova tentativa {repeticoes}/{politica['tentativas']} em {espera:.2f}s"
+            )
+            metricas.incrementar(self.porta_vps, "retries")
+            with span("backoff", classe=erro.classe):
+                time.sleep(espera)
+            erro = None
+    
+    def ler_bloco_diagnostico(self, endereco_inicial: int, quantidade: int, funcao: int = 0x03,
+                              escravo: Optional[int] = None, timeout: Optional[float] = None) -> array:
+        """
+        NOVO v2.20.0: Uma tentativa de leitura para POST /diagnostico, com
+        escravo e timeout próprios. Sem retries e sem contar para o
+        link_morto; só a conexão fechada marca o link. Levanta ErroModbus.
+        """
+        endereco_modbus, timeout_link = self.endereco_modbus, self.timeout
+        if escravo is not None:
+            self.endereco_modbus = escravo
+        if timeout is not None:
+            self.timeout = timeout
+        try:
+            if self.socket_cliente:
+                self.socket_cliente.settimeout(self.timeout)
+            return self._ler_bloco(endereco_inicial, quantidade, funcao)
+        except ErroConexaoFechada:
+            self.cliente_conectado = False
+            raise
+        finally:
+            self.endereco_modbus, self.timeout = endereco_modbus, timeout_link
+            if self.socket_cliente:
+                try:
+                    self.socket_cliente.settimeout(self.timeout)
+                except OSError:
+                    pass
+    
+    # -------------------------------------------------------------------------
+    # MODBUS TCP (MBAP) - v2.11.0
+    # -------------------------------------------------------------------------
+    #
+    # Frame: [TID (2)] [Protocolo=0 (2)] [Tamanho (2)] [Unit (1)] [PDU]
+    # As respostas são casadas pelo transaction ID, então várias requisições
+    # podem ficar pendentes na mesma conexão e respostas atrasadas de ciclos
+    # anteriores são descartadas sem precisar drenar o buffer.
+
+    def _novo_tid(self) -> int:
+        self._proximo_tid = (self._proximo_tid + 1) & 0xFFFF
+        return self._proximo_tid
+
+    def _receber_exato(self, tamanho: int, prazo: float) -> Optional[bytes]:
+        """Lê exatamente `tamanho` bytes até o prazo (time.monotonic)"""
+        recebido = bytearray()
+        while len(recebido) < tamanho:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                return None
+            self.socket_cliente.settimeout(restante)
+            chunk = self.socket_cliente.recv(tamanho - len(recebido))
+            if not chunk:
+                raise ErroConexaoFechada("Conexão fechada pelo gateway")
+            recebido.extend(chunk)
+        return bytes(recebido)
+
+    @staticmethod
+    def _completar_resultados(resultados: list, erro: "ErroModbus") -> list:
+        """Marca com `erro` os blocos que ainda não têm resultado"""
+        return [erro if r is None else r for r in resultados]
+
+    def ler_blocos_mbap(self, blocos: list, funcao: int = 0x03) -> list:
+        """
+        Lê vários blocos em pipeline via Modbus TCP.
+
+        Envia até MAX_TRANSACOES_PENDENTES requisições antes de aguardar as
+        respostas. Retorna uma lista (na ordem de `blocos`) com array('H')
+        ou, v2.12.0, a instância de ErroModbus de cada bloco que falhou.
+        """
+        resultados: list = [None] * len(blocos)
+        if not self.cliente_conectado or not self.socket_cliente:
+            return self._completar_resultados(resultados, ErroConexaoFechada("Sem conexão"))
+
+        unit = self.endereco_modbus
+        prazo = time.monotonic() + self.timeout
+        proximo = 0
+        inicio_ns = time.monotonic_ns()
+        recebidos = 0
+
+        try:
+            while proximo < len(blocos):
+                pendentes: Dict[int, int] = {}  # tid → índice do bloco
+
+                with span("tx", transacoes=min(MAX_TRANSACOES_PENDENTES, len(blocos) - proximo)):
+                    while proximo < len(blocos) and len(pendentes) < MAX_TRANSACOES_PENDENTES:
+                        endereco, quantidade = blocos[proximo]
+                        tid = self._novo_tid()
+                        frame = struct.pack(">HHHBBHH", tid, 0, 6, unit, funcao, endereco, quantidade)
+                        self.logger.info("TX MBAP: %s", _Hex(frame))
+                        self.socket_cliente.sendall(frame)
+                        pendentes[tid] = proximo
+                        proximo += 1
+
+                espera_ns = time.monotonic_ns()
+                primeiro = True
+                while pendentes:
+                    cabecalho = self._receber_exato(7, prazo)
+                    if cabecalho is None:
+                        raise ErroTimeout(f"{len(pendentes)} transação(ões) MBAP sem resposta")
+                    if primeiro:
+                        registrar_span("ttfb", espera_ns, time.monotonic_ns())
+                        primeiro = False
+
+                    tid, protocolo, tamanho, unit_resp = struct.unpack(">HHHB", cabecalho)
+                    if protocolo != 0 or not 2 <= tamanho <= 254:
+                        self.limpar_buffer_socket()
+                        raise ErroFraming(f"Cabeçalho MBAP inválido: {cabecalho.hex(' ').upper()}")
+
+                    pdu = self._receber_exato(tamanho - 1, prazo)
+                    if pdu is None:
+                        raise ErroTimeout("PDU MBAP incompleta")
+
+                    self.logger.info("RX MBAP (%d bytes): %s", 7 + len(pdu), _Hex(cabecalho + pdu))
+                    recebidos += len(pdu) + 3  # equivalente RTU: endereço + PDU + CRC
+
+                    indice = pendentes.pop(tid, None)
+                    if indice is None:
+                        self.logger.warning(f"Resposta MBAP descartada (TID {tid} desconhecido)")
+                        continue
+
+                    try:
+                        resultados[indice] = self._decodificar_pdu_leitura(pdu, funcao, blocos[indice][1], unit_resp)
+                    except ErroModbus as e:
+                        resultados[indice] = e
+        except ErroModbus as e:
+            self.logger.error(f"Falha MBAP [{e.classe}]: {e}")
+            resultados = self._completar_resultados(resultados, e)
+        except socket.timeout:
+            resultados = self._completar_resultados(resultados, ErroTimeout("Timeout MBAP"))
+        except OSError as e:
+            self.logger.error(f"Erro na comunicação MBAP: {e}")
+            resultados = self._completar_resultados(resultados, ErroConexaoFechada(str(e)))
+        finally:
+            # Requisição FC03/FC04 em RTU: endereço + 5 bytes de PDU + CRC
+            self._contabilizar_serial(8 * proximo, recebidos, inicio_ns, proximo)
+            if self.socket_cliente:
+                try:
+                    self.socket_cliente.settimeout(self.timeout)
+                except OSError:
+                    pass
+
+        return resultados
+
+    def _decodificar_pdu_leitura(self, pdu: bytes, funcao: int, quantidade: int, unit: int) -> array:
+        """Decodifica a PDU de resposta de FC03/FC04 (sem CRC no Modbus TCP)"""
+        if unit != self.endereco_modbus:
+            self.logger.warning(f"Unit ID diferente: recebido={unit}, esperado={self.endereco_modbus}")
+
+        if pdu[0] & 0x80:
+            raise ErroExcecaoModbus(pdu[0], pdu[1] if len(pdu) > 1 else 0)
+
+        if pdu[0] != funcao or len(pdu) < 2 or pdu[1] != len(pdu) - 2:
+            raise ErroFraming(f"PDU inválida: {pdu.hex(' ').upper()}")
+
+        if pdu[1] != quantidade * 2:
+            self.logger.warning(f"Byte count diferente: recebido={pdu[1]}, esperado={quantidade * 2}")
+
+        valores = array("H", pdu[2:2 + (pdu[1] & ~1)])
+        if sys.byteorder == "little":
+            valores.byteswap()
+        return valores
+
+    # -------------------------------------------------------------------------
+    # ESCRITA (FC06/FC16) E FILA DE TRABALHO - v2.13.0
+    # -------------------------------------------------------------------------
+
+    def _transacao_mbap(self, pdu: bytes) -> bytes:
+        """Uma transação Modbus TCP; retorna a PDU de resposta do mesmo TID"""
+        if not self.cliente_conectado or not self.socket_cliente:
+            raise ErroConexaoFechada("Sem conexão")
+
+        tid = self._novo_tid()
+        frame = struct.pack(">HHHB", tid, 0, len(pdu) + 1, self.endereco_modbus) + pdu
+        prazo = time.monotonic() + self.timeout
+        inicio_ns = time.monotonic_ns()
+        resposta = b""
+
+        try:
+            self.logger.info("TX MBAP: %s", _Hex(frame))
+            self.socket_cliente.sendall(frame)
+            while True:
+                cabecalho = self._receber_exato(7, prazo)
+                if cabecalho is None:
+                    raise ErroTimeout("Transação MBAP sem resposta")
+                tid_resposta, protocolo, tamanho, _ = struct.unpack(">HHHB", cabecalho)
+                if protocolo != 0 or not 2 <= tamanho <= 254:
+                    self.limpar_buffer_socket()
+                    raise ErroFraming(f"Cabeçalho MBAP inválido: {cabecalho.hex(' ').upper()}")
+                resposta = self._receber_exato(tamanho - 1, prazo)
+                if resposta is None:
+                    raise ErroTimeout("PDU MBAP incompleta")
+                self.logger.info("RX MBAP (%d bytes): %s", 7 + len(resposta), _Hex(cabecalho + resposta))
+                if tid_resposta == tid:
+                    break
+                self.logger.warning(f"Resposta MBAP descartada (TID {tid_resposta} desconhecido)")
+        except socket.timeout:
+            raise ErroTimeout("Timeout MBAP")
+        except OSError as e:
+            raise ErroConexaoFechada(f"Erro na comunicação MBAP: {e}")
+        finally:
+            self._contabilizar_serial(len(pdu) + 3, len(resposta) + 3 if resposta else 0, inicio_ns)
+            if self.socket_cliente:
+                try:
+                    self.socket_cliente.settimeout(self.timeout)
+                except OSError:
+                    pass
+
+        if resposta[0] & 0x80:
+            raise ErroExcecaoModbus(resposta[0], resposta[1] if len(resposta) > 1 else 0)
+        return resposta
+
+    def escrever_registradores(self, endereco: int, valores: list, funcao: int = None):
+        """
+        Escreve um registrador (FC06) ou vários (FC16) e confere o eco do
+        escravo. Levanta ErroModbus em caso de falha.
+        """
+        if funcao is None:
+            funcao = 0x06 if len(valores) == 1 else 0x10
+
+        if funcao == 0x06:
+            pdu = struct.pack(">BHH", funcao, endereco, valores[0])
+            esperado = pdu  # FC06 responde com eco da requisição
+        else:
+            pdu = struct.pack(f">BHHB{len(valores)}H", funcao, endereco, len(valores),
+                              len(valores) * 2, *valores)
+            esperado = pdu[:5]  # FC16 responde com endereço e quantidade
+
+        if self.transporte == "tcp":
+            resposta = self._transacao_mbap(pdu)
+        else:
+            resposta = self._validar_frame_rtu(self._transacao_rtu(pdu, 0))[1:-2]
+
+        if resposta != esperado:
+            raise ErroFraming(f"Eco da escrita diferente: {resposta.hex(' ').upper()}")
+
+    def executar_comando(self, comando: Comando):
+        """
+        Executa uma escrita da fila e confere o valor lendo de volta.
+
+        Escritas não seguem POLITICAS_RETRY: um registrador de comando
+        (partida, reconhecimento de alarme) não é idempotente, então a falha
+        volta para quem pediu decidir.
+        """
+        if comando.expirado():
+            comando.concluir("prazo_expirado")
+            return
+
+        self.logger.info(
+            f"COMANDO {comando.id}: FC{comando.funcao:02d} em 0x{comando.endereco:04X} = {comando.valores}"
+        )
+        try:
+            with span("comando", funcao=comando.funcao, registradores=len(comando.valores)):
+                self.escrever_registradores(comando.endereco, comando.valores, comando.funcao)
+        except ErroModbus as e:
+            self._registrar_falha(e)
+            self.logger.error(f"COMANDO {comando.id} falhou [{e.classe}]: {e}")
+            comando.concluir("erro", erro=e.classe, detalhe=str(e))
+            return
+
+        self.timeouts_consecutivos = 0
+        self.ultimo_erro = None
+        self.cache.invalidar(self.endereco_modbus, comando.endereco, len(comando.valores))
+
+        if not comando.verificar:
+            comando.concluir("ok")
+            return
+
+        with span("verificacao"):
+            lidos = self.ler_bloco_registradores(comando.endereco, len(comando.valores))
+        if lidos is None:
+            comando.concluir("verificacao_falhou", erro=self.ultimo_erro)
+        elif list(lidos) != comando.valores:
+            self.logger.warning(f"COMANDO {comando.id}: leitura de volta {list(lidos)} ≠ {comando.valores}")
+            comando.concluir("divergente", valores_lidos=list(lidos))
+        else:
+            comando.concluir("ok", valores_lidos=list(lidos))
+
+    def atender_fila(self, limite: float, prioridade_max: int = PRIORIDADE_POLLING) -> Optional[TurnoPolling]:
+        """
+        Executa os trabalhos enfileirados até `limite` (time.monotonic).
+        Retorna o TurnoPolling assim que ele é retirado (v2.17.0), ou None.
+        """
+        while not self.link_morto:
+            trabalho = self.fila.retirar(limite, prioridade_max)
+            if trabalho is None:
+                return None
+            if isinstance(trabalho, TurnoPolling):
+                trabalho.retirado = True
+                return trabalho
+            if trabalho.expirado():
+                trabalho.cancelar("prazo_expirado")
+                continue
+            trabalho.executar(self)
+
     def extrair_status_bits(self, status_word: int) -> Dict[str, bool]:
         """
         Extrai os bits de status conforme manual K30XL (registro 00017 / 0x0010)
@@ -619,89 +2789,136 @@ class ConexaoHF:
         self.logger.info("=== FIM DO SCAN EXTENDIDO v2.4.0 ===")
         self.logger.info("=" * 70)
     
+    def _marcar_captura(self, dados: Leitura):
+        dados.capturado_em = time.time()
+        trace = trace_atual()
+        if trace is not None:
+            dados.trace_id = trace.trace_id
+    
+    def _resultado_pipeline(self, resultado, endereco: int, quantidade: int) -> Optional[array]:
+        """Bloco do pipeline MBAP: falhas seguem a política de retry individualmente"""
+        if isinstance(resultado, ErroModbus):
+            return self.ler_bloco_registradores(endereco, quantidade, erro_inicial=resultado)
+        self._registrar_sucesso()
+        self.cache.atualizar(self.endereco_modbus, 0x03, endereco, resultado)
+        return resultado
+    
     def ler_todos_registradores(self) -> Dict[str, Any]:
         """
         Lê todos os registradores K30XL em duas requisições (blocos).
         
         CORREÇÃO v2.5.0: Horímetro confirmado em 0x000B
+        v2.12.0: A falha de um bloco não descarta o outro; a leitura sai
+        marcada como parcial (leitura_parcial) com os campos disponíveis.
         """
-        dados = {}
+        dados = Leitura()
         
         # =========================================
         # BLOCO 1: Parâmetros Elétricos, Motor e HORÍMETRO
         # =========================================
+        # Modbus TCP: os dois blocos vão em pipeline, na mesma janela de ida e volta
+        pipeline = None
+        if self.transporte == "tcp":
+            with span("pipeline_mbap"):
+                pipeline = self.ler_blocos_mbap([
+                    (BLOCO1_ENDERECO, BLOCO1_QUANTIDADE),
+                    (BLOCO2_ENDERECO, BLOCO2_QUANTIDADE),
+                ])
+        
         self.logger.info("=" * 50)
         self.logger.info("=== Lendo Bloco 1 (0x0000-0x000B) - v2.5.0 ===")
-        valores_bloco1 = self.ler_bloco_registradores(BLOCO1_ENDERECO, BLOCO1_QUANTIDADE)
+        with span("bloco1"):
+            if pipeline is not None:
+                valores_bloco1 = self._resultado_pipeline(pipeline[0], BLOCO1_ENDERECO, BLOCO1_QUANTIDADE)
+            else:
+                valores_bloco1 = self.ler_bloco_registradores(BLOCO1_ENDERECO, BLOCO1_QUANTIDADE)
         
         if not valores_bloco1:
-            self.logger.error("Falha na leitura do Bloco 1")
-            return dados
-        
-        self.logger.info(f"Bloco 1 RAW: {[f'0x{v:04X}' for v in valores_bloco1]}")
+            self.logger.error(f"Falha na leitura do Bloco 1 [{self.ultimo_erro}]")
+            if self.link_morto:
+                return dados
+        else:
+            # Instante de captura: viaja com a leitura até o backend
+            self._marcar_captura(dados)
+            
+            self.logger.info("Bloco 1 RAW: %s", _Hex(valores_bloco1))
         
-        # Mapear valores do Bloco 1 (0x0000 a 0x0008)
-        for i, reg in enumerate(BLOCO1_REGISTRADORES[:9]):  # Só os primeiros 9
-            if i < len(valores_bloco1):
-                valor_raw = valores_bloco1[i]
-                valor = valor_raw * reg.fator_escala
-                dados[reg.nome] = round(valor, 2) if reg.fator_escala != 1.0 else valor
+            # Mapear valores do Bloco 1 (0x0000 a 0x0008)
+            for i, reg in enumerate(BLOCO1_REGISTRADORES[:9]):  # Só os primeiros 9
+                if i < len(valores_bloco1):
+                    valor_raw = valores_bloco1[i]
+                    valor = valor_raw * reg.fator_escala
+                    dados[reg.nome] = round(valor, 2) if reg.fator_escala != 1.0 else valor
         
-        # =========================================
-        # HORÍMETRO - Registrador 0x000B (índice 11)
-        # CORREÇÃO v2.5.0: Confirmado via scan!
-        # =========================================
-        if len(valores_bloco1) >= 12:
-            horimetro_horas = valores_bloco1[11]  # Índice 11 = 0x000B
-            self.logger.info(f"  ★ Reg 0x000B (HORÍMETRO): {horimetro_horas} horas ✓")
+            # =========================================
+            # HORÍMETRO - Registrador 0x000B (índice 11)
+            # CORREÇÃO v2.5.0: Confirmado via scan!
+            # =========================================
+            if len(valores_bloco1) >= 12:
+                horimetro_horas = valores_bloco1[11]  # Índice 11 = 0x000B
+                self.logger.info(f"  ★ Reg 0x000B (HORÍMETRO): {horimetro_horas} horas ✓")
             
-            # Novos campos separados para o backend
-            dados["horimetro_horas"] = horimetro_horas
-            dados["horimetro_minutos"] = 0  # Por enquanto, não identificado
-            dados["horimetro_segundos"] = 0  # Por enquanto, não identificado
+                # Novos campos separados para o backend
+                dados["horimetro_horas"] = horimetro_horas
+                dados["horimetro_minutos"] = 0  # Por enquanto, não identificado
+                dados["horimetro_segundos"] = 0  # Por enquanto, não identificado
             
-            # Manter compatibilidade com campo antigo
-            dados["horas_trabalhadas"] = float(horimetro_horas)
+                # Manter compatibilidade com campo antigo
+                dados["horas_trabalhadas"] = float(horimetro_horas)
         
         # CORREÇÃO v2.2.0: Delay maior entre blocos para buffer limpar
-        self.logger.info(f"Aguardando {DELAY_ENTRE_BLOCOS}s para buffer limpar...")
-        time.sleep(DELAY_ENTRE_BLOCOS)
+        # (desnecessário no Modbus TCP: respostas casadas por transaction ID)
+        # v2.13.0: a pausa é usada para atender comandos pendentes
+        if pipeline is None:
+            self.logger.info(f"Aguardando {DELAY_ENTRE_BLOCOS}s para buffer limpar...")
+            with span("delay_entre_blocos"):
+                self.atender_fila(time.monotonic() + DELAY_ENTRE_BLOCOS, PRIORIDADE_COMANDO)
         
         # =========================================
         # BLOCO 2: Partidas e Combustível
         # =========================================
         self.logger.info("=== Lendo Bloco 2 (0x0010-0x0013) - v2.5.0 ===")
-        valores_bloco2 = self.ler_bloco_registradores(BLOCO2_ENDERECO, BLOCO2_QUANTIDADE)
+        with span("bloco2"):
+            if pipeline is not None:
+                valores_bloco2 = self._resultado_pipeline(pipeline[1], BLOCO2_ENDERECO, BLOCO2_QUANTIDADE)
+            else:
+                valores_bloco2 = self.ler_bloco_registradores(BLOCO2_ENDERECO, BLOCO2_QUANTIDADE)
         
         if not valores_bloco2:
-            self.logger.error("Falha na leitura do Bloco 2")
-            return dados
+            self.logger.error(f"Falha na leitura do Bloco 2 [{self.ultimo_erro}]")
+        else:
+            if dados.capturado_em is None:
+                self._marcar_captura(dados)
+            
+            self.logger.info("Bloco 2 RAW: %s", _Hex(valores_bloco2))
         
-        self.logger.info(f"Bloco 2 RAW: {[f'0x{v:04X}' for v in valores_bloco2]}")
-        
-        # CORREÇÃO v2.5.0: Índice 0 = PARTIDAS (0x0010)
-        if len(valores_bloco2) >= 1:
-            dados["numero_partidas"] = valores_bloco2[0]
-            self.logger.info(f"  ★ Reg 0x0010 (PARTIDAS): {valores_bloco2[0]} ✓")
-        
-        # Índice 1-2: Reservados (0x0011, 0x0012)
-        if len(valores_bloco2) >= 2:
-            self.logger.info(f"  Reg 0x0011: {valores_bloco2[1]} (0x{valores_bloco2[1]:04X})")
-        if len(valores_bloco2) >= 3:
-            self.logger.info(f"  Reg 0x0012: {valores_bloco2[2]} (0x{valores_bloco2[2]:04X})")
-        
-        # Índice 3: Nível Combustível (0x0013)
-        if len(valores_bloco2) >= 4:
-            dados["nivel_combustivel"] = valores_bloco2[3]
-            self.logger.info(f"  Reg 0x0013 (Combustível): {valores_bloco2[3]}%")
-        
-        # Status bits: Inferidos a partir dos valores lidos
-        tensao_rede = dados.get("tensao_rede_rs", 0)
-        dados["rede_ok"] = tensao_rede > 180
-        dados["motor_funcionando"] = dados.get("rpm_motor", 0) > 100
-        dados["gmg_alimentando"] = dados.get("tensao_gmg", 0) > 180
-        dados["aviso_ativo"] = False
-        dados["falha_ativa"] = False
+            # CORREÇÃO v2.5.0: Índice 0 = PARTIDAS (0x0010)
+            if len(valores_bloco2) >= 1:
+                dados["numero_partidas"] = valores_bloco2[0]
+                self.logger.info(f"  ★ Reg 0x0010 (PARTIDAS): {valores_bloco2[0]} ✓")
+        
+            # Índice 1-2: Reservados (0x0011, 0x0012)
+            if len(valores_bloco2) >= 2:
+                self.logger.info(f"  Reg 0x0011: {valores_bloco2[1]} (0x{valores_bloco2[1]:04X})")
+            if len(valores_bloco2) >= 3:
+                self.logger.info(f"  Reg 0x0012: {valores_bloco2[2]} (0x{valores_bloco2[2]:04X})")
+        
+            # Índice 3: Nível Combustível (0x0013)
+            if len(valores_bloco2) >= 4:
+                dados["nivel_combustivel"] = valores_bloco2[3]
+                self.logger.info(f"  Reg 0x0013 (Combustível): {valores_bloco2[3]}%")
+        
+        if not valores_bloco1 and not valores_bloco2:
+            return dados
+        
+        if not valores_bloco1 or not valores_bloco2:
+            dados.parcial = True
+            metricas.incrementar(self.porta_vps, "leituras_parciais")
+            self.logger.warning("Leitura PARCIAL: enviando apenas os campos dos blocos lidos")
+        
+        # Status bits: Inferidos a partir dos valores lidos (só existem no Bloco 1)
+        if valores_bloco1:
+            inferir_status(dados)
         
         # =========================================
         # LOG RESUMIDO
@@ -714,115 +2931,3126 @@ class ConexaoHF:
         self.logger.info(f"  Motor: {dados.get('motor_funcionando', 'N/A')}")
         self.logger.info("=" * 50)
         
+        self.ultimo_dado = dados
         return dados
     
     def fechar(self):
-        """Fecha as conexões"""
-        if self.socket_cliente:
+        """Fecha as conexões"""
+        if self.socket_cliente:
+            try:
+                self.socket_cliente.close()
+            except:
+                pass
+        if self.socket_servidor:
+            try:
+                self.socket_servidor.close()
+            except:
+                pass
+
+
+# =============================================================================
+# FORMATO COMPACTO DE ENVIO (v2.19.0)
+# =============================================================================
+#
+# Com FORMATO_ENVIO = "msgpack" o corpo vai em MessagePack com as chaves
+# trocadas por IDs inteiros (CAMPOS_WIRE) e o capturado_em como epoch, em
+# vez do ISO. Lotes (rollups, alertas) vão também com gzip. O Content-Type
+# (application/x-msgpack) diz à edge function qual decodificador usar; o
+# JSON continua aceito. Se a edge function responder 415, ou 400/500 antes
+# de qualquer POST compacto ter dado certo (versão sem suporte, que tenta
+# ler o corpo como JSON), o mesmo payload é reenviado em JSON; se o JSON
+# passa, o leitor fica em JSON até reiniciar.
+#
+# Os IDs são a posição em CAMPOS_WIRE: nunca reordene nem remova nomes, só
+# acrescente no fim (a edge function tem a mesma tabela).
+
+CAMPOS_WIRE = (
+    None,  # 0: reservado
+    # Envelope e metadados
+    "porta_vps", "tipo", "capturado_em", "trace_id", "leitura_parcial",
+    "alertas_avaliados_na_vps",
+    # Lotes
+    "rollups", "janela", "inicio", "fim", "amostras", "estatisticas",
+    "min", "max", "media", "ultimo",
+    "alertas", "nivel", "mensagem", "condicao",
+    # Perfil K30XL: registradores (blocos 1 e 2) e status inferidos
+    "tensao_rede_rs", "tensao_rede_st", "tensao_rede_tr", "tensao_gmg",
+    "corrente_fase1", "frequencia_gmg", "rpm_motor", "tensao_bateria",
+    "temperatura_agua", "horimetro_horas", "horimetro_minutos",
+    "horimetro_segundos", "horas_trabalhadas", "numero_partidas",
+    "nivel_combustivel",
+    "motor_funcionando", "rede_ok", "gmg_alimentando", "aviso_ativo",
+    "falha_ativa",
+    # Envio idempotente (v2.29.0)
+    "seq", "id_fluxo", "seq_min", "leituras", "chave",
+)
+IDS_WIRE = {nome: i for i, nome in enumerate(CAMPOS_WIRE) if nome}
+
+CONTENT_TYPE_MSGPACK = "application/x-msgpack"
+
+_formato_compacto_recusado = False
+_formato_compacto_aceito = False  # Algum POST compacto já foi aceito (400/500 passa a ser erro real)
+
+
+def formato_compacto_ativo() -> bool:
+    return FORMATO_ENVIO == "msgpack" and msgpack is not None and not _formato_compacto_recusado
+
+
+def _para_wire(valor):
+    """Troca chaves conhecidas por IDs; floats inteiros viram int (1-3 bytes)"""
+    if isinstance(valor, dict):
+        return {IDS_WIRE.get(chave, chave): _para_wire(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_para_wire(v) for v in valor]
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def _de_wire(valor):
+    if isinstance(valor, dict):
+        return {
+            (CAMPOS_WIRE[chave] if isinstance(chave, int) and 0 < chave < len(CAMPOS_WIRE) else chave): _de_wire(v)
+            for chave, v in valor.items()
+        }
+    if isinstance(valor, list):
+        return [_de_wire(v) for v in valor]
+    return valor
+
+
+def codificar_compacto(payload: Dict[str, Any], comprimir: bool = False) -> bytes:
+    corpo = msgpack.packb(_para_wire(payload), use_bin_type=True)
+    return gzip.compress(corpo, compresslevel=6) if comprimir else corpo
+
+
+def decodificar_compacto(corpo: bytes, comprimido: bool = False) -> Dict[str, Any]:
+    """Inverso de codificar_compacto (capturado_em volta como epoch)"""
+    if comprimido:
+        corpo = gzip.decompress(corpo)
+    return _de_wire(msgpack.unpackb(corpo, raw=False, strict_map_key=False))
+
+
+def postar_backend(payload: Dict[str, Any], lote: bool = False):
+    """
+    POST na edge function no formato configurado. `lote` comprime com gzip
+    no formato compacto. Retorna a resposta do requests.
+    """
+    global _formato_compacto_recusado, _formato_compacto_aceito
+
+    recusado = None
+    if formato_compacto_ativo():
+        headers = {"Content-Type": CONTENT_TYPE_MSGPACK, "Accept": "application/json"}
+        if lote:
+            headers["Content-Encoding"] = "gzip"
+        response = requests.post(
+            EDGE_FUNCTION_URL,
+            data=codificar_compacto(payload, comprimir=lote),
+            headers=headers,
+            timeout=10
+        )
+        if response.status_code < 300:
+            _formato_compacto_aceito = True
+        if response.status_code != 415 and (_formato_compacto_aceito or response.status_code not in (400, 500)):
+            return response
+        recusado = response.status_code
+
+    if isinstance(payload.get("capturado_em"), float):
+        payload = {**payload, "capturado_em": iso_utc(payload["capturado_em"])}
+    if "leituras" in payload:
+        payload = {**payload, "leituras": [
+            {**item, "capturado_em": iso_utc(item["capturado_em"])} if isinstance(item.get("capturado_em"), float) else item
+            for item in payload["leituras"]
+        ]}
+    response = requests.post(
+        EDGE_FUNCTION_URL,
+        json=payload,
+        headers={"Content-Type": "application/json"},
+        timeout=10
+    )
+    if recusado is not None and (recusado == 415 or response.status_code < 300):
+        logger.warning(f"Edge function não aceita MessagePack ({recusado}), voltando para JSON")
+        _formato_compacto_recusado = True
+    return response
+
+
+# =============================================================================
+# ENVIO IDEMPOTENTE (v2.29.0)
+# =============================================================================
+#
+# Cada leitura recebe (id_fluxo, seq) uma única vez, logo após o polling:
+# seq cresce de 1 em 1 por gerador e id_fluxo é sorteado a cada partida do
+# processo (o seq recomeça em 1, então um kill -9 nunca reaproveita um par
+# já enviado). Leituras restauradas do estado salvo (v2.28.0) mantêm o par
+# original. O backend tem índice único em (gerador_id, id_fluxo, seq): um
+# reenvio (timeout depois do insert, lote repetido após reinício) volta
+# como "duplicada" e não gera linha nem alerta.
+#
+# A resposta traz ack_seq, o maior seq contíguo gravado no fluxo. seq_min
+# diz ao backend qual é a leitura mais antiga que a VPS ainda guarda (o que
+# a fila cheia descartou não trava o ack). O sink http só tira da fila o
+# que foi confirmado e, por ser idempotente, repete sem limite de
+# tentativas; com GMG_ENVIO_LOTE > 1 envia lotes (tipo "leituras") por
+# gerador e fluxo.
+#
+# Alertas enviados pela VPS levam chave = id_fluxo:seq:condicao da leitura
+# que disparou; o reenvio de um alerta reaberto usa a mesma chave.
+
+ID_FLUXO = os.urandom(8).hex()
+
+_sequencias: Dict[str, int] = {}
+_sequencias_lock = threading.Lock()
+# Último ack por porta: {"id_fluxo", "ack_seq"}, em GET /metricas → sinks → http
+acks_envio: Dict[str, Dict[str, Any]] = {}
+_envio_lote_recusado = False
+
+
+def numerar_leitura(porta_vps: str, dados) -> None:
+    """Atribui (id_fluxo, seq) à leitura; não faz nada se ela já tem"""
+    if not isinstance(dados, Leitura) or dados.seq is not None:
+        return
+    with _sequencias_lock:
+        seq = _sequencias.get(porta_vps, 0) + 1
+        _sequencias[porta_vps] = seq
+    dados.seq = seq
+    dados.id_fluxo = ID_FLUXO
+    if dados.capturado_em is None:
+        dados.capturado_em = time.time()
+
+
+def _corpo_leitura(porta_vps: str, dados: Dict[str, Any], alertas_avaliados: bool) -> Dict[str, Any]:
+    corpo = {"porta_vps": porta_vps, **dados}
+    if alertas_avaliados:
+        corpo["alertas_avaliados_na_vps"] = True
+    if isinstance(dados, Leitura) and dados.capturado_em is not None:
+        corpo["capturado_em"] = dados.capturado_em  # epoch; vira ISO no envio JSON
+    return corpo
+
+
+def registrar_ack(porta_vps: str, id_fluxo: Optional[str], ack_seq: Optional[int]):
+    if id_fluxo is not None and ack_seq is not None:
+        acks_envio[porta_vps] = {"id_fluxo": id_fluxo, "ack_seq": ack_seq}
+
+
+def envio_em_lote_ativo() -> bool:
+    return ENVIO_LOTE_MAX > 1 and sink_postgres is None and not _envio_lote_recusado
+
+
+def enviar_lote_leituras(porta_vps: str, id_fluxo: str, itens: list) -> tuple:
+    """
+    Envia leituras de um gerador e fluxo num POST (tipo "leituras").
+    Retorna (status HTTP, ack_seq): status None = sem resposta; ack_seq
+    None = lote não aceito.
+    """
+    global _envio_lote_recusado
+
+    seqs = [dados.seq for _, dados, _ in itens]
+    payload = {
+        "porta_vps": porta_vps,
+        "tipo": "leituras",
+        "id_fluxo": id_fluxo,
+        "seq_min": min(seqs),
+        "leituras": [
+            {chave: valor for chave, valor in _corpo_leitura(porta_vps, dados, alertas).items()
+             if chave not in ("porta_vps", "id_fluxo")}
+            for _, dados, alertas in itens
+        ],
+    }
+
+    try:
+        response = postar_backend(payload, lote=True)
+        if response.status_code != 200:
+            logger.error(f"✗ Erro ao enviar lote de {len(itens)} leituras: {response.status_code} - {response.text}")
+            return response.status_code, None
+        resultado = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"✗ Erro de conexão ao enviar lote: {e}")
+        return None, None
+
+    ack_seq = resultado.get("ack_seq")
+    if ack_seq is None:
+        # Edge function anterior à v2.29.0: volta para uma leitura por POST
+        logger.error("Edge function não devolveu ack_seq para o lote, voltando para envio individual")
+        _envio_lote_recusado = True
+        return 200, None
+    registrar_ack(porta_vps, id_fluxo, ack_seq)
+    if resultado.get("duplicadas"):
+        metricas.incrementar(porta_vps, "envios_duplicados", resultado["duplicadas"])
+    logger.info(f"✓ Lote de {len(itens)} leituras (seq {min(seqs)}-{max(seqs)}) porta {porta_vps}, ack {ack_seq}")
+    return 200, ack_seq
+
+
+# =============================================================================
+# FUNÇÃO DE ENVIO PARA BACKEND
+# =============================================================================
+
+def enviar_para_backend(porta_vps: str, dados: Dict[str, Any], alertas_avaliados: bool = False,
+                        seq_min: Optional[int] = None) -> bool:
+    """Envia os dados lidos para a edge function via HTTP POST (ver postar_leitura)"""
+    return postar_leitura(porta_vps, dados, alertas_avaliados, seq_min) == 200
+
+
+def postar_leitura(porta_vps: str, dados: Dict[str, Any], alertas_avaliados: bool = False,
+                   seq_min: Optional[int] = None) -> Optional[int]:
+    """
+    Envia os dados lidos para a edge function via HTTP POST. Retorna o
+    status HTTP (200 = gravada ou já estava no banco), ou None sem resposta.
+
+    Args:
+        alertas_avaliados: True se os alertas desta leitura já foram avaliados
+            na VPS (a edge function não consulta parametros_alerta)
+        seq_min: menor seq do fluxo ainda guardado na VPS (o ack não passa
+            de leituras ainda não confirmadas); sem ele o ack só avança
+            pelo trecho contíguo já gravado
+    """
+    payload = _corpo_leitura(porta_vps, dados, alertas_avaliados)
+    if seq_min is not None and payload.get("seq") is not None:
+        payload["seq_min"] = seq_min
+    
+    try:
+        logger.info(f"Enviando dados do gerador porta {porta_vps}")
+        
+        response = postar_backend(payload)
+        
+        if response.status_code == 200:
+            result = response.json()
+            registrar_ack(porta_vps, payload.get("id_fluxo"), result.get("ack_seq"))
+            if result.get("duplicada"):
+                # v2.29.0: reenvio de uma leitura já gravada (idempotente)
+                metricas.incrementar(porta_vps, "envios_duplicados")
+                logger.info(f"✓ Leitura seq {payload.get('seq')} já estava no banco")
+                return 200
+            logger.info(f"✓ Dados enviados! Reading ID: {result.get('reading_id')}")
+            return 200
+        else:
+            logger.error(f"✗ Erro ao enviar: {response.status_code} - {response.text}")
+            return response.status_code
+            
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"✗ Erro de conexão: {e}")
+        return None
+
+
+def buscar_parametros_alerta(porta_vps: str) -> Optional[list]:
+    """
+    Busca os parametros_alerta habilitados do gerador via edge function.
+    Retorna None se o gerador ainda não existe no backend ou em caso de erro.
+    """
+    try:
+        response = requests.get(
+            EDGE_FUNCTION_URL,
+            params={"porta_vps": porta_vps, "recurso": "parametros_alerta"},
+            timeout=10
+        )
+
+        if response.status_code == 200:
+            return response.json().get("parametros", [])
+
+        logger.warning(f"Parâmetros de alerta indisponíveis ({porta_vps}): {response.status_code}")
+        return None
+
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Erro ao buscar parâmetros de alerta ({porta_vps}): {e}")
+        return None
+
+
+def postar_eventos(porta_vps: str, tipo: str, itens: list) -> Optional[int]:
+    """
+    Envia alertas ou rollups (`tipo`) de um gerador num POST. Retorna o
+    status HTTP, ou None sem resposta.
+    """
+    payload = {
+        "porta_vps": porta_vps,
+        "tipo": tipo,
+        tipo: itens,
+    }
+
+    try:
+        response = postar_backend(payload, lote=True)
+
+        if response.status_code == 200:
+            logger.info(f"✓ {len(itens)} {tipo} enviado(s) para porta {porta_vps}")
+        else:
+            logger.error(f"✗ Erro ao enviar {tipo}: {response.status_code} - {response.text}")
+        return response.status_code
+
+    except requests.RequestException as e:
+        logger.error(f"✗ Erro de conexão ao enviar {tipo}: {e}")
+        return None
+
+
+def enviar_alertas_para_backend(porta_vps: str, alertas: list) -> bool:
+    """
+    Envia imediatamente os alertas detectados na VPS para a edge function
+    """
+    return postar_eventos(porta_vps, "alertas", alertas) == 200
+
+
+# =============================================================================
+# FILTRO DE PLAUSIBILIDADE (v2.16.0)
+# =============================================================================
+#
+# Etapa entre a leitura e os alertas/upload. Por campo:
+#   1. Faixa física (LIMITES_PLAUSIBILIDADE)
+#   2. Taxa de variação máxima em relação ao último valor aceito
+#   3. Contadores (horímetro, partidas) só crescem, no máximo no ritmo do relógio
+#   4. Mediana de 3 nos campos analógicos (atrasa um degrau real em um polling)
+#
+# Valor suspeito sai da leitura (vai NULL para o backend) e fica na quarentena.
+# Se o mesmo patamar se repetir FILTRO_CONFIRMACOES vezes seguidas (troca de
+# controlador, reabastecimento rápido), passa a ser a nova referência. Com
+# FILTRO_MAX_SUSPEITOS ou mais campos suspeitos (frame deslocado), a leitura
+# inteira vai para a quarentena. Memória constante: alguns arrays por gerador.
+
+_NAN = float("nan")
+
+
+# Status inferido → (campo de origem, limiar)
+STATUS_INFERIDOS = {
+    "rede_ok": ("tensao_rede_rs", 180),
+    "motor_funcionando": ("rpm_motor", 100),
+    "gmg_alimentando": ("tensao_gmg", 180),
+}
+
+
+def inferir_status(dados: Leitura):
+    """
+    Status bits inferidos a partir dos valores lidos.
+
+    Campo de origem ausente (bloco não lido) ou em quarentena deixa o status
+    ausente: um valor desconhecido não vira "rede em falha" ou "motor parado".
+    """
+    lidos = 0
+    for status, (campo, limiar) in STATUS_INFERIDOS.items():
+        valor = dados.get(campo)
+        if valor is None:
+            del dados[status]
+        else:
+            dados[status] = valor > limiar
+            lidos += 1
+    if lidos:
+        dados["aviso_ativo"] = False
+        dados["falha_ativa"] = False
+
+
+class FiltroPlausibilidade:
+    """Estado do filtro de um gerador (arrays indexados por CAMPOS_NUMERICOS)"""
+
+    __slots__ = (
+        "porta_vps",
+        "referencia",
+        "instante_referencia",
+        "candidato",
+        "instante_candidato",
+        "confirmacoes",
+        "janela",
+        "quarentena",
+    )
+
+    def __init__(self, porta_vps: str):
+        n = len(CAMPOS_NUMERICOS)
+        self.porta_vps = porta_vps
+        self.referencia = array("d", _VALORES_VAZIOS)
+        self.instante_referencia = array("d", bytes(8 * n))
+        self.candidato = array("d", _VALORES_VAZIOS)
+        self.instante_candidato = array("d", bytes(8 * n))
+        self.confirmacoes = array("B", bytes(n))
+        self.janela = array("d", _VALORES_VAZIOS * 2)  # 2 amostras anteriores por campo
+        self.quarentena: deque = deque(maxlen=FILTRO_QUARENTENA_MAX)
+
+    @staticmethod
+    def _motivo(campo: str, valor: float, anterior: float, dt: float) -> Optional[str]:
+        """Motivo da suspeita em relação a um valor anterior, ou None"""
+        if anterior != anterior:  # sem referência
+            return None
+        if campo in CONTADORES_MONOTONICOS:
+            if valor < anterior:
+                return "regressao"
+            if valor - anterior > CONTADORES_MONOTONICOS[campo] * dt + 1:
+                return "salto"
+            return None
+        taxa = TAXAS_MAXIMAS.get(campo)
+        if taxa is not None and dt <= FILTRO_REFERENCIA_MAX_S and abs(valor - anterior) > taxa * max(dt, 1.0):
+            return "taxa"
+        return None
+
+    def filtrar(self, dados: Leitura) -> bool:
+        """
+        Aplica o filtro na leitura (in-place). Retorna False se a leitura
+        inteira foi para a quarentena.
+        """
+        agora = dados.capturado_em or time.time()
+        valores = dados.valores
+        suspeitos = []
+
+        for i, campo in enumerate(CAMPOS_NUMERICOS):
+            valor = valores[i]
+            if valor != valor:
+                continue
+
+            minimo, maximo = LIMITES_PLAUSIBILIDADE.get(campo, (-math.inf, math.inf))
+            if not minimo <= valor <= maximo:
+                suspeitos.append((i, campo, valor, "faixa"))
+                continue
+
+            motivo = self._motivo(campo, valor, self.referencia[i], agora - self.instante_referencia[i])
+            if motivo is not None:
+                # Novo patamar consistente consigo mesmo por N leituras → aceito
+                if self._motivo(campo, valor, self.candidato[i], agora - self.instante_candidato[i]) is None \
+                        and self.candidato[i] == self.candidato[i]:
+                    self.confirmacoes[i] += 1
+                else:
+                    self.confirmacoes[i] = 1
+                self.candidato[i] = valor
+                self.instante_candidato[i] = agora
+                if self.confirmacoes[i] < FILTRO_CONFIRMACOES:
+                    suspeitos.append((i, campo, valor, motivo))
+                    continue
+                logger.warning(f"[Filtro {self.porta_vps}] {campo}: novo patamar {valor} aceito")
+
+            self.referencia[i] = valor
+            self.instante_referencia[i] = agora
+            self.candidato[i] = _NAN
+            self.confirmacoes[i] = 0
+
+        if suspeitos:
+            inteira = len(suspeitos) >= FILTRO_MAX_SUSPEITOS
+            capturado_em = dados.get("capturado_em")
+            for i, campo, valor, motivo in suspeitos:
+                valores[i] = _NAN
+                self.quarentena.append({
+                    "campo": campo, "valor": valor, "motivo": motivo,
+                    "capturado_em": capturado_em, "leitura_inteira": inteira,
+                })
+                metricas.incrementar(self.porta_vps, f"quarentena_{motivo}")
+            logger.warning(
+                f"[Filtro {self.porta_vps}] Quarentena"
+                f"{' (leitura inteira)' if inteira else ''}: "
+                + ", ".join(f"{campo}={valor} ({motivo})" for _, campo, valor, motivo in suspeitos)
+            )
+            if inteira:
+                metricas.incrementar(self.porta_vps, "leituras_quarentena")
+                return False
+
+        # Mediana de 3 nos analógicos (amostras aceitas)
+        for campo in CAMPOS_MEDIANA:
+            i = _INDICE_NUMERICO[campo]
+            valor = valores[i]
+            if valor != valor:
+                continue
+            a, b = self.janela[2 * i], self.janela[2 * i + 1]
+            self.janela[2 * i], self.janela[2 * i + 1] = b, valor
+            if a == a and b == b:
+                valores[i] = sorted((a, b, valor))[1]
+
+        inferir_status(dados)
+        return True
+
+    def exportar_estado(self) -> Dict[str, Any]:
+        """v2.28.0: referências e janelas, para a 1ª leitura após reiniciar já ter deltas"""
+        return {
+            "referencia": self.referencia.tolist(),
+            "instante_referencia": self.instante_referencia.tolist(),
+            "candidato": self.candidato.tolist(),
+            "instante_candidato": self.instante_candidato.tolist(),
+            "confirmacoes": self.confirmacoes.tolist(),
+            "janela": self.janela.tolist(),
+            "quarentena": list(self.quarentena),
+        }
+
+    def restaurar_estado(self, estado: Dict[str, Any]):
+        for nome in ("referencia", "instante_referencia", "candidato", "instante_candidato", "janela"):
+            setattr(self, nome, array("d", estado[nome]))
+        self.confirmacoes = array("B", estado["confirmacoes"])
+        self.quarentena.extend(estado["quarentena"])
+
+
+# =============================================================================
+# AVALIAÇÃO DE ALERTAS NA VPS (v2.6.0)
+# =============================================================================
+
+# Mesmo mapeamento usado pela edge function modbus-receiver
+# (parametros_alerta.parametro → campo da leitura)
+MAPA_PARAMETROS_ALERTA = {
+    "Tensão GMG": "tensao_gmg",
+    "Tensão Rede R-S": "tensao_rede_rs",
+    "Tensão Rede S-T": "tensao_rede_st",
+    "Tensão Rede T-R": "tensao_rede_tr",
+    "Corrente Fase 1": "corrente_fase1",
+    "Frequência GMG": "frequencia_gmg",
+    "RPM Motor": "rpm_motor",
+    "Temperatura Água": "temperatura_agua",
+    "Tensão Bateria": "tensao_bateria",
+    "Nível Combustível": "nivel_combustivel",
+}
+
+# Condições de status do controlador que geram alerta
+ALERTAS_STATUS = [
+    ("aviso_ativo", "warning", "Aviso ativo no controlador K30XL"),
+    ("falha_ativa", "critical", "Falha ativa no controlador K30XL"),
+]
+
+
+class CacheParametrosAlerta:
+    """
+    Cache dos parametros_alerta por gerador, renovado por TTL.
+
+    A renovação roda numa thread própria: o polling nunca espera o GET
+    (timeout de 10 s) e usa os parâmetros em cache, mesmo vencidos, até a
+    resposta chegar. Em caso de falha mantém os parâmetros anteriores (ou
+    a ausência deles) por RETRY_PARAMETROS_ALERTA segundos.
+    """
+
+    def __init__(self, ttl: float = TTL_PARAMETROS_ALERTA):
+        self.ttl = ttl
+        self._cache: Dict[str, tuple] = {}  # porta_vps → (expira_em, parametros ou None)
+        self._recarregando = set()
+        self._lock = threading.Lock()
+
+    def obter(self, porta_vps: str) -> Optional[list]:
+        """Retorna os parâmetros do gerador; agenda a recarga em segundo plano se o TTL expirou"""
+        agora = time.monotonic()
+
+        with self._lock:
+            entrada = self._cache.get(porta_vps)
+            if (entrada is None or entrada[0] <= agora) and porta_vps not in self._recarregando:
+                self._recarregando.add(porta_vps)
+                threading.Thread(
+                    target=self._recarregar, args=(porta_vps,), daemon=True, name=f"Parametros-{porta_vps}"
+                ).start()
+
+        return entrada[1] if entrada else None
+
+    def _recarregar(self, porta_vps: str):
+        parametros = None
+        try:
+            parametros = buscar_parametros_alerta(porta_vps)
+        finally:
+            agora = time.monotonic()
+            with self._lock:
+                self._recarregando.discard(porta_vps)
+                if parametros is None:
+                    # Mantém os parâmetros antigos (ou o resultado negativo) até a próxima tentativa
+                    entrada = self._cache.get(porta_vps)
+                    self._cache[porta_vps] = (agora + RETRY_PARAMETROS_ALERTA, entrada[1] if entrada else None)
+                else:
+                    self._cache[porta_vps] = (agora + self.ttl, parametros)
+
+        if parametros is not None:
+            logger.info(f"Parâmetros de alerta carregados ({porta_vps}): {len(parametros)}")
+
+    def invalidar(self, porta_vps: str):
+        """Força recarga na próxima consulta"""
+        with self._lock:
+            self._cache.pop(porta_vps, None)
+
+    def exportar_estado(self) -> Dict[str, Any]:
+        """v2.28.0: parâmetros com a expiração em epoch"""
+        diferenca = time.time() - time.monotonic()
+        with self._lock:
+            return {
+                porta: [expira_em + diferenca, parametros]
+                for porta, (expira_em, parametros) in self._cache.items() if parametros is not None
+            }
+
+    def restaurar_estado(self, estado: Dict[str, Any]):
+        """
+        Parâmetros expirados continuam valendo até a próxima tentativa de
+        recarga: a 1ª leitura após reiniciar não espera o backend.
+        """
+        agora = time.monotonic()
+        diferenca = time.time() - agora
+        with self._lock:
+            for porta, (expira_em, parametros) in estado.items():
+                self._cache[porta] = (max(expira_em - diferenca, agora + RETRY_PARAMETROS_ALERTA), parametros)
+
+
+class AvaliadorAlertas:
+    """
+    Avalia limites mínimo/máximo e bits de status de um gerador.
+
+    - Histerese: um alerta de limite só é encerrado quando o valor volta
+      HISTERESE_ALERTA além do limite (evita oscilação perto do limite).
+    - Dedupe: só transições inativo → ativo geram alerta, e a mesma condição
+      não é reenviada antes de INTERVALO_MIN_REALERTA segundos.
+    """
+
+    def __init__(self, porta_vps: str):
+        self.porta_vps = porta_vps
+        self.ativos: Dict[str, bool] = {}
+        self.ultimo_envio: Dict[str, float] = {}
+        self.chaves_reenvio: Dict[str, str] = {}  # v2.29.0: condição → chave do envio que falhou
+
+    def _banda(self, limite: float) -> float:
+        return abs(limite) * HISTERESE_ALERTA
+
+    def _transicao(self, chave: str, condicao: bool, retorno: bool) -> bool:
+        """
+        Atualiza o estado da condição. Retorna True se o alerta deve ser emitido.
+
+        Args:
+            condicao: valor está além do limite (dispara)
+            retorno: valor voltou além da faixa de histerese (encerra)
+        """
+        ativo = self.ativos.get(chave, False)
+
+        if not ativo:
+            if not condicao:
+                if self.chaves_reenvio:
+                    self.chaves_reenvio.pop(chave, None)  # condição encerrou antes do reenvio
+                return False
+            self.ativos[chave] = True
+            agora = time.monotonic()
+            ultimo = self.ultimo_envio.get(chave)
+            if ultimo is not None and agora - ultimo < INTERVALO_MIN_REALERTA:
+                return False
+            self.ultimo_envio[chave] = agora
+            return True
+
+        if retorno:
+            self.ativos[chave] = False
+        return False
+
+    def avaliar(self, dados: Dict[str, Any], parametros: list) -> list:
+        """Retorna os alertas novos para a leitura (mesmo formato da edge function)"""
+        alertas = []
+
+        for param in parametros:
+            if not param.get("habilitado", True):
+                continue
+
+            nome = param.get("parametro")
+            campo = MAPA_PARAMETROS_ALERTA.get(nome)
+            if campo is None:
+                continue
+
+            valor = dados.get(campo)
+            if valor is None:
+                continue
+
+            minimo = param.get("valor_minimo")
+            maximo = param.get("valor_maximo")
+            nivel = param.get("nivel", "warning")
+
+            if minimo is not None:
+                minimo = float(minimo)
+                if self._transicao(f"{nome}:min", valor < minimo, valor >= minimo + self._banda(minimo)):
+                    alertas.append({
+                        "condicao": f"{nome}:min",
+                        "nivel": nivel,
+                        "mensagem": f"{nome} abaixo do limite: {valor} (mínimo: {minimo})",
+                    })
+
+            if maximo is not None:
+                maximo = float(maximo)
+                if self._transicao(f"{nome}:max", valor > maximo, valor <= maximo - self._banda(maximo)):
+                    alertas.append({
+                        "condicao": f"{nome}:max",
+                        "nivel": nivel,
+                        "mensagem": f"{nome} acima do limite: {valor} (máximo: {maximo})",
+                    })
+
+        for campo, nivel, mensagem in ALERTAS_STATUS:
+            ativo = dados.get(campo)
+            if ativo is None:
+                continue  # leitura parcial sem o bloco de status: mantém o estado do alerta
+            if self._transicao(f"status:{campo}", ativo, not ativo):
+                alertas.append({"condicao": f"status:{campo}", "nivel": nivel, "mensagem": mensagem})
+
+        return alertas
+
+    def reabrir(self, alertas: list):
+        """Desfaz o registro dos alertas não entregues para que sejam reemitidos"""
+        for alerta in alertas:
+            self.ativos.pop(alerta["condicao"], None)
+            self.ultimo_envio.pop(alerta["condicao"], None)
+            if alerta.get("chave"):
+                self.chaves_reenvio[alerta["condicao"]] = alerta["chave"]
+
+    def exportar_estado(self) -> Dict[str, Any]:
+        """v2.28.0: condições ativas e últimos envios (epoch), para não realertar após reiniciar"""
+        diferenca = time.time() - time.monotonic()
+        return {
+            "ativos": dict(self.ativos),
+            "ultimo_envio": {chave: instante + diferenca for chave, instante in list(self.ultimo_envio.items())},
+            "chaves_reenvio": dict(self.chaves_reenvio),
+        }
+
+    def restaurar_estado(self, estado: Dict[str, Any]):
+        diferenca = time.time() - time.monotonic()
+        self.ativos.update(estado["ativos"])
+        self.chaves_reenvio.update(estado.get("chaves_reenvio", {}))
+        self.ultimo_envio.update({chave: instante - diferenca for chave, instante in estado["ultimo_envio"].items()})
+
+
+cache_parametros_alerta = CacheParametrosAlerta()
+
+
+def processar_alertas(avaliador: AvaliadorAlertas, dados: Dict[str, Any]) -> bool:
+    """
+    Avalia a leitura contra os parâmetros em cache e envia os alertas novos.
+
+    Retorna True se a avaliação foi feita na VPS (a edge function pode então
+    pular a consulta a parametros_alerta), False se os parâmetros ainda
+    não estão disponíveis.
+    """
+    parametros = cache_parametros_alerta.obter(avaliador.porta_vps)
+    if parametros is None:
+        return False
+
+    alertas = avaliador.avaliar(dados, parametros)
+
+    if alertas:
+        numerar_leitura(avaliador.porta_vps, dados)
+        for alerta in alertas:
+            # v2.29.0: chave de idempotência (a mesma se o alerta está sendo reenviado)
+            chave = avaliador.chaves_reenvio.pop(alerta["condicao"], None)
+            if chave is None and dados.get("seq") is not None:
+                chave = f"{dados.get('id_fluxo')}:{dados.get('seq')}:{alerta['condicao']}"
+            if chave is not None:
+                alerta["chave"] = chave
+            logger.warning(f"⚠ ALERTA [{alerta['nivel']}] porta {avaliador.porta_vps}: {alerta['mensagem']}")
+
+        if MODO_DEBUG:
+            logger.info("*** MODO DEBUG: alertas NÃO enviados ***")
+        elif sink_eventos is not None:
+            # Envio na thread do sink de eventos, com fila e backoff próprios
+            sink_eventos.entregar(avaliador.porta_vps, {"alertas": alertas})
+        elif not enviar_alertas_para_backend(avaliador.porta_vps, alertas):
+            avaliador.reabrir(alertas)
+
+    return True
+
+
+# =============================================================================
+# AGREGAÇÃO LOCAL - ROLLUPS (v2.7.0)
+# =============================================================================
+
+# Valores elétricos e do motor agregados em cada janela
+CAMPOS_ROLLUP = [
+    "tensao_rede_rs",
+    "tensao_rede_st",
+    "tensao_rede_tr",
+    "tensao_gmg",
+    "corrente_fase1",
+    "frequencia_gmg",
+    "rpm_motor",
+    "tensao_bateria",
+    "temperatura_agua",
+    "nivel_combustivel",
+    "horimetro_horas",
+    "numero_partidas",
+]
+
+
+class EstatisticaCampo:
+    """Min/max/média/último de um campo, acumulados em streaming"""
+
+    __slots__ = ("minimo", "maximo", "soma", "ultimo", "amostras")
+
+    def __init__(self, valor: float):
+        self.minimo = valor
+        self.maximo = valor
+        self.soma = valor
+        self.ultimo = valor
+        self.amostras = 1
+
+    def adicionar(self, valor: float):
+        if valor < self.minimo:
+            self.minimo = valor
+        if valor > self.maximo:
+            self.maximo = valor
+        self.soma += valor
+        self.ultimo = valor
+        self.amostras += 1
+
+    def para_dict(self) -> Dict[str, Any]:
+        return {
+            "min": self.minimo,
+            "max": self.maximo,
+            "media": round(self.soma / self.amostras, 3),
+            "ultimo": self.ultimo,
+            "amostras": self.amostras,
+        }
+
+
+class AgregadorRollup:
+    """
+    Agrega as leituras de um gerador em janelas alinhadas ao relógio
+    (JANELAS_ROLLUP). Cada janela fechada vira uma linha para o backend.
+    Memória constante: uma EstatisticaCampo por campo e janela aberta.
+    """
+
+    def __init__(self, porta_vps: str, janelas: Dict[str, int] = None):
+        self.porta_vps = porta_vps
+        self.janelas = janelas or JANELAS_ROLLUP
+        self._abertas: Dict[str, tuple] = {}  # janela → (inicio, amostras, {campo: EstatisticaCampo})
+        self.pendentes: list = []
+
+    def _fechar(self, nome: str) -> Dict[str, Any]:
+        inicio, amostras, estatisticas = self._abertas.pop(nome)
+        duracao = self.janelas[nome]
+        return {
+            "janela": nome,
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(inicio)),
+            "fim": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(inicio + duracao)),
+            "amostras": amostras,
+            "estatisticas": {campo: est.para_dict() for campo, est in estatisticas.items()},
+        }
+
+    def fechar_expiradas(self, instante: float = None) -> list:
+        """Fecha as janelas cujo fim já passou (mesmo sem novas amostras)"""
+        instante = time.time() if instante is None else instante
+        fechadas = []
+        for nome, duracao in self.janelas.items():
+            aberta = self._abertas.get(nome)
+            if aberta and instante >= aberta[0] + duracao:
+                fechadas.append(self._fechar(nome))
+        return fechadas
+
+    def adicionar(self, dados: Dict[str, Any], instante: float = None) -> list:
+        """Acumula uma leitura. Retorna os rollups das janelas que fecharam."""
+        instante = time.time() if instante is None else instante
+        fechadas = self.fechar_expiradas(instante)
+
+        for nome, duracao in self.janelas.items():
+            if nome not in self._abertas:
+                self._abertas[nome] = (instante - instante % duracao, 0, {})
+            inicio, amostras, estatisticas = self._abertas[nome]
+
+            for campo in CAMPOS_ROLLUP:
+                valor = dados.get(campo)
+                if valor is None:
+                    continue
+                est = estatisticas.get(campo)
+                if est is None:
+                    estatisticas[campo] = EstatisticaCampo(valor)
+                else:
+                    est.adicionar(valor)
+
+            self._abertas[nome] = (inicio, amostras + 1, estatisticas)
+
+        return fechadas
+
+    def exportar_estado(self) -> Dict[str, Any]:
+        """v2.28.0: janelas abertas e rollups ainda não enviados"""
+        abertas = {}
+        for nome, (inicio, amostras, estatisticas) in list(self._abertas.items()):
+            abertas[nome] = [inicio, amostras, {
+                campo: [est.minimo, est.maximo, est.soma, est.ultimo, est.amostras]
+                for campo, est in list(estatisticas.items())
+            }]
+        return {"abertas": abertas, "pendentes": list(self.pendentes)}
+
+    def restaurar_estado(self, estado: Dict[str, Any]):
+        for nome, (inicio, amostras, campos) in estado["abertas"].items():
+            if nome not in self.janelas:
+                continue
+            estatisticas = {}
+            for campo, (minimo, maximo, soma, ultimo, n) in campos.items():
+                est = estatisticas[campo] = EstatisticaCampo(minimo)
+                est.maximo, est.soma, est.ultimo, est.amostras = maximo, soma, ultimo, n
+            self._abertas[nome] = (inicio, amostras, estatisticas)
+        self.enfileirar(estado["pendentes"])
+
+    def enfileirar(self, rollups: list):
+        """Guarda rollups para envio, descartando os mais antigos se exceder o limite"""
+        self.pendentes.extend(rollups)
+        excesso = len(self.pendentes) - MAX_ROLLUPS_PENDENTES
+        if excesso > 0:
+            logger.warning(f"Descartando {excesso} rollups antigos da porta {self.porta_vps}")
+            del self.pendentes[:excesso]
+
+
+def enviar_rollups_para_backend(porta_vps: str, rollups: list) -> bool:
+    """
+    Envia os rollups fechados para a edge function (tabela leituras_agregadas).
+    O backend faz upsert por (gerador, janela, início), então reenvios são seguros.
+    """
+    return postar_eventos(porta_vps, "rollups", rollups) == 200
+
+
+def processar_rollups(agregador: AgregadorRollup, dados: Optional[Dict[str, Any]]):
+    """Acumula a leitura (se houver) e envia as janelas fechadas"""
+    if dados:
+        fechadas = agregador.adicionar(dados)
+    else:
+        fechadas = agregador.fechar_expiradas()
+
+    if not ENVIAR_ROLLUPS:
+        return
+
+    agregador.enfileirar(fechadas)
+
+    if not agregador.pendentes or MODO_DEBUG:
+        agregador.pendentes.clear()
+        return
+
+    if sink_eventos is not None:
+        # A fila de envio passa a ser a do sink de eventos (fora do ciclo de polling)
+        sink_eventos.entregar(agregador.porta_vps, {"rollups": agregador.pendentes})
+        agregador.pendentes = []
+    elif enviar_rollups_para_backend(agregador.porta_vps, agregador.pendentes):
+        agregador.pendentes.clear()
+
+
+# =============================================================================
+# SINK POSTGRES DIRETO (v2.15.0)
+# =============================================================================
+#
+# Alternativa opcional ao POST por leitura na edge function: as leituras são
+# acumuladas e gravadas em lote (INSERT multi-linha via execute_values) numa
+# conexão do pool. A porta_vps → gerador_id fica em cache local.
+#
+# Leituras de portas sem equipamentos_hf cadastrado, ou cujos alertas não
+# foram avaliados na VPS, continuam indo pela edge function (que cadastra o
+# gerador e avalia parametros_alerta).
+
+# Mesmo mapeamento do insert em supabase/functions/modbus-receiver/index.ts
+COLUNAS_LEITURA = (
+    "tensao_rede_rs",
+    "tensao_rede_st",
+    "tensao_rede_tr",
+    "tensao_gmg",
+    "corrente_fase1",
+    "frequencia_gmg",
+    "rpm_motor",
+    "temperatura_agua",
+    "tensao_bateria",
+    "horas_trabalhadas",
+    "numero_partidas",
+    "nivel_combustivel",
+    "motor_funcionando",
+    "rede_ok",
+    "gmg_alimentando",
+    "aviso_ativo",
+    "falha_ativa",
+    "horimetro_horas",
+    "horimetro_minutos",
+    "horimetro_segundos",
+    "capturado_em",
+    "trace_id",
+    "seq",
+    "id_fluxo",
+    "leitura_parcial",
+)
+
+# v2.29.0: reenvio de (id_fluxo, seq) já gravado é ignorado
+SQL_INSERT_LEITURAS = (
+    "INSERT INTO public.leituras_tempo_real (gerador_id, "
+    + ", ".join(COLUNAS_LEITURA)
+    + ") VALUES %s ON CONFLICT (gerador_id, id_fluxo, seq) DO NOTHING"
+)
+SQL_GERADOR_POR_PORTA = "SELECT gerador_id FROM public.equipamentos_hf WHERE porta_vps = %s LIMIT 1"
+SQL_STATUS_ONLINE = (
+    "UPDATE public.equipamentos_hf SET status = 'online', updated_at = now() "
+    "WHERE porta_vps = ANY(%s)"
+)
+
+
+class SinkPostgres:
+    """Grava leituras em lote direto no Postgres, com thread própria"""
+
+    def __init__(self, dsn: str):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, POSTGRES_POOL_MAX, dsn)
+        self._fila: deque = deque(maxlen=POSTGRES_FILA_MAX)
+        self._sinal = threading.Event()
+        self._geradores: Dict[str, tuple] = {}  # porta → (gerador_id | None, expira_em)
+        self._gravando = False
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="Sink-Postgres")
+        self._thread.start()
+
+    @contextlib.contextmanager
+    def _conexao(self):
+        """Conexão do pool; getconn() também falha com o banco fora (OperationalError/PoolError)"""
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def gerador_id(self, porta_vps: str) -> Optional[str]:
+        """porta_vps → gerador_id, com cache (inclusive de portas não cadastradas)"""
+        agora = time.monotonic()
+        em_cache = self._geradores.get(porta_vps)
+        if em_cache is not None and em_cache[1] > agora:
+            return em_cache[0]
+
+        try:
+            with self._conexao() as conn, conn, conn.cursor() as cur:
+                cur.execute(SQL_GERADOR_POR_PORTA, (porta_vps,))
+                linha = cur.fetchone()
+        except (psycopg2.Error, psycopg2.pool.PoolError) as e:
+            logger.error(f"[Postgres] Erro ao buscar gerador da porta {porta_vps}: {e}")
+            # Leituras seguem pela edge function; não reconecta a cada polling
+            self._geradores[porta_vps] = (None, agora + POSTGRES_RETRY_GERADOR)
+            return None
+
+        gerador_id = str(linha[0]) if linha else None
+        self._geradores[porta_vps] = (gerador_id, agora + POSTGRES_TTL_GERADOR)
+        if gerador_id is None:
+            logger.warning(f"[Postgres] Porta {porta_vps} sem equipamentos_hf, usando edge function")
+        return gerador_id
+
+    def enfileirar(self, porta_vps: str, dados: Dict[str, Any]) -> bool:
+        """Enfileira a leitura para o próximo lote. False se a porta não está mapeada."""
+        gerador_id = self.gerador_id(porta_vps)
+        if gerador_id is None:
+            return False
+        linha = (gerador_id,) + tuple(dados.get(coluna) for coluna in COLUNAS_LEITURA[:-1]) + (
+            bool(dados.get("leitura_parcial", False)),
+        )
+        if len(self._fila) == self._fila.maxlen:
+            metricas.incrementar(porta_vps, "postgres_descartadas")
+        self._fila.append((porta_vps, linha))
+        if len(self._fila) >= POSTGRES_LOTE_MAX:
+            self._sinal.set()
+        return True
+
+    def pendentes(self) -> int:
+        return len(self._fila)
+
+    def esvaziar(self, timeout: float) -> bool:
+        """Força a gravação do que está na fila e aguarda até `timeout` segundos"""
+        limite = time.monotonic() + timeout
+        while self._fila or self._gravando:
+            if time.monotonic() > limite:
+                return False
+            self._sinal.set()
+            time.sleep(0.05)
+        return True
+
+    def _loop(self):
+        while True:
+            self._sinal.wait(POSTGRES_INTERVALO_LOTE)
+            self._sinal.clear()
+            while self._fila:
+                lote = []
+                self._gravando = True
+                while self._fila and len(lote) < POSTGRES_LOTE_MAX:
+                    lote.append(self._fila.popleft())
+                try:
+                    gravado = self.gravar(lote)
+                except Exception as e:
+                    # A thread do sink não pode morrer: o lote volta para a fila
+                    logger.exception(f"[Postgres] Erro inesperado ao gravar lote: {e}")
+                    gravado = False
+                self._gravando = False
+                if not gravado:
+                    # Devolve o lote (mais antigo na frente) e tenta no próximo intervalo
+                    self._fila.extendleft(reversed(lote))
+                    break
+
+    def gravar(self, lote: list) -> bool:
+        """Um INSERT multi-linha e um UPDATE de status por lote"""
+        portas = sorted({porta for porta, _ in lote})
+        inicio = time.monotonic()
+        try:
+            with self._conexao() as conn, conn, conn.cursor() as cur:
+                psycopg2.extras.execute_values(
+                    cur, SQL_INSERT_LEITURAS, [linha for _, linha in lote], page_size=POSTGRES_LOTE_MAX
+                )
+                cur.execute(SQL_STATUS_ONLINE, (portas,))
+        except (psycopg2.Error, psycopg2.pool.PoolError) as e:
+            logger.error(f"[Postgres] Falha ao gravar lote de {len(lote)} leituras: {e}")
+            for porta in portas:
+                metricas.incrementar(porta, "postgres_erros")
+            return False
+
+        for porta, _ in lote:
+            metricas.incrementar(porta, "postgres_linhas")
+        logger.info(f"[Postgres] ✓ {len(lote)} leituras gravadas em {(time.monotonic() - inicio) * 1000:.0f} ms")
+        return True
+
+
+# Criado em main() quando GMG_POSTGRES_DSN está definido
+sink_postgres: Optional[SinkPostgres] = None
+
+
+def iniciar_sink_postgres() -> Optional[SinkPostgres]:
+    if not POSTGRES_DSN:
+        return None
+    if psycopg2 is None:
+        logger.error("GMG_POSTGRES_DSN definido, mas psycopg2 não está instalado (pip install psycopg2-binary)")
+        return None
+    try:
+        sink = SinkPostgres(POSTGRES_DSN)
+    except psycopg2.Error as e:
+        logger.error(f"[Postgres] Não foi possível conectar, usando edge function: {e}")
+        return None
+    logger.info(f"[Postgres] Sink direto ativo (lotes de até {POSTGRES_LOTE_MAX} leituras)")
+    return sink
+
+
+def enviar_leitura(porta_vps: str, dados: Dict[str, Any], alertas_avaliados: bool = False,
+                   seq_min: Optional[int] = None) -> bool:
+    """Sink Postgres quando disponível; caso contrário, edge function"""
+    return gravar_leitura(porta_vps, dados, alertas_avaliados, seq_min) == 200
+
+
+def gravar_leitura(porta_vps: str, dados: Dict[str, Any], alertas_avaliados: bool = False,
+                   seq_min: Optional[int] = None) -> Optional[int]:
+    """Como enviar_leitura, retornando o status HTTP (200 se foi para o sink Postgres)"""
+    numerar_leitura(porta_vps, dados)
+    if sink_postgres is not None and alertas_avaliados:
+        try:
+            if sink_postgres.enfileirar(porta_vps, dados):
+                return 200
+        except Exception as e:
+            logger.error(f"[Postgres] Erro ao enfileirar leitura da porta {porta_vps}: {e}")
+    if sink_postgres is not None:
+        metricas.incrementar(porta_vps, "postgres_fallback_http")
+    return postar_leitura(porta_vps, dados, alertas_avaliados, seq_min)
+
+
+# =============================================================================
+# STREAM DE LEITURAS AO VIVO (v2.14.0)
+# =============================================================================
+#
+# Cada leitura decodificada é publicada no barramento logo após o polling,
+# antes do upload. Os assinantes (GET /stream, Server-Sent Events) têm cada
+# um uma deque de tamanho fixo: publicar nunca bloqueia o worker, e um
+# consumidor lento perde as mensagens mais antigas em vez de acumular memória.
+
+class Assinatura:
+    """Fila de um consumidor do stream (um gerador ou a frota inteira)"""
+
+    __slots__ = ("porta_vps", "mensagens", "sinal", "descartadas")
+
+    def __init__(self, porta_vps: Optional[str]):
+        self.porta_vps = porta_vps
+        self.mensagens: deque = deque(maxlen=STREAM_FILA_ASSINANTE)
+        self.sinal = threading.Event()
+        self.descartadas = 0
+
+    def entregar(self, mensagem: bytes) -> bool:
+        """Chamado pelo publicador; retorna True se descartou a mais antiga"""
+        cheia = len(self.mensagens) == self.mensagens.maxlen
+        if cheia:
+            self.descartadas += 1
+        self.mensagens.append(mensagem)
+        self.sinal.set()
+        return cheia
+
+    def aguardar(self, timeout: float) -> list:
+        """Retorna as mensagens pendentes, aguardando até `timeout` segundos"""
+        if not self.mensagens:
+            self.sinal.wait(timeout)
+        self.sinal.clear()
+        pendentes = []
+        while self.mensagens:
+            pendentes.append(self.mensagens.popleft())
+        return pendentes
+
+
+class BarramentoLeituras:
+    """Fan-out das leituras dos workers para os sinks e os assinantes do stream"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinaturas: list = []
+        self._sinks: list = []
+        self._sequencia = 0
+
+    def registrar_sink(self, sink):
+        with self._lock:
+            self._sinks = self._sinks + [sink]
+
+    @property
+    def sinks(self) -> list:
+        return self._sinks
+
+    def assinar(self, porta_vps: Optional[str] = None) -> Optional[Assinatura]:
+        """Nova assinatura (porta_vps=None: todos os geradores), ou None se lotado"""
+        with self._lock:
+            if len(self._assinaturas) >= STREAM_MAX_ASSINANTES:
+                return None
+            assinatura = Assinatura(porta_vps)
+            self._assinaturas = self._assinaturas + [assinatura]
+            return assinatura
+
+    def cancelar(self, assinatura: Assinatura):
+        with self._lock:
+            self._assinaturas = [a for a in self._assinaturas if a is not assinatura]
+
+    def __len__(self) -> int:
+        return len(self._assinaturas)
+
+    def publicar(self, porta_vps: str, evento: str, dados: Dict[str, Any], alertas_avaliados: bool = False):
+        """Entrega um evento aos sinks (só leituras) e aos assinantes interessados, sem bloquear"""
+        if evento == "leitura":
+            for sink in self._sinks:
+                if sink.recebe_leituras:
+                    sink.entregar(porta_vps, dados, alertas_avaliados)
+        assinaturas = self._assinaturas  # cópia imutável (copy-on-write)
+        if not assinaturas:
+            return
+        with self._lock:
+            self._sequencia += 1
+            sequencia = self._sequencia
+        corpo = json.dumps({"porta_vps": porta_vps, **dados}, ensure_ascii=False)
+        mensagem = f"id: {sequencia}\nevent: {evento}\ndata: {corpo}\n\n".encode()
+        for assinatura in assinaturas:
+            if assinatura.porta_vps is None or assinatura.porta_vps == porta_vps:
+                if assinatura.entregar(mensagem):
+                    metricas.incrementar(porta_vps, "stream_descartadas")
+
+
+barramento = BarramentoLeituras()
+
+
+# =============================================================================
+# SÉRIE TEMPORAL LOCAL COMPRIMIDA (v2.25.0)
+# =============================================================================
+#
+# Meses de leituras brutas na própria VPS (análise pós-incidente) sem mandar
+# tudo para o backend. Cada gerador tem um diretório SERIE_DIRETORIO/<porta>/
+# com um arquivo por hora UTC (AAAAMMDDTHH.gms), gravado só com append:
+#
+#   arquivo  "GMGSERIE" + versão (u16) + tamanho (u32) + esquema JSON
+#   bloco    "GBLK" + amostras (u32) + t_inicio_ms, t_fim_ms (i64)
+#            + colunas (u16) + bytes de cada coluna (u32) + colunas
+#
+# O esquema lista as colunas do arquivo (capturado_em, CAMPOS_NUMERICOS,
+# booleanos). Se CAMPOS_NUMERICOS mudar, a hora continua em outro arquivo
+# (AAAAMMDDTHH.1.gms) e os antigos seguem legíveis pelo próprio esquema.
+#
+# Cada coluna é comprimida bit a bit no estilo Gorilla:
+#
+#   capturado_em  ms, delta-of-delta: '0' (mesmo intervalo), '10' + 7 bits,
+#                 '110' + 9, '1110' + 12, '1111' + 32
+#   numéricos     XOR com o float64 anterior: '0' (igual), '10' + bits
+#                 significativos na janela anterior, '11' + 5 bits de zeros
+#                 à esquerda + 6 bits de tamanho + bits significativos
+#   booleanos     '0' (igual ao anterior) ou '1' + 32 bits
+#
+# A codificação é incremental: cada amostra custa alguns shifts por coluna
+# no bloco aberto em memória, que vai para o arquivo a cada SERIE_BLOCO_S,
+# na virada da hora e no encerramento (um crash perde no máximo isso). Cada
+# bloco começa com os valores brutos e é decodificável sozinho; a leitura
+# de um intervalo só abre os arquivos das horas tocadas, pula pelo
+# cabeçalho os blocos de fora e só decodifica as colunas pedidas.
+#
+# Retenção: o sink apaga a cada hora os arquivos mais antigos que
+# SERIE_RETENCAO_DIAS. Medir bytes por amostra: --teste-serie.
+
+SERIE_MAGICO = b"GMGSERIE"
+SERIE_VERSAO_LAYOUT = 1
+SERIE_MAGICO_BLOCO = b"GBLK"
+_SERIE_CABECALHO = struct.Struct("<8sHI")
+_SERIE_BLOCO = struct.Struct("<4sIqqH")
+
+
+def _esquema_serie() -> bytes:
+    esquema = {"colunas": ["capturado_em", *CAMPOS_NUMERICOS, "booleanos"], "booleanos": list(CAMPOS_BOOLEANOS)}
+    return json.dumps(esquema, separators=(",", ":")).encode()
+
+
+class _EscritorBits:
+    """Bits acumulados num inteiro, o primeiro escrito é o mais significativo"""
+
+    __slots__ = ("acumulado", "bits")
+
+    def __init__(self):
+        self.acumulado = 0
+        self.bits = 0
+
+    def escrever(self, valor: int, bits: int):
+        self.acumulado = (self.acumulado << bits) | valor
+        self.bits += bits
+
+    def para_bytes(self) -> bytes:
+        sobra = -self.bits % 8
+        return (self.acumulado << sobra).to_bytes((self.bits + sobra) // 8, "big")
+
+
+class _LeitorBits:
+    __slots__ = ("acumulado", "restantes")
+
+    def __init__(self, dados: bytes):
+        self.acumulado = int.from_bytes(dados, "big")
+        self.restantes = len(dados) * 8
+
+    def ler(self, bits: int) -> int:
+        self.restantes -= bits
+        return (self.acumulado >> self.restantes) & ((1 << bits) - 1)
+
+
+class _ColunaTempo:
+    """capturado_em em ms, delta-of-delta (o primeiro instante fica no cabeçalho do bloco)"""
+
+    __slots__ = ("saida", "anterior", "delta")
+
+    def __init__(self, primeiro: int):
+        self.saida = _EscritorBits()
+        self.anterior = primeiro
+        self.delta = 0
+
+    def adicionar(self, instante: int):
+        delta = instante - self.anterior
+        dd = delta - self.delta
+        self.anterior = instante
+        self.delta = delta
+        if dd == 0:
+            self.saida.escrever(0, 1)
+        elif -63 <= dd <= 64:
+            self.saida.escrever((0b10 << 7) | (dd + 63), 9)
+        elif -255 <= dd <= 256:
+            self.saida.escrever((0b110 << 9) | (dd + 255), 12)
+        elif -2047 <= dd <= 2048:
+            self.saida.escrever((0b1110 << 12) | (dd + 2047), 16)
+        else:
+            self.saida.escrever((0b1111 << 32) | (dd & 0xFFFFFFFF), 36)
+
+
+def _decodificar_tempo(dados: bytes, amostras: int, primeiro: int) -> list:
+    leitor = _LeitorBits(dados)
+    instante, delta = primeiro, 0
+    saida = [primeiro]
+    for _ in range(amostras - 1):
+        if not leitor.ler(1):
+            dd = 0
+        elif not leitor.ler(1):
+            dd = leitor.ler(7) - 63
+        elif not leitor.ler(1):
+            dd = leitor.ler(9) - 255
+        elif not leitor.ler(1):
+            dd = leitor.ler(12) - 2047
+        else:
+            dd = leitor.ler(32)
+            if dd >= 1 << 31:
+                dd -= 1 << 32
+        delta += dd
+        instante += delta
+        saida.append(instante)
+    return saida
+
+
+class _ColunaXOR:
+    """float64 (como inteiro de 64 bits) em XOR com o anterior"""
+
+    __slots__ = ("saida", "anterior", "zeros_esquerda", "zeros_direita")
+
+    def __init__(self, primeiro: int):
+        self.saida = _EscritorBits()
+        self.saida.escrever(primeiro, 64)
+        self.anterior = primeiro
+        self.zeros_esquerda = -1  # sem janela ainda
+        self.zeros_direita = 0
+
+    def adicionar(self, valor: int):
+        xor = valor ^ self.anterior
+        if not xor:
+            self.saida.escrever(0, 1)
+            return
+        self.anterior = valor
+        esquerda = min(64 - xor.bit_length(), 31)
+        direita = (xor & -xor).bit_length() - 1
+        if self.zeros_esquerda >= 0 and esquerda >= self.zeros_esquerda and direita >= self.zeros_direita:
+            bits = 64 - self.zeros_esquerda - self.zeros_direita
+            self.saida.escrever((0b10 << bits) | (xor >> self.zeros_direita), bits + 2)
+        else:
+            bits = 64 - esquerda - direita
+            controle = (0b11 << 11) | (esquerda << 6) | (bits - 1)
+            self.saida.escrever((controle << bits) | (xor >> direita), bits + 13)
+            self.zeros_esquerda = esquerda
+            self.zeros_direita = direita
+
+
+def _decodificar_xor(dados: bytes, amostras: int) -> array:
+    leitor = _LeitorBits(dados)
+    valor = leitor.ler(64)
+    saida = array("Q", [valor])
+    esquerda = direita = 0
+    for _ in range(amostras - 1):
+        if leitor.ler(1):
+            if leitor.ler(1):
+                esquerda = leitor.ler(5)
+                direita = 64 - esquerda - (leitor.ler(6) + 1)
+            valor ^= leitor.ler(64 - esquerda - direita) << direita
+        saida.append(valor)
+    return array("d", saida.tobytes())
+
+
+class _ColunaBooleanos:
+    """Palavra de booleanos da Leitura: '0' se repetiu, senão '1' + 32 bits"""
+
+    __slots__ = ("saida", "anterior")
+
+    def __init__(self, primeiro: int):
+        self.saida = _EscritorBits()
+        self.saida.escrever(primeiro, 32)
+        self.anterior = primeiro
+
+    def adicionar(self, valor: int):
+        if valor == self.anterior:
+            self.saida.escrever(0, 1)
+        else:
+            self.saida.escrever((1 << 32) | valor, 33)
+            self.anterior = valor
+
+
+def _decodificar_booleanos(dados: bytes, amostras: int) -> list:
+    leitor = _LeitorBits(dados)
+    valor = leitor.ler(32)
+    saida = [valor]
+    for _ in range(amostras - 1):
+        if leitor.ler(1):
+            valor = leitor.ler(32)
+        saida.append(valor)
+    return saida
+
+
+class _BlocoSerie:
+    """Bloco aberto: uma coluna comprimida por campo, codificada a cada amostra"""
+
+    __slots__ = ("amostras", "inicio_ms", "tempo", "valores", "booleanos", "aberto_em")
+
+    def __init__(self, instante_ms: int, valores, booleanos: int):
+        self.amostras = 1
+        self.inicio_ms = instante_ms
+        self.tempo = _ColunaTempo(instante_ms)
+        self.valores = [_ColunaXOR(valor) for valor in valores]
+        self.booleanos = _ColunaBooleanos(booleanos)
+        self.aberto_em = time.monotonic()
+
+    def adicionar(self, instante_ms: int, valores, booleanos: int):
+        self.amostras += 1
+        self.tempo.adicionar(instante_ms)
+        for coluna, valor in zip(self.valores, valores):
+            coluna.adicionar(valor)
+        self.booleanos.adicionar(booleanos)
+
+    def serializar(self) -> bytes:
+        colunas = [self.tempo.saida.para_bytes()]
+        colunas.extend(coluna.saida.para_bytes() for coluna in self.valores)
+        colunas.append(self.booleanos.saida.para_bytes())
+        cabecalho = _SERIE_BLOCO.pack(SERIE_MAGICO_BLOCO, self.amostras, self.inicio_ms,
+                                      self.tempo.anterior, len(colunas))
+        return cabecalho + struct.pack(f"<{len(colunas)}I", *map(len, colunas)) + b"".join(colunas)
+
+
+def _nome_particao(particao: int) -> str:
+    return time.strftime("%Y%m%dT%H", time.gmtime(particao))
+
+
+def _particoes(diretorio: str) -> list:
+    """(início da hora, caminho) dos arquivos de um gerador, em ordem"""
+    try:
+        nomes = os.listdir(diretorio)
+    except FileNotFoundError:
+        return []
+    particoes = []
+    for nome in nomes:
+        if not nome.endswith(".gms"):
+            continue
+        try:
+            inicio = datetime.strptime(nome[:11], "%Y%m%dT%H").replace(tzinfo=timezone.utc).timestamp()
+            sufixo = int(nome[12:-4] or 0)  # AAAAMMDDTHH.1.gms: mesma hora, esquema novo
+        except ValueError:
+            continue
+        particoes.append((int(inicio), sufixo, os.path.join(diretorio, nome)))
+    particoes.sort()
+    return [(inicio, caminho) for inicio, _, caminho in particoes]
+
+
+def _ler_esquema(dados: bytes) -> Optional[tuple]:
+    """(esquema, posição do primeiro bloco), ou None se não for um arquivo de série"""
+    if len(dados) < _SERIE_CABECALHO.size:
+        return None
+    magico, versao, tamanho = _SERIE_CABECALHO.unpack_from(dados)
+    if magico != SERIE_MAGICO or versao != SERIE_VERSAO_LAYOUT:
+        return None
+    fim = _SERIE_CABECALHO.size + tamanho
+    return json.loads(dados[_SERIE_CABECALHO.size:fim]), fim
+
+
+class SerieTemporal:
+    """Escrita da série de um gerador: bloco aberto em memória + arquivo da hora"""
+
+    __slots__ = ("porta_vps", "diretorio", "bloco", "particao", "caminho")
+
+    def __init__(self, porta_vps: str, diretorio: str = None):
+        self.porta_vps = porta_vps
+        self.diretorio = os.path.join(diretorio or SERIE_DIRETORIO, porta_vps)
+        self.bloco: Optional[_BlocoSerie] = None
+        self.particao: Optional[int] = None
+        self.caminho: Optional[str] = None
+        os.makedirs(self.diretorio, exist_ok=True)
+
+    def adicionar(self, instante: float, valores: array, booleanos: int) -> int:
+        """Codifica uma amostra; devolve os bytes gravados se um bloco fechou"""
+        instante_ms = int(round(instante * 1000))
+        particao = int(instante // SERIE_PARTICAO_S) * SERIE_PARTICAO_S
+        gravados = 0
+        if self.bloco is not None and (
+            particao != self.particao or instante_ms - self.bloco.inicio_ms >= SERIE_BLOCO_S * 1000
+        ):
+            gravados = self.descarregar()
+        bits = memoryview(valores).cast("B").cast("Q")
+        if self.bloco is None:
+            if particao != self.particao:
+                self.caminho = None
+            self.bloco = _BlocoSerie(instante_ms, bits, booleanos)
+            self.particao = particao
+        else:
+            self.bloco.adicionar(instante_ms, bits, booleanos)
+        return gravados
+
+    def _caminho_particao(self) -> str:
+        """Arquivo da hora com o esquema atual (outro sufixo se o esquema mudou)"""
+        base = os.path.join(self.diretorio, _nome_particao(self.particao))
+        esquema = _esquema_serie()
+        for sufixo in range(100):
+            caminho = f"{base}.gms" if not sufixo else f"{base}.{sufixo}.gms"
+            if not os.path.exists(caminho):
+                return caminho
+            with open(caminho, "rb") as arquivo:
+                lido = _ler_esquema(arquivo.read(65536))
+            if lido is not None and json.dumps(lido[0], separators=(",", ":")).encode() == esquema:
+                return caminho
+        raise RuntimeError(f"Esquemas demais na hora {base}")
+
+    def descarregar(self) -> int:
+        """Grava o bloco aberto no arquivo da hora (append)"""
+        if self.bloco is None:
+            return 0
+        bloco, self.bloco = self.bloco, None
+        dados = bloco.serializar()
+        if self.caminho is None:
+            self.caminho = self._caminho_particao()
+        with open(self.caminho, "ab") as arquivo:
+            if arquivo.tell() == 0:
+                esquema = _esquema_serie()
+                arquivo.write(_SERIE_CABECALHO.pack(SERIE_MAGICO, SERIE_VERSAO_LAYOUT, len(esquema)) + esquema)
+            arquivo.write(dados)
+        return len(dados)
+
+
+def _ler_particao(caminho: str, inicio_ms: int, fim_ms: int, campos: list, estatisticas: Counter):
+    with open(caminho, "rb") as arquivo:
+        dados = arquivo.read()
+    lido = _ler_esquema(dados)
+    if lido is None:
+        logger.warning(f"[Série] {caminho}: cabeçalho inválido")
+        return
+    esquema, posicao = lido
+    estatisticas["arquivos"] += 1
+    indice = {nome: i for i, nome in enumerate(esquema["colunas"])}
+    bits_booleanos = {nome: i for i, nome in enumerate(esquema["booleanos"])}
+
+    while posicao + _SERIE_BLOCO.size <= len(dados):
+        magico, amostras, bloco_inicio, bloco_fim, n_colunas = _SERIE_BLOCO.unpack_from(dados, posicao)
+        if magico != SERIE_MAGICO_BLOCO:
+            logger.warning(f"[Série] {caminho}: bloco inválido na posição {posicao}")
+            return
+        tamanhos = struct.unpack_from(f"<{n_colunas}I", dados, posicao + _SERIE_BLOCO.size)
+        inicios = [posicao + _SERIE_BLOCO.size + 4 * n_colunas]
+        for tamanho in tamanhos:
+            inicios.append(inicios[-1] + tamanho)
+        if inicios[-1] > len(dados):
+            return  # Último bloco truncado (crash durante a gravação)
+        posicao = inicios[-1]
+        if bloco_fim < inicio_ms or bloco_inicio > fim_ms:
+            estatisticas["blocos_pulados"] += 1
+            continue
+        estatisticas["blocos_lidos"] += 1
+
+        def coluna(nome):
+            i = indice[nome]
+            return dados[inicios[i]:inicios[i + 1]]
+
+        tempos = _decodificar_tempo(coluna("capturado_em"), amostras, bloco_inicio)
+        linhas = [i for i, t in enumerate(tempos) if inicio_ms <= t <= fim_ms]
+        if not linhas:
+            continue
+        estatisticas["amostras"] += len(linhas)
+        resultado = {"capturado_em": [tempos[i] / 1000 for i in linhas]}
+        palavras = None
+        for nome in campos:
+            if nome in bits_booleanos:
+                if palavras is None:
+                    palavras = _decodificar_booleanos(coluna("booleanos"), amostras)
+                bit = bits_booleanos[nome]
+                resultado[nome] = [bool(palavras[i] & (1 << (bit + 16))) if palavras[i] & (1 << bit) else None
+                                   for i in linhas]
+            elif nome in indice:
+                valores = _decodificar_xor(coluna(nome), amostras)
+                inteiro = nome in CAMPOS_INTEIROS
+                resultado[nome] = [None if valores[i] != valores[i] else int(valores[i]) if inteiro else valores[i]
+                                   for i in linhas]
+            else:
+                resultado[nome] = [None] * len(linhas)
+        yield resultado
+
+
+def iterar_serie(porta_vps: str, inicio: float, fim: float, campos: List[str] = None,
+                 diretorio: str = None, estatisticas: Counter = None):
+    """
+    Blocos gravados de um gerador no intervalo [inicio, fim] (epoch), cada um
+    como {"capturado_em": [...], campo: [...]}; campo ausente = None. O bloco
+    ainda aberto no processo que grava não aparece (até SERIE_BLOCO_S).
+    """
+    campos = list(campos or CAMPOS_NUMERICOS + CAMPOS_BOOLEANOS)
+    estatisticas = estatisticas if estatisticas is not None else Counter()
+    inicio_ms, fim_ms = int(inicio * 1000), int(fim * 1000)
+    for particao, caminho in _particoes(os.path.join(diretorio or SERIE_DIRETORIO, porta_vps)):
+        if particao > fim or particao + SERIE_PARTICAO_S <= inicio:
+            continue
+        yield from _ler_particao(caminho, inicio_ms, fim_ms, campos, estatisticas)
+
+
+def ler_serie(porta_vps: str, inicio: float, fim: float, campos: List[str] = None,
+              diretorio: str = None, estatisticas: Counter = None) -> Dict[str, list]:
+    """Intervalo inteiro em colunas (ver iterar_serie)"""
+    colunas: Dict[str, list] = {"capturado_em": [], **{nome: [] for nome in campos or CAMPOS_NUMERICOS + CAMPOS_BOOLEANOS}}
+    for bloco in iterar_serie(porta_vps, inicio, fim, campos, diretorio, estatisticas):
+        for nome, valores in bloco.items():
+            colunas[nome].extend(valores)
+    return colunas
+
+
+def aplicar_retencao_serie(diretorio: str = None, dias: int = None) -> int:
+    """Apaga as horas mais antigas que a retenção; devolve quantos arquivos saíram"""
+    diretorio = diretorio or SERIE_DIRETORIO
+    limite = time.time() - (dias if dias is not None else SERIE_RETENCAO_DIAS) * 86400
+    removidos = 0
+    try:
+        portas = os.listdir(diretorio)
+    except FileNotFoundError:
+        return 0
+    for porta_vps in portas:
+        for particao, caminho in _particoes(os.path.join(diretorio, porta_vps)):
+            if particao + SERIE_PARTICAO_S > limite:
+                break
+            os.remove(caminho)
+            removidos += 1
+    if removidos:
+        logger.info(f"[Série] Retenção de {dias if dias is not None else SERIE_RETENCAO_DIAS} dias: "
+                    f"{removidos} arquivo(s) removido(s)")
+    return removidos
+
+
+# =============================================================================
+# SINKS DE SAÍDA (v2.21.0)
+# =============================================================================
+#
+# Cada leitura é publicada uma vez no barramento (BarramentoLeituras) e
+# entregue a todos os sinks configurados em SINKS. Cada sink tem fila
+# (deque limitada), lote e thread próprios: um sink lento ou fora do ar
+# acumula na própria fila e não atrasa o polling nem os outros sinks.
+#
+#   http     edge function (ou sink Postgres, se configurado) via enviar_leitura
+#   arquivo  NDJSON local com rotação por tamanho (historiador)
+#   mqtt     broker MQTT 3.1.1 (SCADA local), cliente mínimo só com stdlib
+#   serie    série temporal local comprimida por gerador (v2.25.0)
+#   eventos  alertas e rollups para a edge function (sempre ativo fora do
+#            modo debug; não recebe leituras)
+#
+# Dentro de cada sink a fila é separada por gerador e o lote é montado em
+# rodízio. Leituras que falham voltam ao início da fila do próprio gerador,
+# que entra em espera (backoff dobrado a cada falha seguida, até
+# SINK_BACKOFF_MAX): os outros geradores continuam sendo enviados. Após
+# SINK_TENTATIVAS falhas seguidas as leituras do gerador são descartadas
+# (contador "descartadas" em GET /metricas → sinks). O sink http (envio
+# idempotente, v2.29.0) só tira da fila o que o backend confirmou: falhas
+# transitórias (rede, 408/429/502-504) repetem sem limite; a leitura recusada
+# (4xx) ou com ENVIO_TENTATIVAS_ERRO erros seguidos vai para o dead-letter
+# do gerador e a fila dele segue.
+
+# Sem resposta (None) ou sobrecarga/timeout do backend: repetir até passar
+STATUS_TRANSITORIOS = frozenset({None, 408, 425, 429, 502, 503, 504})
+
+
+def _recusada(status: Optional[int]) -> bool:
+    """4xx que não é transitório: reenviar a mesma leitura não muda a resposta"""
+    return status is not None and 400 <= status < 500 and status not in STATUS_TRANSITORIOS
+
+
+class EnvioParcial(Exception):
+    """
+    Parte do lote não foi confirmada; `pendentes` volta para a fila. Só as
+    leituras em `falhas` contam para `tentativas` (padrão: todas as
+    pendentes); `recusadas` saem da fila direto para descartar().
+    """
+
+    def __init__(self, pendentes: list, mensagem: str, falhas: list = None, recusadas: list = ()):
+        super().__init__(mensagem)
+        self.pendentes = pendentes
+        self.falhas = pendentes if falhas is None else falhas
+        self.recusadas = list(recusadas)
+
+
+class Sink:
+    """Base dos sinks: fila por gerador, lote, retentativas e thread próprios"""
+
+    nome = "sink"
+    lote_max = 1              # Leituras por chamada de gravar()
+    intervalo_lote = 0.0      # Espera para acumular um lote após a 1ª leitura
+    intervalo_ocioso = None   # Chama ocioso() quando a fila fica parada por esse tempo
+    tentativas = SINK_TENTATIVAS  # Falhas seguidas de um gerador antes de descartar suas leituras (0 = sem limite)
+    recebe_leituras = True    # False: o barramento não entrega leituras (ex: sink de eventos)
+
+    def __init__(self):
+        self._filas: Dict[str, deque] = {}  # porta_vps → leituras na ordem de chegada
+        self._falhas: Dict[str, int] = {}   # porta_vps → falhas seguidas (backoff)
+        self._erros: Dict[str, int] = {}    # porta_vps → falhas seguidas que contam para tentativas
+        self._pausa: Dict[str, float] = {}  # porta_vps → time.monotonic() da próxima tentativa
+        self._vez = 0                       # Rodízio entre geradores na montagem do lote
+        self._em_gravacao = 0
+        self._lote: list = []  # v2.28.0: lote em gravação, salvo junto com a fila
+        self._lock = threading.RLock()  # Filas: threads dos workers (entregar) × thread do sink
+        self._sinal = threading.Event()
+        self.contadores = Counter()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=f"Sink-{self.nome}")
+        self._thread.start()
+
+    def _fila_de(self, porta_vps: str) -> deque:
+        with self._lock:
+            fila = self._filas.get(porta_vps)
+            if fila is None:
+                fila = self._filas[porta_vps] = deque()
+            return fila
+
+    def _limitar(self):
+        """Acima de SINK_FILA_MAX descarta as mais antigas do gerador com a maior fila"""
+        with self._lock:
+            excesso = sum(len(fila) for fila in self._filas.values()) - SINK_FILA_MAX
+            while excesso > 0:
+                max(self._filas.values(), key=len).popleft()
+                self.contadores["descartadas"] += 1
+                excesso -= 1
+
+    def entregar(self, porta_vps: str, dados, alertas_avaliados: bool = False):
+        """Chamado pelo barramento (thread do worker): só enfileira"""
+        with self._lock:
+            self._fila_de(porta_vps).append((porta_vps, dados, alertas_avaliados))
+            self._limitar()
+        self._sinal.set()
+
+    def pendentes(self) -> int:
+        return sum(len(fila) for fila in list(self._filas.values())) + self._em_gravacao
+
+    def estado(self) -> Dict[str, Any]:
+        agora = time.monotonic()
+        em_espera = {porta: round(instante - agora, 1) for porta, instante in list(self._pausa.items())
+                     if instante > agora}
+        return {"pendentes": self.pendentes(), **self.contadores, **({"em_espera": em_espera} if em_espera else {})}
+
+    def gravar(self, lote: list):
+        """Envia o lote; levanta exceção em caso de falha"""
+        raise NotImplementedError
+
+    def ocioso(self):
+        pass
+
+    def fechar(self):
+        """Encerramento do processo: grava o que o sink guarda em memória"""
+        pass
+
+    def exportar_fila(self) -> list:
+        """v2.28.0: leituras ainda não gravadas (cursor de envio) para o próximo processo"""
+        with self._lock:
+            itens = list(self._lote)
+            for fila in self._filas.values():
+                itens.extend(fila)
+        return [[porta_vps, dados.para_estado(), alertas] for porta_vps, dados, alertas in itens
+                if isinstance(dados, Leitura)]
+
+    def restaurar_fila(self, itens: list):
+        with self._lock:
+            for porta_vps, dados, alertas in itens:
+                self._fila_de(porta_vps).append((porta_vps, Leitura.de_estado(dados), alertas))
+            self._limitar()
+        self._sinal.set()
+
+    def _proximo_lote(self, agora: float) -> list:
+        """Até lote_max leituras dos geradores fora de espera, uma de cada por vez (rodízio)"""
+        with self._lock:
+            portas = [porta for porta, fila in self._filas.items()
+                      if fila and self._pausa.get(porta, 0.0) <= agora]
+            if not portas:
+                return []
+            self._vez += 1
+            inicio = self._vez % len(portas)
+            portas = portas[inicio:] + portas[:inicio]
+            lote = []
+            while portas and len(lote) < self.lote_max:
+                for porta in list(portas):
+                    fila = self._filas[porta]
+                    if not fila:
+                        portas.remove(porta)
+                        continue
+                    lote.append(fila.popleft())
+                    if len(lote) >= self.lote_max:
+                        break
+            # Marca o lote em gravação antes de soltar a trava (exportar_fila o vê)
+            self._lote = lote
+            self._em_gravacao = len(lote)
+            return lote
+
+    def descartar(self, itens: list, erro: Exception):
+        """Leituras que saem da fila sem gravar (recusadas ou após `tentativas` falhas)"""
+        self.contadores["descartadas"] += len(itens)
+        logger.error(f"[Sink {self.nome}] {len(itens)} leitura(s) descartada(s): {erro}")
+
+    def _registrar_falha(self, itens: list, contadas: list, erro: Exception):
+        """
+        Devolve as leituras de cada gerador que falhou ao início da fila dele e
+        o coloca em espera (backoff próprio); os outros geradores seguem. As
+        leituras em `contadas` são descartadas após `tentativas` falhas seguidas.
+        """
+        por_porta: Dict[str, list] = {}
+        for item in itens:
+            por_porta.setdefault(item[0], []).append(item)
+        ids_contadas = {id(item) for item in contadas}
+
+        agora = time.monotonic()
+        resumo, descartes = [], []
+        with self._lock:
+            for porta, falhos in por_porta.items():
+                erros = self._erros.get(porta, 0)
+                if any(id(item) in ids_contadas for item in falhos):
+                    erros = self._erros[porta] = erros + 1
+                if self.tentativas and erros >= self.tentativas:
+                    self._erros.pop(porta, None)
+                    descartes.append(([item for item in falhos if id(item) in ids_contadas],
+                                      f"porta {porta} após {erros} falhas: {erro}"))
+                    falhos = [item for item in falhos if id(item) not in ids_contadas]
+                    if not falhos:
+                        self._falhas.pop(porta, None)
+                        self._pausa.pop(porta, None)
+                        continue
+                falhas = self._falhas[porta] = self._falhas.get(porta, 0) + 1
+                self._fila_de(porta).extendleft(reversed(falhos))
+                espera = min(2 ** (falhas - 1), SINK_BACKOFF_MAX)
+                self._pausa[porta] = agora + espera
+                resumo.append(f"{porta} ({falhas}x, nova tentativa em {espera}s)")
+            self._limitar()
+        for descartadas, motivo in descartes:  # descartar() pode gravar em disco: fora da trava
+            self.descartar(descartadas, motivo)
+        if resumo:
+            logger.warning(f"[Sink {self.nome}] Falha: {erro} - " + ", ".join(resumo))
+
+    def _drenar(self):
+        """Grava lotes enquanto houver leituras de geradores fora de espera"""
+        while True:
+            lote = self._proximo_lote(time.monotonic())
+            if not lote:
+                return
+            falhos, contadas, recusadas, erro = [], [], [], None
+            try:
+                self.gravar(lote)
+            except EnvioParcial as e:
+                falhos, contadas, recusadas, erro = e.pendentes, e.falhas, e.recusadas, e
+            except Exception as e:
+                falhos, contadas, erro = lote, lote, e
+            self.contadores["enviadas"] += len(lote) - len(falhos) - len(recusadas)
+            portas_falhas = {item[0] for item in falhos}
+            with self._lock:
+                for porta in {item[0] for item in lote} - portas_falhas:
+                    self._falhas.pop(porta, None)
+                    self._erros.pop(porta, None)
+                    self._pausa.pop(porta, None)
+            if recusadas:
+                self.descartar(recusadas, erro)
+            if falhos:
+                self.contadores["erros"] += 1
+                self._registrar_falha(falhos, contadas, erro)
+            with self._lock:
+                self._em_gravacao = 0
+                self._lote = []
+
+    def _loop(self):
+        while True:
+            pausas = [instante for porta, instante in list(self._pausa.items()) if self._filas.get(porta)]
+            if pausas:
+                # Geradores em espera: acorda na próxima tentativa (ou com leitura nova)
+                self._sinal.wait(max(min(pausas) - time.monotonic(), 0.0))
+            elif not self._sinal.wait(self.intervalo_ocioso):
+                try:
+                    self.ocioso()
+                except Exception as e:
+                    logger.warning(f"[Sink {self.nome}] {e}")
+                continue
+            if self.intervalo_lote and self._sinal.is_set():
+                time.sleep(self.intervalo_lote)
+            self._sinal.clear()
+            try:
+                self._drenar()
+            except Exception as e:
+                # Um lote com problema não pode parar a thread do sink
+                logger.error(f"[Sink {self.nome}] Erro ao drenar a fila: {e}")
+                with self._lock:
+                    self._em_gravacao = 0
+                    self._lote = []
+                time.sleep(1)
+
+
+def _linha_json(porta_vps: str, dados, alertas_avaliados: bool) -> str:
+    corpo = {"porta_vps": porta_vps, **dados}
+    if alertas_avaliados:
+        corpo["alertas_avaliados_na_vps"] = True
+    return json.dumps(corpo, ensure_ascii=False)
+
+
+class SinkHTTP(Sink):
+    """Caminho atual: edge function, ou o sink Postgres quando configurado"""
+
+    nome = "http"
+    lote_max = ENVIO_LOTE_MAX
+    intervalo_lote = ENVIO_INTERVALO_LOTE if ENVIO_LOTE_MAX > 1 else 0.0
+    tentativas = ENVIO_TENTATIVAS_ERRO  # Só erros não transitórios contam (ver _recusada)
+
+    def gravar(self, lote: list):
+        if envio_em_lote_ativo():
+            self._gravar_em_lote(lote)
+            return
+        pendentes, falhas, recusadas = self._gravar_individual(lote)
+        if pendentes or recusadas:
+            raise EnvioParcial(pendentes, f"{len(pendentes) + len(recusadas)} de {len(lote)} leituras sem confirmação",
+                               falhas, recusadas)
+
+    def _gravar_individual(self, lote: list) -> tuple:
+        """
+        Uma leitura por POST. Retorna (pendentes, falhas, recusadas): a 4xx vai
+        para recusadas e o gerador segue; outro erro deixa o resto do gerador
+        pendente (a leitura que falhou conta em falhas); sem resposta, todo o
+        resto do lote fica pendente.
+        """
+        pendentes, falhas, recusadas = [], [], []
+        parados = set()
+        for i, item in enumerate(lote):
+            porta_vps, dados, alertas_avaliados = item
+            if porta_vps in parados:
+                pendentes.append(item)
+                continue
+            numerar_leitura(porta_vps, dados)
+            status = gravar_leitura(porta_vps, dados, alertas_avaliados, self._seq_min(porta_vps, dados, lote[i:]))
+            if status == 200:
+                marcar_partida("primeiro_upload")
+            elif status is None:
+                pendentes.extend(lote[i:])
+                break
+            elif _recusada(status):
+                recusadas.append(item)
+            else:
+                parados.add(porta_vps)
+                pendentes.append(item)
+                if status not in STATUS_TRANSITORIOS:
+                    falhas.append(item)
+        return pendentes, falhas, recusadas
+
+    def _seq_min(self, porta_vps: str, dados, restantes: list) -> Optional[int]:
+        """Menor seq do fluxo da leitura ainda guardado no sink (lote em envio e fila do gerador)"""
+        if not isinstance(dados, Leitura) or dados.seq is None:
+            return None
+        seqs = [d.seq for p, d, _ in restantes
+                if p == porta_vps and isinstance(d, Leitura) and d.id_fluxo == dados.id_fluxo and d.seq is not None]
+        with self._lock:
+            fila = list(self._filas.get(porta_vps, ()))
+        for _, d, _ in fila:
+            if isinstance(d, Leitura) and d.id_fluxo == dados.id_fluxo and d.seq is not None:
+                seqs.append(d.seq)  # a fila de cada gerador está em ordem de seq
+                break
+        return min(seqs, default=dados.seq)
+
+    def _gravar_em_lote(self, lote: list):
+        """Um POST por gerador e fluxo; o que passa do ack volta para a fila"""
+        grupos: Dict[tuple, list] = {}
+        for item in lote:
+            numerar_leitura(item[0], item[1])
+            grupos.setdefault((item[0], item[1].id_fluxo), []).append(item)
+
+        pendentes, falhas, recusadas = [], [], []
+        for (porta_vps, id_fluxo), itens in grupos.items():
+            status, ack_seq = enviar_lote_leituras(porta_vps, id_fluxo, itens)
+            if ack_seq is not None:
+                marcar_partida("primeiro_upload")
+                pendentes.extend(item for item in itens if item[1].seq > ack_seq)
+            elif status in STATUS_TRANSITORIOS:
+                pendentes.extend(itens)
+            else:
+                # Lote recusado ou com erro: uma leitura por POST isola a que o backend não aceita
+                resultado = self._gravar_individual(itens)
+                for destino, parte in zip((pendentes, falhas, recusadas), resultado):
+                    destino.extend(parte)
+        if pendentes or recusadas:
+            raise EnvioParcial(pendentes, f"{len(pendentes) + len(recusadas)} de {len(lote)} leituras sem confirmação",
+                               falhas, recusadas)
+
+    def descartar(self, itens: list, erro: Exception):
+        """Dead-letter: um NDJSON por gerador, reenviado com --reenviar-dead-letter"""
+        try:
+            os.makedirs(DEAD_LETTER_DIRETORIO, exist_ok=True)
+            por_porta: Dict[str, list] = {}
+            for porta_vps, dados, alertas_avaliados in itens:
+                por_porta.setdefault(porta_vps, []).append(json.dumps({
+                    "descartado_em": iso_utc(time.time()),
+                    "erro": str(erro),
+                    "corpo": _corpo_leitura(porta_vps, dados, alertas_avaliados),
+                }, ensure_ascii=False) + "\n")
+            for porta_vps, linhas in por_porta.items():
+                with open(os.path.join(DEAD_LETTER_DIRETORIO, f"{porta_vps}.ndjson"), "a", encoding="utf-8") as arquivo:
+                    arquivo.writelines(linhas)
+                metricas.incrementar(porta_vps, "dead_letter", len(linhas))
+        except OSError as e:
+            logger.error(f"[Sink {self.nome}] Dead-letter indisponível ({e})")
+            super().descartar(itens, erro)
+            return
+        self.contadores["dead_letter"] += len(itens)
+        logger.error(f"[Sink {self.nome}] {len(itens)} leitura(s) no dead-letter: {erro}")
+
+    def estado(self) -> Dict[str, Any]:
+        return {**super().estado(), "id_fluxo": ID_FLUXO, "ack": dict(acks_envio)}
+
+
+class SinkEventos(Sink):
+    """
+    Alertas e rollups para a edge function, fora da thread de polling. Cada
+    item é {"alertas": [...]} ou {"rollups": [...]}; os itens do lote com o
+    mesmo gerador e tipo vão num POST. Mesma classificação de erros do sink http.
+    """
+
+    nome = "eventos"
+    lote_max = 50
+    tentativas = ENVIO_TENTATIVAS_ERRO
+    recebe_leituras = False
+
+    def gravar(self, lote: list):
+        grupos: Dict[tuple, list] = {}
+        for item in lote:
+            tipo = next(iter(item[1]))
+            grupos.setdefault((item[0], tipo), []).append(item)
+
+        pendentes, falhas, recusadas = [], [], []
+        for (porta_vps, tipo), itens in grupos.items():
+            status = postar_eventos(porta_vps, tipo, [evento for item in itens for evento in item[1][tipo]])
+            if status == 200:
+                continue
+            if _recusada(status):
+                recusadas.extend(itens)
+                continue
+            pendentes.extend(itens)
+            if status not in STATUS_TRANSITORIOS:
+                falhas.extend(itens)
+        if pendentes or recusadas:
+            raise EnvioParcial(pendentes, f"{len(pendentes) + len(recusadas)} de {len(lote)} envios sem confirmação",
+                               falhas, recusadas)
+
+    def exportar_fila(self) -> list:
+        with self._lock:
+            itens = list(self._lote)
+            for fila in self._filas.values():
+                itens.extend(fila)
+        return [[porta_vps, dados, False] for porta_vps, dados, _ in itens]
+
+    def restaurar_fila(self, itens: list):
+        with self._lock:
+            for porta_vps, dados, _ in itens:
+                self._fila_de(porta_vps).append((porta_vps, dados, False))
+            self._limitar()
+        self._sinal.set()
+
+
+sink_eventos: Optional[SinkEventos] = None
+
+
+class SinkArquivo(Sink):
+    """NDJSON local (uma leitura por linha) com rotação por tamanho"""
+
+    nome = "arquivo"
+    lote_max = 500
+    intervalo_lote = 1.0
+
+    def __init__(self, caminho: str = None):
+        self.caminho = caminho or SINK_ARQUIVO
+        diretorio = os.path.dirname(self.caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        self._tamanho = os.path.getsize(self.caminho) if os.path.exists(self.caminho) else 0
+        super().__init__()
+
+    def _rotacionar(self):
+        for i in range(SINK_ARQUIVO_BACKUPS - 1, 0, -1):
+            if os.path.exists(f"{self.caminho}.{i}"):
+                os.replace(f"{self.caminho}.{i}", f"{self.caminho}.{i + 1}")
+        os.replace(self.caminho, f"{self.caminho}.1")
+        self._tamanho = 0
+
+    def gravar(self, lote: list):
+        texto = "".join(_linha_json(*item) + "\n" for item in lote).encode()
+        if self._tamanho and self._tamanho + len(texto) > SINK_ARQUIVO_MAX_BYTES:
+            self._rotacionar()
+        with open(self.caminho, "ab") as arquivo:
+            arquivo.write(texto)
+        self._tamanho += len(texto)
+
+
+class ClienteMQTT:
+    """Cliente MQTT 3.1.1 mínimo: CONNECT, PUBLISH (QoS 0/1), PINGREQ"""
+
+    CONNECT, CONNACK, PUBLISH, PUBACK, PINGREQ, PINGRESP, DISCONNECT = 1, 2, 3, 4, 12, 13, 14
+
+    def __init__(self, host: str, porta: int, client_id: str, keepalive: int,
+                 usuario: str = None, senha: str = None, timeout: float = 5.0):
+        self.host = host
+        self.porta = porta
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.usuario = usuario
+        self.senha = senha
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self._proximo_id = 0
+
+    @staticmethod
+    def _texto(valor: str) -> bytes:
+        dados = valor.encode()
+        return struct.pack(">H", len(dados)) + dados
+
+    @staticmethod
+    def _pacote(tipo_flags: int, corpo: bytes) -> bytes:
+        tamanho = len(corpo)
+        cabecalho = bytearray([tipo_flags])
+        while True:
+            byte = tamanho % 128
+            tamanho //= 128
+            cabecalho.append(byte | 0x80 if tamanho else byte)
+            if not tamanho:
+                return bytes(cabecalho) + corpo
+
+    def _receber(self, tamanho: int) -> bytes:
+        dados = bytearray()
+        while len(dados) < tamanho:
+            chunk = self.sock.recv(tamanho - len(dados))
+            if not chunk:
+                raise ConnectionError("Broker fechou a conexão")
+            dados.extend(chunk)
+        return bytes(dados)
+
+    def ler_pacote(self) -> tuple:
+        """(tipo, flags, corpo) do próximo pacote do broker"""
+        primeiro = self._receber(1)[0]
+        tamanho, multiplicador = 0, 1
+        while True:
+            byte = self._receber(1)[0]
+            tamanho += (byte & 0x7F) * multiplicador
+            multiplicador *= 128
+            if not byte & 0x80:
+                break
+        return primeiro >> 4, primeiro & 0x0F, self._receber(tamanho)
+
+    def conectar(self):
+        self.fechar()
+        self.sock = socket.create_connection((self.host, self.porta), timeout=self.timeout)
+        flags = 0x02  # clean session
+        carga = self._texto(self.client_id)
+        if self.usuario:
+            flags |= 0x80
+            carga += self._texto(self.usuario)
+            if self.senha:
+                flags |= 0x40
+                carga += self._texto(self.senha)
+        corpo = self._texto("MQTT") + bytes([4, flags]) + struct.pack(">H", self.keepalive) + carga
+        self.sock.sendall(self._pacote(self.CONNECT << 4, corpo))
+        tipo, _, resposta = self.ler_pacote()
+        if tipo != self.CONNACK or len(resposta) < 2 or resposta[1] != 0:
+            codigo = resposta[1] if tipo == self.CONNACK and len(resposta) > 1 else None
+            self.fechar()
+            raise ConnectionError(f"CONNACK recusado (código {codigo})")
+
+    def publicar_lote(self, mensagens: list, qos: int = 0, reter: bool = False):
+        """Envia [(topico, payload)] de uma vez; com QoS 1 aguarda todos os PUBACK"""
+        if self.sock is None:
+            self.conectar()
+        pendentes = set()
+        pacotes = []
+        for topico, payload in mensagens:
+            corpo = self._texto(topico)
+            if qos:
+                self._proximo_id = self._proximo_id % 0xFFFF + 1
+                pendentes.add(self._proximo_id)
+                corpo += struct.pack(">H", self._proximo_id)
+            pacotes.append(self._pacote((self.PUBLISH << 4) | (qos << 1) | int(reter), corpo + payload))
+        try:
+            self.sock.sendall(b"".join(pacotes))
+            while pendentes:
+                tipo, _, corpo = self.ler_pacote()
+                if tipo == self.PUBACK:
+                    pendentes.discard(struct.unpack(">H", corpo[:2])[0])
+        except (OSError, ConnectionError):
+            self.fechar()
+            raise
+
+    def ping(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendall(bytes([self.PINGREQ << 4, 0]))
+            tipo, _, _ = self.ler_pacote()
+            if tipo != self.PINGRESP:
+                raise ConnectionError(f"Resposta inesperada ao PINGREQ: {tipo}")
+        except (OSError, ConnectionError):
+            self.fechar()
+            raise
+
+    def fechar(self):
+        if self.sock is not None:
             try:
-                self.socket_cliente.close()
-            except:
+                self.sock.sendall(bytes([self.DISCONNECT << 4, 0]))
+            except OSError:
                 pass
-        if self.socket_servidor:
             try:
-                self.socket_servidor.close()
-            except:
+                self.sock.close()
+            except OSError:
                 pass
+        self.sock = None
+
+
+class SinkMQTT(Sink):
+    """Publica cada leitura em <MQTT_PREFIXO>/<porta_vps>/leitura (JSON)"""
+
+    nome = "mqtt"
+    lote_max = 100
+
+    def __init__(self):
+        self.cliente = ClienteMQTT(
+            MQTT_HOST, MQTT_PORTA, f"gmg-leitor-{socket.gethostname()}-{os.getpid()}",
+            MQTT_KEEPALIVE, MQTT_USUARIO, MQTT_SENHA,
+        )
+        self.intervalo_ocioso = MQTT_KEEPALIVE / 2
+        super().__init__()
+
+    def gravar(self, lote: list):
+        self.cliente.publicar_lote(
+            [(f"{MQTT_PREFIXO}/{porta_vps}/leitura", _linha_json(porta_vps, dados, alertas).encode())
+             for porta_vps, dados, alertas in lote],
+            qos=MQTT_QOS, reter=MQTT_RETER,
+        )
+
+    def ocioso(self):
+        self.cliente.ping()
+
+
+class SinkSerie(Sink):
+    """Série temporal comprimida por gerador em SERIE_DIRETORIO (ver SerieTemporal)"""
+
+    nome = "serie"
+    lote_max = 1000
+    intervalo_lote = 1.0
+    intervalo_ocioso = 10.0   # Fecha blocos de geradores que pararam de mandar leituras
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or SERIE_DIRETORIO
+        self.series: Dict[str, SerieTemporal] = {}
+        self._lock = threading.Lock()
+        self._retencao_em = 0.0
+        super().__init__()
+
+    def gravar(self, lote: list):
+        # Amostra já codificada não pode voltar para a fila (seria duplicada):
+        # falha de disco perde o bloco e é contada, sem levantar exceção
+        with self._lock:
+            for porta_vps, dados, _ in lote:
+                serie = self.series.get(porta_vps)
+                if serie is None:
+                    serie = self.series[porta_vps] = SerieTemporal(porta_vps, self.diretorio)
+                instante = dados.capturado_em if dados.capturado_em is not None else time.time()
+                try:
+                    self._contar_bloco(serie.adicionar(instante, dados.valores, dados.booleanos))
+                except OSError as e:
+                    self._falha_disco(serie, e)
+            self._manutencao()
+
+    def _contar_bloco(self, gravados: int):
+        if gravados:
+            self.contadores["blocos"] += 1
+            self.contadores["bytes"] += gravados
+
+    def _falha_disco(self, serie: SerieTemporal, erro: OSError):
+        self.contadores["blocos_perdidos"] += 1
+        logger.error(f"[Sink serie] Porta {serie.porta_vps}: {erro}")
+
+    def _descarregar(self, serie: SerieTemporal):
+        try:
+            self._contar_bloco(serie.descarregar())
+        except OSError as e:
+            self._falha_disco(serie, e)
+
+    def _manutencao(self):
+        agora = time.monotonic()
+        for serie in self.series.values():
+            if serie.bloco is not None and agora - serie.bloco.aberto_em >= SERIE_BLOCO_S:
+                self._descarregar(serie)
+        if time.time() - self._retencao_em >= SERIE_PARTICAO_S:
+            self._retencao_em = time.time()
+            try:
+                aplicar_retencao_serie(self.diretorio)
+            except OSError as e:
+                logger.error(f"[Sink serie] Retenção: {e}")
+
+    def ocioso(self):
+        with self._lock:
+            self._manutencao()
+
+    def fechar(self):
+        with self._lock:
+            for serie in self.series.values():
+                self._descarregar(serie)
+
+    def estado(self) -> Dict[str, Any]:
+        return {**super().estado(), "geradores": len(self.series)}
+
+
+TIPOS_SINK = {"http": SinkHTTP, "arquivo": SinkArquivo, "mqtt": SinkMQTT, "serie": SinkSerie}
+
+
+def iniciar_sinks(nomes: List[str] = None) -> list:
+    """Cria os sinks de SINKS e os registra no barramento"""
+    sinks = []
+    for nome in nomes if nomes is not None else SINKS:
+        if nome == "http" and not ENVIAR_LEITURAS_BRUTAS:
+            continue
+        tipo = TIPOS_SINK.get(nome)
+        if tipo is None:
+            logger.error(f"Sink desconhecido em GMG_SINKS: {nome!r} (opções: {', '.join(TIPOS_SINK)})")
+            continue
+        if nome == "mqtt" and not MQTT_HOST:
+            logger.error("Sink mqtt requer GMG_MQTT_HOST")
+            continue
+        sink = tipo()
+        barramento.registrar_sink(sink)
+        sinks.append(sink)
+        logger.info(f"Sink '{nome}' ativo")
+    return sinks
 
 
 # =============================================================================
-# FUNÇÃO DE ENVIO PARA BACKEND
+# SNAPSHOT EM MEMÓRIA COMPARTILHADA (v2.22.0)
 # =============================================================================
+#
+# A última leitura de cada gerador fica em um arquivo de tamanho fixo mapeado
+# em memória (SNAPSHOT_ARQUIVO, /dev/shm por padrão). Outros processos da VPS
+# (IHM local, relés de alarme, scripts) abrem o arquivo com mmap e leem sem
+# lock e sem chamada HTTP. Layout (little-endian):
+#
+#   Cabeçalho (48 bytes, offset 0)
+#     0  char[8]  magic "GMGSNAP1" (zerado enquanto o escritor reinicializa)
+#     8  u32      versão do layout (1)
+#    12  u32      offset da área de slots
+#    16  u32      número de slots
+#    20  u32      tamanho de cada slot (bytes, múltiplo de 64)
+#    24  u32      N = campos numéricos
+#    28  u32      B = campos booleanos
+#    32  u32      PID do escritor
+#    36  u32      geração (+1 a cada início do leitor Modbus)
+#    40  f64      início do escritor (epoch)
+#   Nomes dos campos (offset 48): N + B entradas de 32 bytes ASCII com zeros
+#     à direita; primeiro os N numéricos, depois os B booleanos
+#   Slot i (offset da área + i * tamanho do slot)
+#     0  u64      seq: 0 = vazio, ímpar = escrita em andamento
+#     8  u32      porta_vps
+#    12  u32      flags (bit 0 leitura parcial, bit 1 alertas avaliados na VPS)
+#    16  f64      capturado_em (epoch)
+#    24  f64      publicado_em (epoch da escrita no snapshot)
+#    32  u32      booleanos: bit i = campo i presente, bit i+16 = valor
+#    36  u32      reservado
+#    40  f64[N]   valores numéricos (NaN = ausente)
+#
+# Seqlock: o escritor (worker do gerador, um por slot) incrementa seq para
+# ímpar, grava o slot e incrementa para par. O leitor lê seq, copia o slot e
+# relê seq; se mudou ou era ímpar, tenta de novo. Não há barreira de memória
+# explícita: conta com a ordem de escrita do x86-64 (TSO) da VPS.
+
+SNAPSHOT_MAGIC = b"GMGSNAP1"
+SNAPSHOT_VERSAO_LAYOUT = 1
+SNAPSHOT_CABECALHO = struct.Struct("<8sIIIIIIIId")
+SNAPSHOT_TAMANHO_NOME = 32
+SNAPSHOT_SLOT = struct.Struct("<QIIddI4x")
+SNAPSHOT_SEQ = struct.Struct("<Q")
+SNAPSHOT_FLAG_PARCIAL = 0x01
+SNAPSHOT_FLAG_ALERTAS = 0x02
+
+
+def _alinhar(valor: int, bloco: int = 64) -> int:
+    return (valor + bloco - 1) // bloco * bloco
+
+
+class SnapshotCompartilhado:
+    """Escritor do snapshot; registrado no barramento como um sink síncrono"""
+
+    nome = "memoria"
+
+    def __init__(self, caminho: str, max_geradores: int = SNAPSHOT_MAX_GERADORES):
+        self.caminho = caminho
+        self.n_slots = max_geradores
+        nomes = CAMPOS_NUMERICOS + CAMPOS_BOOLEANOS
+        self._corpo = struct.Struct(f"<IIddI4x{len(CAMPOS_NUMERICOS)}d")
+        self.tamanho_slot = _alinhar(SNAPSHOT_SLOT.size + 8 * len(CAMPOS_NUMERICOS))
+        self.inicio_slots = _alinhar(SNAPSHOT_CABECALHO.size + SNAPSHOT_TAMANHO_NOME * len(nomes))
+        tamanho = self.inicio_slots + self.n_slots * self.tamanho_slot
+
+        diretorio = os.path.dirname(caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        # Reaproveita o arquivo (mesmo inode): leitores abertos seguem válidos
+        fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != tamanho:
+                os.ftruncate(fd, tamanho)
+            self._mm = mmap.mmap(fd, tamanho)
+        finally:
+            os.close(fd)
+
+        geracao = 0
+        if self._mm[:8] == SNAPSHOT_MAGIC:
+            geracao = SNAPSHOT_CABECALHO.unpack_from(self._mm, 0)[8] + 1
+        self._mm[:8] = bytes(8)
+        self._mm[SNAPSHOT_CABECALHO.size:] = bytes(tamanho - SNAPSHOT_CABECALHO.size)
+        for i, nome in enumerate(nomes):
+            inicio = SNAPSHOT_CABECALHO.size + i * SNAPSHOT_TAMANHO_NOME
+            self._mm[inicio:inicio + len(nome)] = nome.encode()
+        SNAPSHOT_CABECALHO.pack_into(
+            self._mm, 0, bytes(8), SNAPSHOT_VERSAO_LAYOUT, self.inicio_slots, self.n_slots,
+            self.tamanho_slot, len(CAMPOS_NUMERICOS), len(CAMPOS_BOOLEANOS), os.getpid(),
+            geracao, time.time(),
+        )
+        self._mm[:8] = SNAPSHOT_MAGIC
+
+        self._lock = threading.Lock()
+        self._slots: Dict[str, int] = {}
+        self._seq: List[int] = [0] * self.n_slots
+        self.escritas = 0
+
+    def _alocar(self, porta_vps: str) -> Optional[int]:
+        with self._lock:
+            if porta_vps in self._slots:
+                return self._slots[porta_vps]
+            if len(self._slots) >= self.n_slots:
+                logger.warning(f"[Snapshot] Sem slot livre para a porta {porta_vps} (SNAPSHOT_MAX_GERADORES)")
+                return None
+            self._slots[porta_vps] = i = len(self._slots)
+            return i
+
+    def reservar(self, portas: List[str]):
+        """Fixa a ordem dos slots (geradores configurados primeiro)"""
+        for porta_vps in portas:
+            self._alocar(porta_vps)
+
+    def entregar(self, porta_vps: str, dados, alertas_avaliados: bool = False):
+        """Chamado pelo barramento na thread do worker: grava direto no slot"""
+        if not isinstance(dados, Leitura):
+            return
+        i = self._slots.get(porta_vps)
+        if i is None:
+            i = self._alocar(porta_vps)
+            if i is None:
+                return
+        flags = (SNAPSHOT_FLAG_PARCIAL if dados.parcial else 0) | (SNAPSHOT_FLAG_ALERTAS if alertas_avaliados else 0)
+        base = self.inicio_slots + i * self.tamanho_slot
+        seq = self._seq[i]
+        SNAPSHOT_SEQ.pack_into(self._mm, base, seq + 1)  # ímpar: escrita em andamento
+        self._corpo.pack_into(
+            self._mm, base + SNAPSHOT_SEQ.size, int(porta_vps), flags,
+            dados.capturado_em or 0.0, time.time(), dados.booleanos, *dados.valores,
+        )
+        SNAPSHOT_SEQ.pack_into(self._mm, base, seq + 2)
+        self._seq[i] = seq + 2
+        self.escritas += 1
+
+    def pendentes(self) -> int:
+        return 0
+
+    def fechar(self):
+        """Nada em memória: cada leitura já está no arquivo"""
+        pass
+
+    def estado(self) -> Dict[str, Any]:
+        return {"arquivo": self.caminho, "slots_usados": len(self._slots), "escritas": self.escritas}
 
-def enviar_para_backend(porta_vps: str, dados: Dict[str, Any]) -> bool:
+
+class LeitorSnapshot:
     """
-    Envia os dados lidos para a edge function via HTTP POST
+    Leitura do snapshot por outro processo: sem lock, direto do mmap.
+    Ex: LeitorSnapshot("/dev/shm/gmg-leituras").ler("15002")
     """
-    payload = {
-        "porta_vps": porta_vps,
-        **dados
-    }
-    
-    try:
-        logger.info(f"Enviando dados do gerador porta {porta_vps}")
-        
-        response = requests.post(
-            EDGE_FUNCTION_URL,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            logger.info(f"✓ Dados enviados! Reading ID: {result.get('reading_id')}")
-            return True
+
+    TENTATIVAS = 1000  # Releituras quando o escritor está no meio do slot
+    GIROS = 100        # Releituras imediatas antes de começar a ceder a CPU
+
+    def __init__(self, caminho: str = None):
+        with open(caminho or SNAPSHOT_ARQUIVO, "rb") as arquivo:
+            self._mm = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, versao, self.inicio_slots, self.n_slots, self.tamanho_slot,
+         n_numericos, n_booleanos, self.pid, self.geracao, self.iniciado_em) = SNAPSHOT_CABECALHO.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC or versao != SNAPSHOT_VERSAO_LAYOUT:
+            raise ValueError(f"Snapshot inválido ou em reinicialização (magic={magic!r}, versão={versao})")
+        nomes = [
+            bytes(self._mm[inicio:inicio + SNAPSHOT_TAMANHO_NOME]).rstrip(b"\0").decode()
+            for inicio in range(SNAPSHOT_CABECALHO.size,
+                                SNAPSHOT_CABECALHO.size + SNAPSHOT_TAMANHO_NOME * (n_numericos + n_booleanos),
+                                SNAPSHOT_TAMANHO_NOME)
+        ]
+        self.campos_numericos = nomes[:n_numericos]
+        self.campos_booleanos = nomes[n_numericos:]
+        self._valores = struct.Struct(f"<{n_numericos}d")
+        self._indice: Dict[str, int] = {}
+
+    def fechar(self):
+        self._mm.close()
+
+    def ler_slot(self, i: int) -> Optional[Dict[str, Any]]:
+        """Cópia consistente do slot i, ou None se vazio"""
+        mm = self._mm
+        base = self.inicio_slots + i * self.tamanho_slot
+        for tentativa in range(self.TENTATIVAS):
+            if tentativa >= self.GIROS:
+                time.sleep(0.00005)  # escritor preemptado no meio do slot
+            seq = SNAPSHOT_SEQ.unpack_from(mm, base)[0]
+            if seq & 1:
+                continue
+            _, porta, flags, capturado_em, publicado_em, booleanos = SNAPSHOT_SLOT.unpack_from(mm, base)
+            valores = self._valores.unpack_from(mm, base + SNAPSHOT_SLOT.size)
+            if SNAPSHOT_SEQ.unpack_from(mm, base)[0] == seq:
+                break
         else:
-            logger.error(f"✗ Erro ao enviar: {response.status_code} - {response.text}")
-            return False
-            
-    except requests.RequestException as e:
-        logger.error(f"✗ Erro de conexão: {e}")
-        return False
+            return None  # escritor parado no meio de uma escrita
+        if seq == 0:
+            return None
+
+        leitura: Dict[str, Any] = {
+            "porta_vps": str(porta),
+            "capturado_em": capturado_em,
+            "publicado_em": publicado_em,
+            "leitura_parcial": bool(flags & SNAPSHOT_FLAG_PARCIAL),
+            "seq": seq // 2,
+        }
+        for nome, valor in zip(self.campos_numericos, valores):
+            if valor == valor:
+                leitura[nome] = valor
+        for j, nome in enumerate(self.campos_booleanos):
+            if booleanos & (1 << j):
+                leitura[nome] = bool(booleanos & (1 << (j + 16)))
+        return leitura
+
+    def ler(self, porta_vps: str) -> Optional[Dict[str, Any]]:
+        """Última leitura da porta, ou None se o gerador ainda não publicou"""
+        i = self._indice.get(porta_vps)
+        if i is not None:
+            leitura = self.ler_slot(i)
+            if leitura is not None and leitura["porta_vps"] == porta_vps:
+                return leitura
+        for i in range(self.n_slots):
+            leitura = self.ler_slot(i)
+            if leitura is None:
+                continue
+            self._indice[leitura["porta_vps"]] = i
+            if leitura["porta_vps"] == porta_vps:
+                return leitura
+        return None
+
+    def ler_todos(self) -> Dict[str, Dict[str, Any]]:
+        todos = {}
+        for i in range(self.n_slots):
+            leitura = self.ler_slot(i)
+            if leitura is not None:
+                todos[leitura["porta_vps"]] = leitura
+        return todos
+
+
+snapshot: Optional[SnapshotCompartilhado] = None
+
+
+def iniciar_snapshot(portas: List[str]) -> Optional[SnapshotCompartilhado]:
+    """Cria o snapshot em SNAPSHOT_ARQUIVO (vazio = desativado) e o registra no barramento"""
+    if not SNAPSHOT_ARQUIVO:
+        return None
+    try:
+        escritor = SnapshotCompartilhado(SNAPSHOT_ARQUIVO)
+    except (OSError, ValueError) as e:
+        logger.error(f"Snapshot em memória desativado ({SNAPSHOT_ARQUIVO}): {e}")
+        return None
+    escritor.reservar(portas)
+    barramento.registrar_sink(escritor)
+    logger.info(f"Snapshot em memória: {SNAPSHOT_ARQUIVO} ({escritor.n_slots} slots de {escritor.tamanho_slot} bytes)")
+    return escritor
 
 
 # =============================================================================
 # WORKER THREAD PARA CADA GERADOR
 # =============================================================================
 
+# Conexões por porta, usadas pela Health API para enfileirar comandos (v2.13.0)
+conexoes: Dict[str, ConexaoHF] = {}
+# Filtros por porta, expostos em GET /quarentena (v2.16.0)
+filtros: Dict[str, FiltroPlausibilidade] = {}
+# Avaliadores e agregadores por porta, salvos com o estado do processo (v2.28.0)
+avaliadores: Dict[str, "AvaliadorAlertas"] = {}
+agregadores: Dict[str, "AgregadorRollup"] = {}
+
+
+class EstadoWorker:
+    """Andamento de um worker, observado pelo watchdog e pelo /health (v2.18.0)"""
+
+    __slots__ = (
+        "porta_vps",
+        "config",
+        "thread",
+        "iniciado_em",
+        "inicio_ciclo",
+        "ultimo_sucesso",
+        "abortado",
+        "encerrado",
+        "erros_consecutivos",
+        "ultimo_erro",
+        "reinicios",
+    )
+
+    def __init__(self, porta_vps: str, config: Dict[str, Any], reinicios: int = 0):
+        self.porta_vps = porta_vps
+        self.config = config
+        self.thread: Optional[threading.Thread] = None
+        self.iniciado_em = time.monotonic()
+        self.inicio_ciclo = 0.0  # time.monotonic() do ciclo em andamento, 0 fora de ciclo
+        self.ultimo_sucesso = 0.0
+        self.abortado = False
+        self.encerrado = False
+        self.erros_consecutivos = 0
+        self.ultimo_erro: Optional[str] = None
+        self.reinicios = reinicios  # Reinícios seguidos sem nenhuma leitura ok
+
+    def espera_reinicio(self) -> float:
+        """Tempo mínimo de vida antes de o watchdog recriar a thread (dobra a cada reinício seguido)"""
+        return min(WATCHDOG_INTERVALO * 2 ** self.reinicios, WORKER_BACKOFF_MAX)
+
+    def saude(self, agora: float) -> Dict[str, Any]:
+        """Estado do gerador para o /health, a partir da idade do último sucesso"""
+        conexao = conexoes.get(self.porta_vps)
+        idade = agora - (self.ultimo_sucesso or self.iniciado_em)
+        em_ciclo = agora - self.inicio_ciclo if self.inicio_ciclo else 0.0
+
+        if self.thread is None or not self.thread.is_alive():
+            estado = "encerrado" if self.encerrado else "parado"
+        elif em_ciclo > PRAZO_CICLO:
+            estado = "travado"
+        elif idade <= IDADE_MAX_SUCESSO:
+            estado = "ok"
+        elif conexao is None or conexao.link_morto:
+            estado = "desconectado"
+        else:
+            estado = "sem_dados"
+
+        return {
+            "estado": estado,
+            "saudavel": estado in ("ok", "encerrado"),
+            "idade_ultimo_sucesso_s": round(agora - self.ultimo_sucesso, 1) if self.ultimo_sucesso else None,
+            "ciclo_em_andamento_s": round(em_ciclo, 1) if self.inicio_ciclo else None,
+            "conectado": bool(conexao and conexao.cliente_conectado),
+            "ultimo_erro": self.ultimo_erro or (conexao.ultimo_erro if conexao else None),
+            "erros_consecutivos": self.erros_consecutivos,
+        }
+
+
+# Estado dos workers por porta (v2.18.0)
+estados_worker: Dict[str, EstadoWorker] = {}
+
+
+def iniciar_worker(porta_vps: str, config: Dict[str, Any], reinicios: int = 0) -> threading.Thread:
+    """Cria (ou recria) a thread do worker de um gerador"""
+    estado = EstadoWorker(porta_vps, config, reinicios)
+    estado.thread = threading.Thread(
+        target=worker_gerador,
+        args=(porta_vps, config),
+        daemon=True,
+        name=f"Worker-{porta_vps}"
+    )
+    estados_worker[porta_vps] = estado
+    estado.thread.start()
+    return estado.thread
+
+
+def watchdog():
+    """
+    Verifica os workers a cada WATCHDOG_INTERVALO (v2.18.0):
+    - ciclo passou de PRAZO_CICLO: aborta o socket do link (o recv bloqueado
+      retorna com erro e o worker volta a aguardar o HF2211)
+    - thread morreu: libera a porta e recria o worker; se morre de novo sem
+      nenhuma leitura ok (ex: porta em uso), a espera dobra até WORKER_BACKOFF_MAX
+    """
+    log = logging.getLogger("Watchdog")
+    while True:
+        time.sleep(WATCHDOG_INTERVALO)
+        agora = time.monotonic()
+        for porta_vps, estado in list(estados_worker.items()):
+            try:
+                conexao = conexoes.get(porta_vps)
+
+                if not estado.thread.is_alive():
+                    if estado.encerrado or agora - estado.iniciado_em < estado.espera_reinicio():
+                        continue
+                    reinicios = 0 if estado.ultimo_sucesso else estado.reinicios + 1
+                    if reinicios:
+                        log.error(f"Worker {porta_vps} parou sem nenhuma leitura ok, reiniciando ({reinicios}º reinício seguido)")
+                    else:
+                        log.error(f"Worker {porta_vps} parou inesperadamente, reiniciando")
+                    metricas.incrementar(porta_vps, "workers_reiniciados")
+                    if conexao:
+                        conexao.fechar()
+                    iniciar_worker(porta_vps, estado.config, reinicios)
+                    continue
+
+                if estado.inicio_ciclo and not estado.abortado and agora - estado.inicio_ciclo > PRAZO_CICLO:
+                    log.error(
+                        f"Worker {porta_vps} travado há {agora - estado.inicio_ciclo:.0f}s "
+                        f"(prazo {PRAZO_CICLO}s), abortando o link"
+                    )
+                    metricas.incrementar(porta_vps, "ciclos_abortados")
+                    estado.abortado = True
+                    if conexao:
+                        conexao.abortar()
+            except Exception as e:
+                log.error(f"Erro no watchdog ({porta_vps}): {e}")
+
+
+def saude_geradores() -> Dict[str, Dict[str, Any]]:
+    agora = time.monotonic()
+    return {porta: estado.saude(agora) for porta, estado in list(estados_worker.items())}
+
+
 def worker_gerador(porta_vps: str, config: Dict[str, Any]):
     """Thread que gerencia a conexão e leitura de um gerador"""
     log = logging.getLogger(f"Worker-{porta_vps}")
     log.info(f"Iniciando worker para {config['nome']}")
     
     conexao = ConexaoHF(porta_vps, config)
+    conexoes[porta_vps] = conexao
+    if DESCOBERTA_ENDERECO and not MODO_SCAN:
+        # v2.27.0: endereço descoberto numa conexão anterior, sem sondar de novo
+        descoberto = enderecos_escravo.endereco(porta_vps, config["endereco_modbus"])
+        if descoberto is not None and descoberto != conexao.endereco_modbus:
+            log.info(f"Usando escravo {descoberto} descoberto antes (configurado: {config['endereco_modbus']})")
+            conexao.endereco_modbus = descoberto
+    leu_desde_conexao = False
+    avaliador = AvaliadorAlertas(porta_vps)
+    agregador = AgregadorRollup(porta_vps)
+    filtro = FiltroPlausibilidade(porta_vps)
+    filtros[porta_vps] = filtro
+    avaliadores[porta_vps] = avaliador
+    agregadores[porta_vps] = agregador
+    restaurar_worker(porta_vps, filtro, avaliador, agregador)
+    ciclo_imediato = False
+    estado = estados_worker.get(porta_vps)
+    if estado is None:  # chamado fora de iniciar_worker
+        estado = estados_worker[porta_vps] = EstadoWorker(porta_vps, config)
+        estado.thread = threading.current_thread()
     
     if not conexao.iniciar_servidor():
         log.error("Falha ao iniciar servidor, encerrando worker")
+        estado.ultimo_erro = conexao.ultimo_erro
         return
+    marcar_partida("servidor")
+    
+    agendador.registrar(porta_vps, conexao.fila)
     
     while True:
         try:
             # Aguarda conexão do HF2211
-            if not conexao.cliente_conectado:
+            if conexao.link_morto:
+                conexao.desconectar()
                 log.info("Aguardando conexão do HF2211...")
                 if not conexao.aceitar_conexao():
                     continue
+                leu_desde_conexao = False
+                ciclo_imediato = True
             
             # Modo SCAN: apenas varre e sai
             if MODO_SCAN:
                 conexao.scan_registradores()
                 log.info("Scan completo. Encerrando...")
+                estado.encerrado = True
                 break
             
+            # Aguarda o turno do agendador atendendo comandos (v2.17.0); o 1º
+            # ciclo de cada conexão é feito na hora (v2.28.0)
+            turno = None if ciclo_imediato else conexao.atender_fila(time.monotonic() + 2 * INTERVALO_LEITURA)
+            if ciclo_imediato:
+                ciclo_imediato = False
+                atraso = 0.0
+            elif turno is None:
+                if conexao.link_morto:
+                    continue
+                # Agendador parado: faz o polling mesmo assim, fora de fase
+                log.warning("Nenhum turno do agendador, polling fora de fase")
+                metricas.incrementar(porta_vps, "turnos_ausentes")
+                atraso = 0.0
+            else:
+                atraso = time.monotonic() - turno.prazo
+                if atraso > TOLERANCIA_ATRASO_CICLO:
+                    metricas.incrementar(porta_vps, "ciclos_atrasados")
+            
+            # Ciclo sob prazo: o watchdog aborta o link após PRAZO_CICLO (v2.18.0)
+            estado.inicio_ciclo = time.monotonic()
+            estado.abortado = False
+            
             # Faz polling dos registradores
+            iniciar_trace(porta_vps)
+            inicio_ciclo_ns = time.monotonic_ns()
             dados = conexao.ler_todos_registradores()
             
-            if dados:
-                log.info(f"Dados lidos: {len(dados)} parâmetros")
+            # Filtro de plausibilidade: valores suspeitos não chegam a alertas nem ao banco
+            quarentena = False
+            if dados and FILTRO_PLAUSIBILIDADE:
+                with span("filtro"):
+                    quarentena = not filtro.filtrar(dados)
+            
+            if quarentena:
+                # Link vivo, mas frame implausível: descarta sem reconectar
+                log.warning("Leitura inteira em quarentena, não enviada")
+            elif dados:
+                log.info(f"Dados lidos: {len(dados)} parâmetros" + (" (PARCIAL)" if dados.parcial else ""))
+                metricas.incrementar(porta_vps, "leituras_ok")
+                estado.ultimo_sucesso = time.monotonic()
+                leu_desde_conexao = True
+                marcar_partida("leitura")
+                numerar_leitura(porta_vps, dados)
+                
+                # Alertas avaliados a cada polling, antes do envio da leitura
+                with span("alertas"):
+                    alertas_avaliados = AVALIAR_ALERTAS_NA_VPS and processar_alertas(avaliador, dados)
                 
+                # v2.21.0: publicação única para o stream e os sinks (HTTP, arquivo,
+                # MQTT); o envio roda nas threads dos sinks, fora do ciclo de polling
+                barramento.publicar(porta_vps, "leitura", dados, alertas_avaliados)
                 if MODO_DEBUG:
                     log.info("*** MODO DEBUG: NÃO enviando para banco ***")
-                else:
-                    enviar_para_backend(porta_vps, dados)
             else:
-                log.warning("Nenhum dado lido, conexão pode ter sido perdida")
-                conexao.cliente_conectado = False
+                metricas.incrementar(porta_vps, "ciclos_sem_dados")
+                # v2.12.0: só reconecta quando o link está de fato morto;
+                # CRC/framing/exceção Modbus mantêm a conexão para o próximo ciclo
+                descoberto = None
+                if (DESCOBERTA_ENDERECO and not leu_desde_conexao and conexao.cliente_conectado
+                        and conexao.ultimo_erro == "timeout"):
+                    # v2.27.0: fora do prazo do ciclo (cada sonda tem timeout próprio)
+                    estado.inicio_ciclo = 0.0
+                    descoberto = descobrir_endereco(conexao, config["endereco_modbus"])
+                if descoberto is not None:
+                    log.info(f"Próximo ciclo lê o escravo {descoberto}")
+                elif conexao.link_morto:
+                    log.warning(f"Link morto [{conexao.ultimo_erro}], aguardando nova conexão do HF2211")
+                    conexao.desconectar()
+                else:
+                    log.warning(f"Nenhum dado lido [{conexao.ultimo_erro}], mantendo conexão")
             
-            # Intervalo entre leituras
-            time.sleep(INTERVALO_LEITURA)
+            if not quarentena:
+                processar_rollups(agregador, dados)
+            
+            registrar_span("ciclo", inicio_ciclo_ns, time.monotonic_ns(),
+                           capturado_em=dados.get("capturado_em"), ok=bool(dados) and not quarentena,
+                           atraso_ms=round(atraso * 1000, 1))
+            finalizar_trace()
+            
+            estado.inicio_ciclo = 0.0
+            estado.erros_consecutivos = 0
+            estado.ultimo_erro = None
             
         except KeyboardInterrupt:
+            estado.encerrado = True
             break
         except Exception as e:
-            log.error(f"Erro no worker: {e}")
-            conexao.cliente_conectado = False
-            time.sleep(5)
+            # v2.18.0: erro inesperado fica visível (traceback, métrica, /health)
+            # e a espera cresce com a repetição, em vez de 5 s silenciosos
+            estado.inicio_ciclo = 0.0
+            estado.erros_consecutivos += 1
+            estado.ultimo_erro = f"{type(e).__name__}: {e}"
+            espera = min(2 ** (estado.erros_consecutivos - 1), WORKER_BACKOFF_MAX)
+            metricas.incrementar(porta_vps, "erros_worker")
+            log.exception(f"Erro no worker ({estado.erros_consecutivos}x seguidas), nova tentativa em {espera}s")
+            conexao.desconectar()
+            time.sleep(espera)
     
+    agendador.remover(porta_vps)
     conexao.fechar()
     log.info("Worker encerrado")
 
 
+# =============================================================================
+# ESTADO PERSISTIDO ENTRE REINÍCIOS (v2.28.0)
+# =============================================================================
+#
+# Reiniciar o serviço (deploy, systemctl restart) perdia tudo o que estava em
+# memória: leituras ainda não enviadas nas filas dos sinks, janelas de rollup
+# abertas, referências do filtro (a 1ª leitura voltava sem deltas), alertas
+# ativos (realertados logo após a partida), parâmetros de alerta (a 1ª
+# leitura esperava o backend) e as fases do agendador.
+#
+# O estado vai para ESTADO_ARQUIVO (JSON gzip, gravação atômica) a cada
+# ESTADO_INTERVALO e no SIGTERM, e é lido antes dos workers subirem:
+#   - filas dos sinks e rollups pendentes: sempre restaurados
+#   - filtros, alertas, parâmetros, fases e o último cliente de cada porta:
+#     só se o arquivo tem menos de ESTADO_IDADE_MAX (e o mesmo layout de
+#     CAMPOS_NUMERICOS, para os arrays do filtro)
+#
+# A conexão TCP com o HF2211 não sobrevive ao processo: o socket de escuta
+# sobe na partida e o 1º ciclo de cada conexão é feito na hora, sem esperar
+# o slot do agendador. Endereço de escravo e tempo de resposta já ficam em
+# DESCOBERTA_ARQUIVO (v2.27.0). Um lote que estava em gravação é salvo junto
+# com a fila e pode ser reenviado.
+#
+# Partida medida em ms desde o início do processo (servidor, conexao,
+# leitura, primeiro_upload), exposta em GET /metricas ("partida").
+
+ESTADO_LAYOUT = 1
+
+# Último HF2211 (ip:porta) conectado em cada porta, também o de antes do reinício
+clientes_hf: Dict[str, str] = {}
+_estado_workers: Dict[str, Dict[str, Any]] = {}  # porta → estado restaurado, consumido pelo worker
+_partida: Dict[str, Any] = {"estado_restaurado": False}
+_partida_lock = threading.Lock()
+
+
+def marcar_partida(evento: str):
+    """Registra o 1º acontecimento de `evento` em ms desde o início do processo"""
+    if evento in _partida:
+        return
+    with _partida_lock:
+        if evento in _partida:
+            return
+        decorrido = round((time.monotonic() - INICIO_PROCESSO) * 1000, 1)
+        _partida[evento] = decorrido
+    if evento == "primeiro_upload":
+        marca = "✓" if decorrido <= PARTIDA_ORCAMENTO_MS else "✗"
+        logger.info(f"[Partida] Primeiro upload {decorrido:.0f} ms após o início {marca} (meta {PARTIDA_ORCAMENTO_MS} ms)")
+
+
+def estado_partida() -> Dict[str, Any]:
+    return dict(_partida)
+
+
+def coletar_estado() -> Dict[str, Any]:
+    """Estado do processo em estruturas JSON"""
+    workers = {}
+    for porta_vps in list(conexoes):
+        workers[porta_vps] = {
+            "filtro": filtros[porta_vps].exportar_estado() if porta_vps in filtros else None,
+            "alertas": avaliadores[porta_vps].exportar_estado() if porta_vps in avaliadores else None,
+            "rollup": agregadores[porta_vps].exportar_estado() if porta_vps in agregadores else None,
+            "cliente": clientes_hf.get(porta_vps),
+        }
+    return {
+        "versao": VERSAO,
+        "layout": ESTADO_LAYOUT,
+        "campos": list(CAMPOS_NUMERICOS),
+        "salvo_em": time.time(),
+        "workers": workers,
+        "sinks": {
+            sink.nome: sink.exportar_fila()
+            for sink in barramento.sinks if hasattr(sink, "exportar_fila")
+        },
+        "parametros_alerta": cache_parametros_alerta.exportar_estado(),
+        "fases": agendador.exportar_fases(),
+    }
+
+
+def salvar_estado(caminho: str = None) -> Optional[int]:
+    """Grava o estado (gzip, troca atômica). Retorna o tamanho em bytes, ou None"""
+    caminho = caminho or ESTADO_ARQUIVO
+    if not caminho:
+        return None
+    try:
+        conteudo = gzip.compress(json.dumps(coletar_estado(), separators=(",", ":")).encode(), compresslevel=6)
+        diretorio = os.path.dirname(caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        temporario = f"{caminho}.tmp"
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, caminho)
+        return len(conteudo)
+    except Exception as e:
+        logger.warning(f"[Estado] Falha ao salvar {caminho}: {e}")
+        return None
+
+
+def carregar_estado(caminho: str = None) -> Optional[Dict[str, Any]]:
+    """Lê o estado salvo; arquivo ausente ou corrompido retorna None"""
+    caminho = caminho or ESTADO_ARQUIVO
+    if not caminho:
+        return None
+    try:
+        with gzip.open(caminho, "rt", encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError) as e:
+        logger.warning(f"[Estado] {caminho} ignorado: {e}")
+        return None
+
+
+def restaurar_estado(estado: Optional[Dict[str, Any]]):
+    """
+    Aplica o estado salvo ao que já existe antes dos workers (sinks, cache
+    de parâmetros, agendador) e guarda o de cada porta para o seu worker.
+    """
+    if not estado:
+        return
+    idade = time.time() - estado.get("salvo_em", 0)
+    recente = 0 <= idade <= ESTADO_IDADE_MAX
+    mesmo_layout = estado.get("layout") == ESTADO_LAYOUT and estado.get("campos") == list(CAMPOS_NUMERICOS)
+
+    sinks = {sink.nome: sink for sink in barramento.sinks}
+    restauradas = 0
+    for nome, itens in estado.get("sinks", {}).items():
+        sink = sinks.get(nome)
+        if sink is None or not hasattr(sink, "restaurar_fila") or not itens:
+            continue
+        if not mesmo_layout:
+            logger.warning(f"[Estado] Fila do sink {nome} descartada: layout de campos mudou")
+            continue
+        sink.restaurar_fila(itens)
+        restauradas += len(itens)
+
+    if recente:
+        cache_parametros_alerta.restaurar_estado(estado.get("parametros_alerta", {}))
+        agendador.restaurar_fases(estado.get("fases", {}))
+
+    for porta_vps, dados in estado.get("workers", {}).items():
+        if dados.get("cliente"):
+            clientes_hf.setdefault(porta_vps, dados["cliente"])
+        _estado_workers[porta_vps] = {
+            "rollup": dados.get("rollup"),
+            "filtro": dados.get("filtro") if recente and mesmo_layout else None,
+            "alertas": dados.get("alertas") if recente else None,
+        }
+
+    _partida["estado_restaurado"] = True
+    logger.info(
+        f"[Estado] Restaurado de {idade:.0f}s atrás (v{estado.get('versao')}): "
+        f"{restauradas} leitura(s) na fila, {len(_estado_workers)} gerador(es)"
+        + ("" if recente else " - só filas e rollups (estado antigo)")
+    )
+
+
+def restaurar_worker(porta_vps: str, filtro: "FiltroPlausibilidade", avaliador: "AvaliadorAlertas",
+                     agregador: "AgregadorRollup"):
+    """Estado salvo da porta, aplicado uma vez (o worker recriado pelo watchdog começa do zero)"""
+    dados = _estado_workers.pop(porta_vps, None)
+    if not dados:
+        return
+    for nome, alvo in (("filtro", filtro), ("alertas", avaliador), ("rollup", agregador)):
+        if dados.get(nome):
+            try:
+                alvo.restaurar_estado(dados[nome])
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"[Estado] {nome} da porta {porta_vps} ignorado: {e}")
+
+
+def salvar_estado_periodico():
+    """Thread: grava o estado a cada ESTADO_INTERVALO"""
+    while True:
+        time.sleep(ESTADO_INTERVALO)
+        salvar_estado()
+
+
 # =============================================================================
 # LOOP PRINCIPAL
 # =============================================================================
@@ -830,7 +6058,7 @@ def worker_gerador(porta_vps: str, config: Dict[str, Any]):
 def main():
     """Inicia threads para cada gerador habilitado"""
     logger.info("=" * 60)
-    logger.info("VPS Modbus Reader - K30XL v2.5.0 (Horímetro Corrigido)")
+    logger.info(f"VPS Modbus Reader - K30XL v{VERSAO}")
     logger.info("IMPORTANTE: Configure HF2211 com baudrate 19200!")
     logger.info(f"Edge Function: {EDGE_FUNCTION_URL}")
     
@@ -862,17 +6090,31 @@ def main():
     
     logger.info("=" * 60)
     
+    # Sink Postgres opcional (GMG_POSTGRES_DSN)
+    global sink_postgres, sink_eventos
+    if not MODO_DEBUG and not MODO_SCAN:
+        sink_postgres = iniciar_sink_postgres()
+        iniciar_sinks()
+        sink_eventos = SinkEventos()
+        barramento.registrar_sink(sink_eventos)
+    
+    # Snapshot local para IHM/relés/scripts (também em modo debug)
+    global snapshot
+    if not MODO_SCAN:
+        snapshot = iniciar_snapshot(list(geradores_ativos))
+    
+    # Agendador central: fases espalhadas pelo intervalo de leitura
+    agendador.definir_fases(list(geradores_ativos))
+    
+    # v2.28.0: filas, rollups, filtros, alertas e fases do processo anterior
+    if not MODO_SCAN:
+        restaurar_estado(carregar_estado())
+    agendador.iniciar()
+    
     # Inicia threads
     threads = []
     for porta_vps, config in geradores_ativos.items():
-        t = threading.Thread(
-            target=worker_gerador,
-            args=(porta_vps, config),
-            daemon=True,
-            name=f"Worker-{porta_vps}"
-        )
-        t.start()
-        threads.append(t)
+        threads.append(iniciar_worker(porta_vps, config))
         logger.info(f"Thread iniciada para porta {porta_vps}")
     
     # No modo scan, aguarda a thread terminar
@@ -882,43 +6124,415 @@ def main():
         logger.info("Scan finalizado.")
         return
     
+    # Watchdog: aborta ciclos travados e recria workers que morreram
+    threading.Thread(target=watchdog, daemon=True, name="Watchdog").start()
+    
     # Health check API (porta 3001)
-    logger.info("Iniciando Health API na porta 3001...")
+    logger.info(f"Iniciando Health API na porta {PORTA_HEALTH_API}...")
     iniciar_health_api()
     
+    if ESTADO_ARQUIVO:
+        threading.Thread(target=salvar_estado_periodico, daemon=True, name="Estado").start()
+    
+    # SIGTERM (systemctl stop/restart) encerra como o Ctrl+C, salvando o estado
+    encerrar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: encerrar.set())
+    
     # Mantém o programa rodando
     try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.info("Encerrando...")
+        while not encerrar.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    logger.info("Encerrando...")
+    tamanho = salvar_estado()
+    if tamanho is not None:
+        logger.info(f"[Estado] Salvo em {ESTADO_ARQUIVO} ({tamanho} bytes)")
+    for sink in barramento.sinks:
+        sink.fechar()
+
+
+# =============================================================================
+# PROFILING SOB DEMANDA (v2.9.0)
+# =============================================================================
+
+_perfil_lock = threading.Lock()
+
+
+class PerfilOcupado(Exception):
+    """Já existe uma coleta de perfil em andamento"""
+
+
+def _chave_funcao(frame) -> str:
+    codigo = frame.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+def _modulo_frame(frame) -> str:
+    return frame.f_globals.get("__name__", "?")
+
+
+def _top(contador: Counter, total: int) -> list:
+    return [
+        {"nome": nome, "amostras": qtd, "percentual": round(100.0 * qtd / total, 1)}
+        for nome, qtd in contador.most_common(PERFIL_TOP)
+    ]
+
+
+def coletar_perfil_cpu(segundos: float, intervalo_ms: float = PERFIL_INTERVALO_MS) -> Dict[str, Any]:
+    """
+    Profiler por amostragem de todas as threads (sys._current_frames).
+
+    Agrupa por função (tempo próprio = topo da pilha; tempo total = função
+    presente na pilha) e por módulo do topo da pilha (ex: logging, socket).
+    Apenas uma coleta por vez; levanta PerfilOcupado se já houver outra.
+    """
+    segundos = min(max(segundos, 0.1), PERFIL_MAX_SEGUNDOS)
+    intervalo = max(intervalo_ms, 1) / 1000.0
+
+    if not _perfil_lock.acquire(blocking=False):
+        raise PerfilOcupado()
+
+    try:
+        proprio = Counter()
+        total = Counter()
+        modulos = Counter()
+        threads = Counter()
+        amostras = 0
+        ignorar = threading.get_ident()
+        nomes_threads = {}
+        fim = time.monotonic() + segundos
+
+        while time.monotonic() < fim:
+            for ident, frame in sys._current_frames().items():
+                if ident == ignorar:
+                    continue
+                if ident not in nomes_threads:
+                    nomes_threads = {t.ident: t.name for t in threading.enumerate()}
+
+                amostras += 1
+                threads[nomes_threads.get(ident, str(ident))] += 1
+                proprio[_chave_funcao(frame)] += 1
+                modulos[_modulo_frame(frame)] += 1
+
+                vistas = set()
+                while frame is not None:
+                    chave = _chave_funcao(frame)
+                    if chave not in vistas:
+                        vistas.add(chave)
+                        total[chave] += 1
+                    frame = frame.f_back
+
+            time.sleep(intervalo)
+
+        amostras = max(amostras, 1)
+        return {
+            "segundos": segundos,
+            "intervalo_ms": intervalo * 1000,
+            "amostras": amostras,
+            "por_funcao_proprio": _top(proprio, amostras),
+            "por_funcao_total": _top(total, amostras),
+            "por_modulo": _top(modulos, amostras),
+            "por_thread": _top(threads, amostras),
+        }
+    finally:
+        _perfil_lock.release()
+
+
+def coletar_diff_memoria(segundos: float) -> Dict[str, Any]:
+    """
+    Compara dois snapshots do tracemalloc separados por `segundos`.
+    tracemalloc só fica ativo durante a coleta (a não ser que já estivesse).
+    """
+    segundos = min(max(segundos, 0.1), PERFIL_MAX_SEGUNDOS)
+
+    if not _perfil_lock.acquire(blocking=False):
+        raise PerfilOcupado()
+
+    iniciado_aqui = not tracemalloc.is_tracing()
+    try:
+        if iniciado_aqui:
+            tracemalloc.start(1)
+        antes = tracemalloc.take_snapshot()
+        time.sleep(segundos)
+        depois = tracemalloc.take_snapshot()
+        atual, pico = tracemalloc.get_traced_memory()
+
+        filtros = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diferencas = depois.filter_traces(filtros).compare_to(antes.filter_traces(filtros), "lineno")
+
+        return {
+            "segundos": segundos,
+            "memoria_rastreada_bytes": atual,
+            "pico_bytes": pico,
+            "top_diferencas": [
+                {
+                    "local": f"{os.path.basename(d.traceback[0].filename)}:{d.traceback[0].lineno}",
+                    "diferenca_bytes": d.size_diff,
+                    "tamanho_bytes": d.size,
+                    "diferenca_blocos": d.count_diff,
+                }
+                for d in diferencas[:PERFIL_TOP]
+            ],
+        }
+    finally:
+        if iniciado_aqui:
+            tracemalloc.stop()
+        _perfil_lock.release()
 
 
 # =============================================================================
 # HEALTH CHECK API
 # =============================================================================
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def _token_confere(token: Optional[str]) -> bool:
+    """Compara com TOKEN_API em tempo constante"""
+    return token is not None and hmac.compare_digest(token.encode(), TOKEN_API.encode())
+
 
 class HealthHandler(BaseHTTPRequestHandler):
+    def _responder_json(self, status: int, corpo: Dict[str, Any]):
+        dados = json.dumps(corpo, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _autorizado(self, params: Optional[Dict[str, list]] = None, exigir_token: bool = False) -> bool:
+        """
+        Confere o X-API-Key. Com exigir_token, a rota fica fechada (403) se
+        GMG_API_TOKEN não estiver definido no serviço.
+        """
+        if not TOKEN_API:
+            if not exigir_token:
+                return True
+            self._responder_json(403, {"error": "Rota desabilitada: defina GMG_API_TOKEN"})
+            return False
+        if _token_confere(self.headers.get("X-API-Key")):
+            return True
+        # EventSource (navegador) não envia headers: aceita ?api_key=
+        if params and _token_confere(params.get("api_key", [None])[0]):
+            return True
+        self._responder_json(401, {"error": "X-API-Key inválida"})
+        return False
+
     def do_GET(self):
-        if self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/health':
+            # v2.18.0: saúde por gerador; 503 se algum está parado, travado ou sem dados
+            geradores = saude_geradores()
+            saudavel = all(g["saudavel"] for g in geradores.values())
             response = {
-                "status": "ok",
+                "status": "ok" if saudavel else "degradado",
                 "service": "vps-modbus-reader",
-                "version": "2.4.0",
+                "version": VERSAO,
                 "protocol": "Modbus RTU (K30XL - Scan Extendido)",
                 "debug_mode": MODO_DEBUG,
+                "geradores": geradores,
                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
             }
-            self.wfile.write(json.dumps(response).encode())
+            self._responder_json(200 if saudavel else 503, response)
+        elif url.path == '/metricas':
+            self._responder_json(200, {
+                "version": VERSAO,
+                "geradores": metricas.instantaneo(),
+                "sinks": {sink.nome: sink.estado() for sink in barramento.sinks},
+                "serial": uso_serial.instantaneo(),
+                "partida": estado_partida(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            })
+        elif url.path == '/quarentena':
+            porta = params.get("porta_vps", [None])[0]
+            self._responder_json(200, {
+                "version": VERSAO,
+                "geradores": {
+                    p: list(f.quarentena) for p, f in list(filtros.items())
+                    if porta is None or p == porta
+                },
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            })
+        elif url.path == '/registradores':
+            # idade_max pequeno força leitura no link em produção: fechado sem token
+            if self._autorizado(params, exigir_token=True):
+                self._consultar_registradores(params)
+        elif url.path == '/stream':
+            if self._autorizado(params):
+                self._transmitir_stream(params.get("porta_vps", [None])[0])
+        elif url.path in ('/debug/perfil', '/debug/memoria'):
+            # Profiling e heap ficam fechados sem token (coleta cara, detalhes internos)
+            if not self._autorizado(exigir_token=True):
+                return
+            try:
+                segundos = float(params.get("segundos", ["10"])[0])
+                if url.path == '/debug/perfil':
+                    intervalo_ms = float(params.get("intervalo_ms", [str(PERFIL_INTERVALO_MS)])[0])
+                    logger.info(f"Profiling de CPU solicitado ({segundos}s)")
+                    resultado = coletar_perfil_cpu(segundos, intervalo_ms)
+                else:
+                    logger.info(f"Diff de memória solicitado ({segundos}s)")
+                    resultado = coletar_diff_memoria(segundos)
+                self._responder_json(200, resultado)
+            except ValueError:
+                self._responder_json(400, {"error": "Parâmetros inválidos"})
+            except PerfilOcupado:
+                self._responder_json(409, {"error": "Já existe uma coleta em andamento"})
         else:
             self.send_response(404)
             self.end_headers()
+
+    def _consultar_registradores(self, params: Dict[str, list]):
+        """GET /registradores: valores do cache com idade máxima, lendo o link se preciso (v2.23.0)"""
+        def param(nome: str, padrao=None):
+            return params.get(nome, [padrao])[0]
+
+        try:
+            porta_vps = param("porta_vps")
+            endereco = int(param("endereco"), 0)
+            quantidade = int(param("quantidade", "1"))
+            idade_max = float(param("idade_max", str(CACHE_IDADE_MAX_PADRAO)))
+            funcao = int(param("funcao", "3"))
+            prazo_s = float(param("prazo_s", str(PRAZO_LEITURA_CACHE)))
+            if funcao not in (0x03, 0x04):
+                raise ValueError("funcao deve ser 3 (FC03) ou 4 (FC04)")
+            if not 1 <= quantidade <= 125 or not 0 <= endereco <= 0xFFFF - quantidade + 1:
+                raise ValueError("endereco/quantidade fora da faixa (1-125 registradores)")
+            if idade_max < 0 or not 0 < prazo_s <= PRAZO_DIAGNOSTICO_MAX:
+                raise ValueError("idade_max ou prazo_s inválido")
+        except (TypeError, ValueError) as e:
+            self._responder_json(400, {"error": f"Parâmetros: porta_vps, endereco, quantidade, idade_max ({e})"})
+            return
+
+        conexao = conexoes.get(porta_vps)
+        if conexao is None:
+            self._responder_json(404, {"error": f"Gerador {porta_vps} não habilitado"})
+            return
+        resultado = consultar_registradores(conexao, endereco, quantidade, idade_max, funcao, prazo_s)
+        status = {"ok": 200, "fila_cheia": 429, "sem_conexao": 503, "prazo_expirado": 504}.get(resultado["status"], 502)
+        self._responder_json(status, resultado)
+
+    def _transmitir_stream(self, porta_vps: Optional[str]):
+        """Server-Sent Events com as leituras de um gerador ou da frota"""
+        if porta_vps is not None and porta_vps not in GERADORES_CONFIG:
+            self._responder_json(404, {"error": f"Gerador {porta_vps} não configurado"})
+            return
+        assinatura = barramento.assinar(porta_vps)
+        if assinatura is None:
+            self._responder_json(503, {"error": "Limite de conexões de stream atingido"})
+            return
+
+        logger.info(f"Stream aberto por {self.client_address[0]} ({porta_vps or 'todos'})")
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(b"retry: 2000\n\n")
+            self.wfile.flush()
+            while True:
+                mensagens = assinatura.aguardar(STREAM_KEEPALIVE)
+                self.wfile.write(b"".join(mensagens) if mensagens else b": keepalive\n\n")
+                self.wfile.flush()
+        except OSError:
+            pass  # consumidor desconectou
+        finally:
+            barramento.cancelar(assinatura)
+            logger.info(f"Stream encerrado ({self.client_address[0]}, {assinatura.descartadas} descartadas)")
+
+    # Status HTTP por resultado do comando
+    STATUS_COMANDO = {
+        "ok": 200,
+        "divergente": 409,
+        "verificacao_falhou": 409,
+        "erro": 502,
+        "prazo_expirado": 504,
+    }
+
+    def do_POST(self):
+        url = urlparse(self.path)
+
+        if url.path == '/diagnostico':
+            self._diagnosticar()
+            return
+        if url.path != '/comandos':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        # Escrita no controlador nunca fica aberta: exige token configurado
+        if not TOKEN_API:
+            self._responder_json(403, {"error": "Comandos desabilitados: defina GMG_API_TOKEN"})
+            return
+        if not self._autorizado():
+            return
+
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            comando = criar_comando(json.loads(self.rfile.read(tamanho) or b"{}"),
+                                    origem=self.client_address[0])
+        except (ValueError, TypeError) as e:
+            self._responder_json(400, {"error": str(e)})
+            return
+
+        conexao = conexoes.get(comando.porta_vps)
+        if conexao is None:
+            self._responder_json(404, {"error": f"Gerador {comando.porta_vps} não habilitado"})
+            return
+        if len(conexao.fila) >= MAX_COMANDOS_PENDENTES:
+            self._responder_json(429, {"error": "Fila de comandos cheia"})
+            return
+
+        conexao.fila.colocar(PRIORIDADE_COMANDO, comando)
+        logger.info(f"Comando {comando.id} enfileirado para {comando.porta_vps} ({self.client_address[0]})")
+
+        # Após o prazo o worker descarta o comando sem executar; a folga cobre
+        # uma escrita já iniciada (escrita + leitura de volta)
+        espera = max(comando.prazo - time.monotonic(), 0) + 2 * conexao.timeout
+        if not comando.concluido.wait(espera):
+            self._responder_json(504, {"id": comando.id, "status": "pendente"})
+            return
+        self._responder_json(self.STATUS_COMANDO.get(comando.resultado["status"], 500), comando.resultado)
     
+    def _diagnosticar(self):
+        """POST /diagnostico: leitura/sondagem no link em produção (v2.20.0)"""
+        # Transações no barramento em produção: fechado sem GMG_API_TOKEN (403)
+        if not self._autorizado(exigir_token=True):
+            return
+
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            diagnostico = criar_diagnostico(json.loads(self.rfile.read(tamanho) or b"{}"),
+                                            origem=self.client_address[0])
+        except (ValueError, TypeError) as e:
+            self._responder_json(400, {"error": str(e)})
+            return
+
+        conexao = conexoes.get(diagnostico.porta_vps)
+        if conexao is None:
+            self._responder_json(404, {"error": f"Gerador {diagnostico.porta_vps} não habilitado"})
+            return
+        if len(conexao.fila) >= MAX_COMANDOS_PENDENTES:
+            self._responder_json(429, {"error": "Fila do link cheia"})
+            return
+
+        conexao.fila.colocar(PRIORIDADE_DIAGNOSTICO, diagnostico)
+        logger.info(
+            f"Diagnóstico {diagnostico.id} ({diagnostico.operacao}, {len(diagnostico.passos)} passos) "
+            f"enfileirado para {diagnostico.porta_vps} ({self.client_address[0]})"
+        )
+
+        espera = max(diagnostico.prazo - time.monotonic(), 0) + 2 * conexao.timeout
+        if not diagnostico.concluido.wait(espera):
+            diagnostico.cancelar("prazo_expirado")
+        status = diagnostico.resultado["status"]
+        self._responder_json({"ok": 200, "prazo_expirado": 504}.get(status, 502), diagnostico.resultado)
+
     def log_message(self, format, *args):
         pass
 
@@ -926,10 +6540,11 @@ class HealthHandler(BaseHTTPRequestHandler):
 def iniciar_health_api():
     """Inicia servidor HTTP para health checks"""
     try:
-        server = HTTPServer(('0.0.0.0', 3001), HealthHandler)
+        server = ThreadingHTTPServer(('0.0.0.0', PORTA_HEALTH_API), HealthHandler)
+        server.daemon_threads = True
         thread = threading.Thread(target=server.serve_forever, daemon=True)
         thread.start()
-        logger.info("Health API rodando em http://0.0.0.0:3001/health")
+        logger.info(f"Health API rodando em http://0.0.0.0:{PORTA_HEALTH_API}/health")
     except Exception as e:
         logger.error(f"Erro ao iniciar Health API: {e}")
 
@@ -938,36 +6553,39 @@ def iniciar_health_api():
 # MODO TESTE (ENVIO SIMULADO)
 # =============================================================================
 
+DADOS_SIMULADOS = {
+    "tensao_rede_rs": 220,
+    "tensao_rede_st": 218,
+    "tensao_rede_tr": 222,
+    "tensao_gmg": 0,
+    "corrente_fase1": 0,
+    "frequencia_gmg": 0.0,
+    "rpm_motor": 0,
+    "tensao_bateria": 12.8,
+    "temperatura_agua": 25,
+    "horas_trabalhadas": 285.5,
+    "numero_partidas": 625,
+    "nivel_combustivel": 78,
+    "modo_automatico": True,
+    "modo_manual": False,
+    "modo_inibido": False,
+    "rede_alimentando": True,
+    "gmg_alimentando": False,
+    "aviso_ativo": False,
+    "falha_ativa": False,
+    "motor_funcionando": False,
+    "tensao_gmg_ok": False,
+    "rede_ok": True,
+}
+
+
 def testar_envio_simulado():
     """Envia dados simulados para testar a edge function"""
     logger.info("=" * 60)
     logger.info("MODO TESTE - Enviando dados simulados K30XL")
     logger.info("=" * 60)
     
-    dados_simulados = {
-        "tensao_rede_rs": 220,
-        "tensao_rede_st": 218,
-        "tensao_rede_tr": 222,
-        "tensao_gmg": 0,
-        "corrente_fase1": 0,
-        "frequencia_gmg": 0.0,
-        "rpm_motor": 0,
-        "tensao_bateria": 12.8,
-        "temperatura_agua": 25,
-        "horas_trabalhadas": 285.5,
-        "numero_partidas": 625,
-        "nivel_combustivel": 78,
-        "modo_automatico": True,
-        "modo_manual": False,
-        "modo_inibido": False,
-        "rede_alimentando": True,
-        "gmg_alimentando": False,
-        "aviso_ativo": False,
-        "falha_ativa": False,
-        "motor_funcionando": False,
-        "tensao_gmg_ok": False,
-        "rede_ok": True,
-    }
+    dados_simulados = {**DADOS_SIMULADOS, "capturado_em": agora_iso_utc()}
     
     logger.info("Dados simulados:")
     for chave, valor in dados_simulados.items():
@@ -983,15 +6601,711 @@ def testar_envio_simulado():
     return sucesso
 
 
+def testar_sink_postgres(quantidade: int = 1000) -> bool:
+    """
+    Grava `quantidade` leituras simuladas pelo sink Postgres, para validar
+    contra um banco local (ex: `supabase start`, GMG_POSTGRES_DSN apontando
+    para ele) com a porta 15002 cadastrada em equipamentos_hf.
+    """
+    logger.info("=" * 60)
+    logger.info(f"TESTE DO SINK POSTGRES - {quantidade} leituras simuladas")
+    logger.info("=" * 60)
+
+    sink = iniciar_sink_postgres()
+    if sink is None:
+        logger.error("✗ Defina GMG_POSTGRES_DSN e instale psycopg2-binary")
+        return False
+    if sink.gerador_id("15002") is None:
+        logger.error("✗ Porta 15002 não cadastrada em equipamentos_hf")
+        return False
+
+    inicio = time.monotonic()
+    for _ in range(quantidade):
+        leitura = _leitura_simulada()
+        leitura.capturado_em = time.time()
+        sink.enfileirar("15002", leitura)
+
+    if not sink.esvaziar(60):
+        logger.error(f"✗ {sink.pendentes()} leituras não gravadas")
+        return False
+
+    duracao = time.monotonic() - inicio
+    logger.info(f"✓ {quantidade} leituras em {duracao:.2f}s ({quantidade / duracao:.0f} leituras/s)")
+    return True
+
+
+def testar_sinks(quantidade: int = 1000) -> bool:
+    """
+    Publica `quantidade` leituras simuladas no barramento e aguarda os sinks
+    de GMG_SINKS esvaziarem. O sink http fica de fora (não envia leituras
+    simuladas para o backend). Para o mqtt, um broker local serve
+    (ex: python vps-carga-ingestao.py broker).
+    """
+    logger.info("=" * 60)
+    logger.info(f"TESTE DOS SINKS {SINKS} - {quantidade} leituras simuladas")
+    logger.info("=" * 60)
+
+    sinks = iniciar_sinks([nome for nome in SINKS if nome != "http"])
+    if not sinks:
+        logger.error("✗ Nenhum sink ativo (GMG_SINKS=arquivo,mqtt)")
+        return False
+
+    inicio = time.monotonic()
+    for i in range(quantidade):
+        leitura = _leitura_simulada()
+        barramento.publicar(str(15001 + i % 3), "leitura", leitura, True)
+
+    publicacao = time.monotonic() - inicio
+
+    # Cada sink esvazia no seu ritmo: um broker lento não atrasa o arquivo
+    esvaziou_em = {}
+    limite = time.monotonic() + 60
+    while len(esvaziou_em) < len(sinks) and time.monotonic() < limite:
+        for sink in sinks:
+            if sink.nome not in esvaziou_em and not sink.pendentes():
+                esvaziou_em[sink.nome] = time.monotonic() - inicio
+        time.sleep(0.05)
+
+    ok = True
+    for sink in sinks:
+        estado = sink.estado()
+        sucesso = estado.get("enviadas", 0) == quantidade
+        ok = ok and sucesso
+        tempo = f"{esvaziou_em[sink.nome]:.2f}s" if sink.nome in esvaziou_em else "não esvaziou"
+        logger.info(f"{'✓' if sucesso else '✗'} {sink.nome}: {tempo} {estado}")
+    logger.info(f"{quantidade} leituras publicadas em {publicacao * 1000:.0f}ms (thread do worker)")
+    return ok
+
+
+def reenviar_dead_letter(portas: List[str] = None) -> bool:
+    """
+    Reenvia as leituras do dead-letter do sink http (DEAD_LETTER_DIRETORIO),
+    uma por POST. O arquivo é renomeado antes (o serviço rodando abre outro);
+    o que falhar de novo volta ao dead-letter. Reenvio repetido não duplica
+    linhas: seq e id_fluxo continuam no corpo.
+    """
+    if portas is None:
+        nomes = os.listdir(DEAD_LETTER_DIRETORIO) if os.path.isdir(DEAD_LETTER_DIRETORIO) else []
+        portas = sorted({nome.split(".")[0] for nome in nomes if nome.endswith((".ndjson", ".reenviando"))})
+    if not portas:
+        logger.info(f"Dead-letter vazio ({DEAD_LETTER_DIRETORIO})")
+        return True
+
+    ok = True
+    for porta_vps in portas:
+        caminho = os.path.join(DEAD_LETTER_DIRETORIO, f"{porta_vps}.ndjson")
+        em_reenvio = caminho[:-len(".ndjson")] + ".reenviando"
+        if not os.path.exists(em_reenvio):  # sobra de um reenvio interrompido vai primeiro
+            if not os.path.exists(caminho):
+                continue
+            os.replace(caminho, em_reenvio)
+        with open(em_reenvio, encoding="utf-8") as arquivo:
+            registros = [json.loads(linha) for linha in arquivo if linha.strip()]
+
+        enviadas, restantes = 0, []
+        for i, registro in enumerate(registros):
+            try:
+                status = postar_backend(registro["corpo"]).status_code
+            except requests.RequestException as e:
+                status, registro["erro"] = None, str(e)
+            if status == 200:
+                enviadas += 1
+                continue
+            if status is not None:
+                registro["erro"] = f"reenvio: HTTP {status}"
+            restantes.append(registro)
+            if status in STATUS_TRANSITORIOS:
+                restantes.extend(registros[i + 1:])  # backend fora do ar: tenta depois
+                break
+
+        if restantes:
+            with open(caminho, "a", encoding="utf-8") as arquivo:
+                arquivo.writelines(json.dumps(registro, ensure_ascii=False) + "\n" for registro in restantes)
+        os.remove(em_reenvio)
+        ok = ok and not restantes
+        logger.info(f"{'✓' if not restantes else '✗'} Porta {porta_vps}: {enviadas} reenviada(s), "
+                    f"{len(restantes)} de volta ao dead-letter")
+    return ok
+
+
+def mostrar_snapshot(porta_vps: str = None) -> bool:
+    """
+    Lê SNAPSHOT_ARQUIVO como um processo externo (serviço rodando) e mede
+    a latência de uma leitura consistente do slot.
+    """
+    try:
+        leitor = LeitorSnapshot()
+    except (OSError, ValueError) as e:
+        logger.error(f"✗ {SNAPSHOT_ARQUIVO}: {e}")
+        return False
+    logger.info(f"Snapshot {SNAPSHOT_ARQUIVO}: escritor PID {leitor.pid}, geração {leitor.geracao}, "
+                f"desde {iso_utc(leitor.iniciado_em)}")
+
+    leituras = leitor.ler_todos() if porta_vps is None else {porta_vps: leitor.ler(porta_vps)}
+    agora = time.time()
+    for porta, leitura in leituras.items():
+        if leitura is None:
+            logger.info(f"  {porta}: sem leitura")
+            continue
+        logger.info(f"  {porta}: idade {agora - leitura['capturado_em']:.1f}s "
+                    f"{json.dumps(leitura, ensure_ascii=False)}")
+
+    alvo = next((porta for porta, leitura in leituras.items() if leitura), None)
+    if alvo is None:
+        logger.info("Nenhum gerador publicou ainda")
+        leitor.fechar()
+        return False
+    amostras = []
+    for _ in range(10000):
+        inicio = time.perf_counter_ns()
+        leitor.ler(alvo)
+        amostras.append(time.perf_counter_ns() - inicio)
+    amostras.sort()
+    logger.info(f"Latência de leitura ({alvo}): p50 {amostras[5000] / 1000:.1f}µs, "
+                f"p99 {amostras[9900] / 1000:.1f}µs")
+    leitor.fechar()
+    return True
+
+
+def testar_serie(geradores: int = 20, horas: int = 2) -> bool:
+    """
+    Grava `horas` de amostras de 1 Hz simuladas para `geradores` geradores
+    num diretório temporário e mede custo de escrita, bytes por amostra e a
+    leitura de um intervalo de 10 minutos (conferida com o que foi gravado).
+    """
+    logger.info("=" * 60)
+    logger.info(f"TESTE DA SÉRIE TEMPORAL - {geradores} geradores x {horas}h a 1 Hz")
+    logger.info("=" * 60)
+
+    diretorio = tempfile.mkdtemp(prefix="gmg-series-")
+    aleatorio = random.Random(42)
+    fim = time.time() // SERIE_PARTICAO_S * SERIE_PARTICAO_S
+    inicio = fim - horas * SERIE_PARTICAO_S
+    amostras = horas * SERIE_PARTICAO_S
+    try:
+        series = [SerieTemporal(str(20000 + g), diretorio) for g in range(geradores)]
+        leituras = [_leitura_simulada() for _ in range(geradores)]
+        conferir = []  # (instante, valores, booleanos) do primeiro gerador
+        escrita_ns = 0
+        for segundo in range(amostras):
+            for g, (serie, leitura) in enumerate(zip(series, leituras)):
+                # Passeio aleatório na resolução dos registradores
+                valores = leitura.valores
+                for i in (0, 1, 2):
+                    if aleatorio.random() < 0.3:
+                        valores[i] += aleatorio.choice((-1, 1))
+                if aleatorio.random() < 0.1:
+                    valores[7] = round(valores[7] + aleatorio.choice((-0.1, 0.1)), 1)
+                if aleatorio.random() < 0.01:
+                    valores[8] += aleatorio.choice((-1, 1))
+                instante = inicio + segundo + aleatorio.uniform(0, 0.05)
+                if g == 0:
+                    conferir.append((instante, array("d", valores), leitura.booleanos))
+                antes = time.perf_counter_ns()
+                serie.adicionar(instante, valores, leitura.booleanos)
+                escrita_ns += time.perf_counter_ns() - antes
+        for serie in series:
+            serie.descarregar()
+
+        total = geradores * amostras
+        tamanho = sum(os.path.getsize(caminho) for serie in series for _, caminho in _particoes(serie.diretorio))
+        por_amostra = tamanho / total
+        json_por_amostra = len(_linha_json("20000", leituras[0], False)) + 1
+        bruto_por_amostra = 8 + 8 * len(CAMPOS_NUMERICOS) + 4
+        logger.info(f"Escrita: {escrita_ns / total / 1000:.1f}µs/amostra "
+                    f"({total / (escrita_ns / 1e9):.0f} amostras/s numa thread)")
+        logger.info(f"Disco: {tamanho / 1024:.0f} KiB, {por_amostra:.1f} bytes/amostra "
+                    f"(bruto {bruto_por_amostra}, {bruto_por_amostra / por_amostra:.0f}x; "
+                    f"NDJSON {json_por_amostra}, {json_por_amostra / por_amostra:.0f}x)")
+        logger.info(f"Projeção: {por_amostra * 86400 * SERIE_RETENCAO_DIAS / 1024 / 1024:.0f} MiB por gerador "
+                    f"em {SERIE_RETENCAO_DIAS} dias a 1 Hz")
+
+        # Intervalo de 10 min no meio da última hora
+        de = fim - SERIE_PARTICAO_S / 2
+        ate = de + 600
+        estatisticas = Counter()
+        antes = time.perf_counter()
+        colunas = ler_serie(series[0].porta_vps, de, ate, diretorio=diretorio, estatisticas=estatisticas)
+        leitura_ms = (time.perf_counter() - antes) * 1000
+        esperado = [amostra for amostra in conferir if de <= round(amostra[0] * 1000) / 1000 <= ate]
+        ok = len(colunas["capturado_em"]) == len(esperado) and all(
+            abs(colunas["capturado_em"][i] - instante) < 0.001
+            and all(colunas[nome][i] == valor for nome, valor in zip(CAMPOS_NUMERICOS, valores)
+                    if valor == valor)
+            for i, (instante, valores, _) in enumerate(esperado)
+        )
+        logger.info(f"{'✓' if ok else '✗'} Leitura de 10 min: {len(colunas['capturado_em'])} amostras em "
+                    f"{leitura_ms:.1f}ms, {estatisticas['arquivos']} arquivo(s), "
+                    f"{estatisticas['blocos_lidos']} bloco(s) decodificado(s), "
+                    f"{estatisticas['blocos_pulados']} pulado(s)")
+        return ok
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+# =============================================================================
+# EXPORTAÇÃO DA SÉRIE LOCAL (v2.26.0)
+# =============================================================================
+#
+# --exportar lê a série local (v2.25.0) de um ou mais geradores e grava CSV
+# ou Parquet em lotes de EXPORTAR_LOTE linhas, bloco a bloco: a memória não
+# cresce com o intervalo. Com passo_s, cada janela alinhada ao relógio vira
+# uma linha (média, _min e _max dos numéricos via EstatisticaCampo, último
+# valor dos booleanos e amostras na janela), para levar meses de 1 Hz ao
+# pandas em segundos:
+#
+#   pd.read_parquet("saida.parquet")   # capturado_em já é timestamp UTC
+#   pd.read_csv("saida.csv", parse_dates=["capturado_em"])
+
+
+def _colunas_exportacao(campos: list, passo_s: float) -> list:
+    colunas = ["porta_vps", "capturado_em"]
+    if not passo_s:
+        return colunas + campos
+    colunas.append("amostras")
+    for campo in campos:
+        colunas.append(campo)
+        if campo in _INDICE_NUMERICO:
+            colunas += [f"{campo}_min", f"{campo}_max"]
+    return colunas
+
+
+def _em_lotes(blocos, campos: list):
+    """Junta os blocos da série em lotes de EXPORTAR_LOTE linhas"""
+    lote = {nome: [] for nome in ["capturado_em", *campos]}
+    for bloco in blocos:
+        for nome, valores in lote.items():
+            valores.extend(bloco[nome])
+        if len(lote["capturado_em"]) >= EXPORTAR_LOTE:
+            yield lote
+            lote = {nome: [] for nome in lote}
+    if lote["capturado_em"]:
+        yield lote
+
+
+def _reamostrar(blocos, campos: list, passo_s: float):
+    """Uma linha por janela de passo_s segundos, em lotes de EXPORTAR_LOTE"""
+    numericos = [campo for campo in campos if campo in _INDICE_NUMERICO]
+    booleanos = [campo for campo in campos if campo in _INDICE_BOOLEANO]
+    lote = {nome: [] for nome in _colunas_exportacao(campos, passo_s)[1:]}
+    janela = None
+    amostras = 0
+    estatisticas: Dict[str, EstatisticaCampo] = {}
+    ultimos: Dict[str, bool] = {}
+
+    def fechar_janela():
+        lote["capturado_em"].append(janela)
+        lote["amostras"].append(amostras)
+        for campo in numericos:
+            est = estatisticas.get(campo)
+            lote[campo].append(est.soma / est.amostras if est else None)
+            lote[f"{campo}_min"].append(est.minimo if est else None)
+            lote[f"{campo}_max"].append(est.maximo if est else None)
+        for campo in booleanos:
+            lote[campo].append(ultimos.get(campo))
+
+    for bloco in blocos:
+        colunas = [(campo, bloco[campo]) for campo in numericos]
+        for i, instante in enumerate(bloco["capturado_em"]):
+            inicio = instante - instante % passo_s
+            if inicio != janela:
+                if janela is not None:
+                    fechar_janela()
+                janela = inicio
+                amostras = 0
+                estatisticas = {}
+                ultimos = {}
+            amostras += 1
+            for campo, valores in colunas:
+                valor = valores[i]
+                if valor is None:
+                    continue
+                est = estatisticas.get(campo)
+                if est is None:
+                    estatisticas[campo] = EstatisticaCampo(valor)
+                else:
+                    est.adicionar(valor)
+            for campo in booleanos:
+                valor = bloco[campo][i]
+                if valor is not None:
+                    ultimos[campo] = valor
+        if len(lote["capturado_em"]) >= EXPORTAR_LOTE:
+            yield lote
+            lote = {nome: [] for nome in lote}
+    if janela is not None:
+        fechar_janela()
+    if lote["capturado_em"]:
+        yield lote
+
+
+class _SaidaCSV:
+    def __init__(self, caminho: str, colunas: list):
+        self.colunas = colunas
+        self.arquivo = open(caminho, "w", newline="", encoding="utf-8")
+        self.escritor = csv.writer(self.arquivo, lineterminator="\n")
+        self.escritor.writerow(colunas)
+
+    def escrever(self, porta_vps: str, lote: Dict[str, list]):
+        lote["capturado_em"] = [iso_utc(instante) for instante in lote["capturado_em"]]
+        linhas = zip(*(lote[nome] for nome in self.colunas[1:]))
+        self.escritor.writerows(
+            [porta_vps, *("" if valor is None else valor for valor in linha)] for linha in linhas
+        )
+
+    def fechar(self):
+        self.arquivo.close()
+
+
+class _SaidaParquet:
+    def __init__(self, caminho: str, colunas: list, passo_s: float):
+        tipos = []
+        for nome in colunas:
+            if nome == "porta_vps":
+                tipo = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+            elif nome == "capturado_em":
+                tipo = pyarrow.timestamp("ms", tz="UTC")
+            elif nome == "amostras":
+                tipo = pyarrow.int32()
+            elif nome in _INDICE_BOOLEANO:
+                tipo = pyarrow.bool_()
+            elif nome in CAMPOS_INTEIROS and not passo_s:
+                tipo = pyarrow.int64()
+            else:
+                tipo = pyarrow.float64()
+            tipos.append(pyarrow.field(nome, tipo))
+        self.esquema = pyarrow.schema(tipos)
+        self.escritor = pyarrow.parquet.ParquetWriter(caminho, self.esquema, compression="zstd")
+
+    def escrever(self, porta_vps: str, lote: Dict[str, list]):
+        linhas = len(lote["capturado_em"])
+        lote["capturado_em"] = [int(round(instante * 1000)) for instante in lote["capturado_em"]]
+        arrays = [pyarrow.DictionaryArray.from_arrays(pyarrow.array([0] * linhas, pyarrow.int32()),
+                                                      pyarrow.array([porta_vps]))]
+        for nome, tipo in zip(self.esquema.names[1:], self.esquema.types[1:]):
+            arrays.append(pyarrow.array(lote[nome], tipo))
+        self.escritor.write_table(pyarrow.Table.from_arrays(arrays, schema=self.esquema))
+
+    def fechar(self):
+        self.escritor.close()
+
+
+def exportar_serie(caminho: str, portas: List[str], inicio: float, fim: float,
+                   passo_s: float = 0, campos: List[str] = None) -> bool:
+    """
+    Exporta a série local das portas no intervalo [inicio, fim] (epoch) para
+    CSV ou Parquet (pela extensão de `caminho`), com reamostragem opcional.
+    """
+    campos = list(campos or CAMPOS_NUMERICOS + CAMPOS_BOOLEANOS)
+    desconhecidos = [campo for campo in campos if campo not in _INDICE_NUMERICO and campo not in _INDICE_BOOLEANO]
+    if desconhecidos:
+        logger.error(f"✗ Campos desconhecidos: {', '.join(desconhecidos)}")
+        return False
+    parquet = caminho.endswith((".parquet", ".pq"))
+    if not parquet and not caminho.endswith(".csv"):
+        logger.error("✗ Use um arquivo .csv ou .parquet")
+        return False
+    if parquet and pyarrow is None:
+        logger.error("✗ Parquet requer pip install pyarrow")
+        return False
+
+    colunas = _colunas_exportacao(campos, passo_s)
+    logger.info(f"Exportando {', '.join(portas)} de {iso_utc(inicio)} a {iso_utc(fim)} para {caminho}"
+                f"{f' (janelas de {passo_s:g}s)' if passo_s else ''}")
+    saida = _SaidaParquet(caminho, colunas, passo_s) if parquet else _SaidaCSV(caminho, colunas)
+    estatisticas = Counter()
+    linhas = 0
+    comeco = time.monotonic()
+    try:
+        for porta_vps in portas:
+            blocos = iterar_serie(porta_vps, inicio, fim, campos, estatisticas=estatisticas)
+            lotes = _reamostrar(blocos, campos, passo_s) if passo_s else _em_lotes(blocos, campos)
+            for lote in lotes:
+                linhas += len(lote["capturado_em"])
+                saida.escrever(porta_vps, lote)
+    finally:
+        saida.fechar()
+
+    duracao = time.monotonic() - comeco
+    logger.info(f"✓ {linhas} linha(s) de {estatisticas['amostras']} leitura(s) "
+                f"({estatisticas['blocos_lidos']} bloco(s) em {estatisticas['arquivos']} arquivo(s)) "
+                f"em {duracao:.1f}s ({estatisticas['amostras'] / max(duracao, 1e-9):.0f} leituras/s), "
+                f"{os.path.getsize(caminho) / 1024 / 1024:.1f} MiB")
+    return linhas > 0
+
+
+def _instante_cli(texto: str) -> float:
+    """Epoch ou data ISO (sem fuso = UTC) da linha de comando"""
+    try:
+        return float(texto)
+    except ValueError:
+        instante = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+        if instante.tzinfo is None:
+            instante = instante.replace(tzinfo=timezone.utc)
+        return instante.timestamp()
+
+
+def exportar_cli(argumentos: List[str]) -> bool:
+    """--exportar <arquivo.csv|.parquet> <portas|todas> <de> <até> [passo_s] [campos]"""
+    uso = "Uso: --exportar <arquivo.csv|.parquet> <15001,15002|todas> <de> <até> [passo_s] [campo,...]"
+    if len(argumentos) < 4:
+        logger.error(uso)
+        return False
+    caminho, portas, de, ate = argumentos[:4]
+    if portas == "todas":
+        portas = sorted(os.listdir(SERIE_DIRETORIO)) if os.path.isdir(SERIE_DIRETORIO) else []
+    else:
+        portas = [porta.strip() for porta in portas.split(",") if porta.strip()]
+    try:
+        inicio, fim = _instante_cli(de), _instante_cli(ate)
+        passo_s = float(argumentos[4]) if len(argumentos) > 4 else 0
+        if not 0 <= passo_s < math.inf:
+            raise ValueError(f"passo_s deve ser >= 0 segundos (0 = sem reamostragem), recebido: {argumentos[4]}")
+    except ValueError as e:
+        logger.error(f"✗ {e}")
+        logger.error(uso)
+        return False
+    campos = argumentos[5].split(",") if len(argumentos) > 5 else None
+    return exportar_serie(caminho, portas, inicio, fim, passo_s, campos)
+
+
+# =============================================================================
+# PLANEJADOR DE CAPACIDADE DO LINK SERIAL (v2.24.0)
+# =============================================================================
+
+def _plano_atual() -> Dict[str, Any]:
+    """Plano equivalente à configuração deste script (geradores habilitados)"""
+    return {
+        "links": {
+            porta: {
+                "intervalo_s": INTERVALO_LEITURA,
+                "blocos": [
+                    {"endereco": BLOCO1_ENDERECO, "quantidade": BLOCO1_QUANTIDADE},
+                    {"endereco": BLOCO2_ENDERECO, "quantidade": BLOCO2_QUANTIDADE},
+                ],
+                "transporte": config.get("transporte", "rtu"),
+                "timeout_s": config["timeout"],
+            }
+            for porta, config in GERADORES_CONFIG.items() if config.get("habilitado")
+        }
+    }
+
+
+def avaliar_link(link: Dict[str, Any], turnaround_ms: float = TURNAROUND_PLANEJAMENTO_MS) -> Dict[str, Any]:
+    """
+    Custo de um ciclo de polling no link serial e a folga em relação ao
+    intervalo. Campos de `link` (só "blocos" é obrigatório): intervalo_s,
+    blocos [{endereco, quantidade, funcao}], transporte (rtu/tcp),
+    delay_entre_blocos_s, turnaround_ms, baudrate, taxa_retry (fração de
+    transações repetidas), timeout_s. ValueError se intervalo_s <= 0.
+    """
+    baudrate = int(link.get("baudrate", BAUDRATE_SERIAL))
+    intervalo = float(link.get("intervalo_s", INTERVALO_LEITURA))
+    if not intervalo > 0:
+        raise ValueError(f"intervalo_s deve ser maior que zero (recebido: {link.get('intervalo_s')})")
+    transporte = link.get("transporte", "rtu")
+    turnaround = float(link.get("turnaround_ms", turnaround_ms)) / 1000
+    delay = float(link.get("delay_entre_blocos_s", DELAY_ENTRE_BLOCOS if transporte == "rtu" else 0.0))
+    taxa_retry = float(link.get("taxa_retry", 0.0))
+    timeout = float(link.get("timeout_s", 5.0))
+    blocos = link.get("blocos") or []
+
+    problemas = []
+    bytes_ciclo = fio = 0.0
+    for bloco in blocos:
+        quantidade = int(bloco["quantidade"])
+        if not 1 <= quantidade <= 125:
+            problemas.append(f"bloco 0x{int(bloco['endereco']):04X}: quantidade {quantidade} fora de 1-125")
+        resposta = 5 + 2 * quantidade  # endereço + FC + byte count + dados + CRC
+        bytes_ciclo += 8 + resposta
+        fio += tempo_fio_s(8, resposta, 1, baudrate)
+
+    if transporte == "tcp":
+        # Pipeline MBAP: um turnaround por lote de MAX_TRANSACOES_PENDENTES
+        lotes = -(-len(blocos) // MAX_TRANSACOES_PENDENTES)
+        ciclo = fio + lotes * turnaround
+    else:
+        ciclo = fio + len(blocos) * turnaround + max(len(blocos) - 1, 0) * delay
+    # Retries esperados: a transação de novo, após o backoff de framing/CRC
+    if blocos:
+        ciclo += taxa_retry * len(blocos) * ((fio / len(blocos)) + turnaround + POLITICAS_RETRY["crc"]["backoff"])
+    pior_caso = ciclo + timeout  # um bloco sem resposta no ciclo
+
+    ocupacao = ciclo / intervalo
+    limite = 1 - ORCAMENTO_BARRAMENTO_DIAGNOSTICO
+    if ocupacao > 1:
+        status = "inviavel"
+    elif ocupacao > limite:
+        status = "apertado"  # sem espaço para o orçamento de diagnóstico/cache
+    else:
+        status = "ok"
+    if pior_caso > PRAZO_CICLO:
+        problemas.append(f"pior caso {pior_caso:.1f}s passa do PRAZO_CICLO ({PRAZO_CICLO:.0f}s) do watchdog")
+    if pior_caso > intervalo:
+        problemas.append(f"um timeout ({timeout:.1f}s) estoura o intervalo: o slot seguinte é pulado")
+    if problemas and status == "ok":
+        status = "atencao"
+
+    return {
+        "status": status,
+        "baudrate": baudrate,
+        "intervalo_s": intervalo,
+        "blocos": len(blocos),
+        "bytes_por_ciclo": int(bytes_ciclo),
+        "fio_ms": round(fio * 1000, 1),
+        "ciclo_ms": round(ciclo * 1000, 1),
+        "pior_caso_ms": round(pior_caso * 1000, 1),
+        "utilizacao_fio": round(fio / intervalo, 4),
+        "ocupacao_link": round(ocupacao, 4),
+        "folga": round(max(1 - ocupacao, 0.0), 4),
+        "intervalo_minimo_s": round(ciclo / limite, 2),
+        "problemas": problemas,
+    }
+
+
+def planejar_capacidade(caminho: Optional[str] = None, turnaround_ms: float = TURNAROUND_PLANEJAMENTO_MS) -> bool:
+    """
+    Avalia um plano de polling sem tocar nos links. `caminho`: JSON
+    {"links": {"15002": {"intervalo_s": 5, "blocos": [...], ...}}} (ver
+    avaliar_link); sem arquivo, avalia a configuração atual. Retorna False
+    se algum link for inviável.
+    """
+    plano = _plano_atual()
+    if caminho:
+        with open(caminho, encoding="utf-8") as arquivo:
+            plano = json.load(arquivo)
+
+    logger.info("=" * 60)
+    logger.info(f"PLANEJAMENTO DO LINK SERIAL - {caminho or 'configuração atual'} "
+                f"(turnaround padrão {turnaround_ms:.0f} ms)")
+    logger.info("=" * 60)
+
+    viavel = True
+    for porta, link in plano.get("links", {}).items():
+        try:
+            r = avaliar_link(link, turnaround_ms)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"✗ {porta}: plano inválido - {e}")
+            viavel = False
+            continue
+        viavel = viavel and r["status"] != "inviavel"
+        marca = {"ok": "✓", "atencao": "!", "apertado": "!", "inviavel": "✗"}[r["status"]]
+        logger.info(
+            f"{marca} {porta}: {r['status'].upper()} - ciclo {r['ciclo_ms']:.0f} ms a cada "
+            f"{r['intervalo_s']:g} s ({r['blocos']} blocos, {r['bytes_por_ciclo']} bytes, fio {r['fio_ms']:.1f} ms)"
+        )
+        logger.info(
+            f"    fio {r['utilizacao_fio']:.2%}, ocupação {r['ocupacao_link']:.2%}, folga {r['folga']:.2%}, "
+            f"pior caso {r['pior_caso_ms']:.0f} ms, intervalo mínimo {r['intervalo_minimo_s']:g} s"
+        )
+        for problema in r["problemas"]:
+            logger.warning(f"    {problema}")
+    return viavel
+
+
+# =============================================================================
+# BENCHMARK DE MEMÓRIA (v2.10.0)
+# =============================================================================
+
+def _leitura_simulada() -> Leitura:
+    """Leitura completa com os valores de DADOS_SIMULADOS"""
+    leitura = Leitura()
+    for nome, valor in DADOS_SIMULADOS.items():
+        if nome in _INDICE_NUMERICO or nome in _INDICE_BOOLEANO:
+            leitura[nome] = valor
+    leitura["horimetro_horas"] = 285
+    leitura.capturado_em = time.time()
+    return leitura
+
+
+def benchmark_memoria(quantidade: int = 10000) -> bool:
+    """
+    Cria `quantidade` conexões simuladas (sem sockets) com uma leitura cada
+    e mede o heap Python via tracemalloc contra ORCAMENTO_MEMORIA_CONEXAO
+    e ORCAMENTO_MEMORIA_GERADOR. Retorna True se dentro do orçamento.
+    """
+    logger.info("=" * 60)
+    logger.info(f"BENCHMARK DE MEMÓRIA - {quantidade} conexões simuladas")
+    logger.info("=" * 60)
+
+    config = GERADORES_CONFIG["15002"]
+    parametros = [
+        {"parametro": nome, "valor_minimo": 0, "valor_maximo": 1000, "nivel": "warning", "habilitado": True}
+        for nome in MAPA_PARAMETROS_ALERTA
+    ]
+
+    tracemalloc.start()
+    try:
+        inicio = tracemalloc.get_traced_memory()[0]
+
+        conexoes = []
+        for i in range(quantidade):
+            conexao = ConexaoHF(str(20000 + i), config)
+            conexao.cliente_conectado = True
+            conexao.ultimo_dado = _leitura_simulada()
+            conexoes.append(conexao)
+
+        apos_conexoes = tracemalloc.get_traced_memory()[0]
+
+        estados = []
+        for conexao in conexoes:
+            avaliador = AvaliadorAlertas(conexao.porta_vps)
+            avaliador.avaliar(conexao.ultimo_dado, parametros)
+            agregador = AgregadorRollup(conexao.porta_vps)
+            agregador.adicionar(conexao.ultimo_dado)
+            filtro = FiltroPlausibilidade(conexao.porta_vps)
+            filtro.filtrar(conexao.ultimo_dado)
+            # Cache de registradores com os dois blocos do polling (v2.23.0)
+            conexao.cache.atualizar(conexao.endereco_modbus, 0x03, BLOCO1_ENDERECO, array("H", range(BLOCO1_QUANTIDADE)))
+            conexao.cache.atualizar(conexao.endereco_modbus, 0x03, BLOCO2_ENDERECO, array("H", range(BLOCO2_QUANTIDADE)))
+            estados.append((avaliador, agregador, filtro))
+
+        final = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    por_conexao = (apos_conexoes - inicio) / quantidade
+    por_gerador = (final - inicio) / quantidade
+
+    ok_conexao = por_conexao <= ORCAMENTO_MEMORIA_CONEXAO
+    ok_gerador = por_gerador <= ORCAMENTO_MEMORIA_GERADOR
+
+    logger.info(f"Conexão + leitura: {por_conexao:.0f} bytes "
+                f"(orçamento {ORCAMENTO_MEMORIA_CONEXAO}) {'✓' if ok_conexao else '✗'}")
+    logger.info(f"Estado completo por gerador: {por_gerador:.0f} bytes "
+                f"(orçamento {ORCAMENTO_MEMORIA_GERADOR}) {'✓' if ok_gerador else '✗'}")
+    logger.info(f"Total para {quantidade} geradores: {(final - inicio) / 1024 / 1024:.1f} MiB")
+
+    return ok_conexao and ok_gerador
+
+
 # =============================================================================
 # ENTRY POINT
 # =============================================================================
 
 if __name__ == "__main__":
-    import sys
-    
     if "--teste" in sys.argv:
         testar_envio_simulado()
+    elif "--teste-postgres" in sys.argv:
+        sys.exit(0 if testar_sink_postgres() else 1)
+    elif "--teste-sinks" in sys.argv:
+        sys.exit(0 if testar_sinks() else 1)
+    elif "--planejar" in sys.argv:
+        posicao = sys.argv.index("--planejar")
+        argumento = sys.argv[posicao + 1] if len(sys.argv) > posicao + 1 else None
+        sys.exit(0 if planejar_capacidade(argumento) else 1)
+    elif "--teste-serie" in sys.argv:
+        sys.exit(0 if testar_serie() else 1)
+    elif "--exportar" in sys.argv:
+        sys.exit(0 if exportar_cli(sys.argv[sys.argv.index("--exportar") + 1:]) else 1)
+    elif "--ler-snapshot" in sys.argv:
+        posicao = sys.argv.index("--ler-snapshot")
+        sys.exit(0 if mostrar_snapshot(sys.argv[posicao + 1] if len(sys.argv) > posicao + 1 else None) else 1)
+    elif "--benchmark-memoria" in sys.argv:
+        sys.exit(0 if benchmark_memoria() else 1)
+    elif "--reenviar-dead-letter" in sys.argv:
+        posicao = sys.argv.index("--reenviar-dead-letter")
+        argumento = sys.argv[posicao + 1] if len(sys.argv) > posicao + 1 else None
+        sys.exit(0 if reenviar_dead_letter(argumento.split(",") if argumento else None) else 1)
     elif "--scan" in sys.argv:
         MODO_SCAN = True
         MODO_DEBUG = True  # Scan sempre em debug
@@ -8,6 +8,11 @@ Uso:
   2. Executar: python3 vps-modbus-scanner.py
   3. Após descobrir o endereço, atualizar vps-modbus-reader.py
   4. Reiniciar serviço: sudo systemctl start gmg-lovable
+
+Com o leitor v2.20.0+ rodando, a mesma varredura pode ser feita sem parar o
+serviço (POST /diagnostico, operação "sondar"; ver VPS-SETUP-INSTRUCTIONS.md).
+A partir do v2.27.0 o leitor já sonda sozinho quando o endereço configurado
+não responde e guarda o resultado em dados/enderecos-escravo.json.
 """
 
 import socket
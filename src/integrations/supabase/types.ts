@@ -16,6 +16,7 @@ export type Database = {
     Tables: {
       alertas: {
         Row: {
+          chave_envio: string | null
           created_at: string
           gerador_id: string
           id: string
@@ -27,6 +28,7 @@ export type Database = {
           resolvido_em: string | null
         }
         Insert: {
+          chave_envio?: string | null
           created_at?: string
           gerador_id: string
           id?: string
@@ -38,6 +40,7 @@ export type Database = {
           resolvido_em?: string | null
         }
         Update: {
+          chave_envio?: string | null
           created_at?: string
           gerador_id?: string
           id?: string
@@ -139,6 +142,35 @@ export type Database = {
           },
         ]
       }
+      fluxos_envio: {
+        Row: {
+          ack_seq: number
+          gerador_id: string
+          id_fluxo: string
+          updated_at: string
+        }
+        Insert: {
+          ack_seq?: number
+          gerador_id: string
+          id_fluxo: string
+          updated_at?: string
+        }
+        Update: {
+          ack_seq?: number
+          gerador_id?: string
+          id_fluxo?: string
+          updated_at?: string
+        }
+        Relationships: [
+          {
+            foreignKeyName: "fluxos_envio_gerador_id_fkey"
+            columns: ["gerador_id"]
+            isOneToOne: false
+            referencedRelation: "geradores"
+            referencedColumns: ["id"]
+          },
+        ]
+      }
       geradores: {
         Row: {
           combustivel: string | null
@@ -184,9 +216,51 @@ export type Database = {
         }
         Relationships: []
       }
+      leituras_agregadas: {
+        Row: {
+          amostras: number
+          created_at: string
+          estatisticas: Json
+          fim: string
+          gerador_id: string
+          id: string
+          inicio: string
+          janela: string
+        }
+        Insert: {
+          amostras?: number
+          created_at?: string
+          estatisticas?: Json
+          fim: string
+          gerador_id: string
+          id?: string
+          inicio: string
+          janela: string
+        }
+        Update: {
+          amostras?: number
+          created_at?: string
+          estatisticas?: Json
+          fim?: string
+          gerador_id?: string
+          id?: string
+          inicio?: string
+          janela?: string
+        }
+        Relationships: [
+          {
+            foreignKeyName: "leituras_agregadas_gerador_id_fkey"
+            columns: ["gerador_id"]
+            isOneToOne: false
+            referencedRelation: "geradores"
+            referencedColumns: ["id"]
+          },
+        ]
+      }
       leituras_tempo_real: {
         Row: {
           aviso_ativo: boolean | null
+          capturado_em: string | null
           corrente_fase1: number | null
           created_at: string
           falha_ativa: boolean | null
@@ -198,20 +272,25 @@ export type Database = {
           horimetro_minutos: number | null
           horimetro_segundos: number | null
           id: string
+          id_fluxo: string | null
+          leitura_parcial: boolean
           motor_funcionando: boolean | null
           nivel_combustivel: number | null
           numero_partidas: number | null
           rede_ok: boolean | null
           rpm_motor: number | null
+          seq: number | null
           temperatura_agua: number | null
           tensao_bateria: number | null
           tensao_gmg: number | null
           tensao_rede_rs: number | null
           tensao_rede_st: number | null
           tensao_rede_tr: number | null
+          trace_id: string | null
         }
         Insert: {
           aviso_ativo?: boolean | null
+          capturado_em?: string | null
           corrente_fase1?: number | null
           created_at?: string
           falha_ativa?: boolean | null
@@ -223,20 +302,25 @@ export type Database = {
           horimetro_minutos?: number | null
           horimetro_segundos?: number | null
           id?: string
+          id_fluxo?: string | null
+          leitura_parcial?: boolean
           motor_funcionando?: boolean | null
           nivel_combustivel?: number | null
           numero_partidas?: number | null
           rede_ok?: boolean | null
           rpm_motor?: number | null
+          seq?: number | null
           temperatura_agua?: number | null
           tensao_bateria?: number | null
           tensao_gmg?: number | null
           tensao_rede_rs?: number | null
           tensao_rede_st?: number | null
           tensao_rede_tr?: number | null
+          trace_id?: string | null
         }
         Update: {
           aviso_ativo?: boolean | null
+          capturado_em?: string | null
           corrente_fase1?: number | null
           created_at?: string
           falha_ativa?: boolean | null
@@ -248,17 +332,21 @@ export type Database = {
           horimetro_minutos?: number | null
           horimetro_segundos?: number | null
           id?: string
+          id_fluxo?: string | null
+          leitura_parcial?: boolean
           motor_funcionando?: boolean | null
           nivel_combustivel?: number | null
           numero_partidas?: number | null
           rede_ok?: boolean | null
           rpm_motor?: number | null
+          seq?: number | null
           temperatura_agua?: number | null
           tensao_bateria?: number | null
           tensao_gmg?: number | null
           tensao_rede_rs?: number | null
           tensao_rede_st?: number | null
           tensao_rede_tr?: number | null
+          trace_id?: string | null
         }
         Relationships: [
           {
@@ -470,7 +558,10 @@ export type Database = {
       [_ in never]: never
     }
     Functions: {
-      [_ in never]: never
+      avancar_ack_fluxo: {
+        Args: { p_gerador_id: string; p_id_fluxo: string; p_seq_min: number }
+        Returns: number
+      }
     }
     Enums: {
       [_ in never]: never
@@ -1,4 +1,5 @@
 import { createClient } from "@supabase/supabase-js";
+import { decode } from "@msgpack/msgpack";
 
 const corsHeaders = {
   "Access-Control-Allow-Origin": "*",
@@ -32,6 +33,117 @@ interface ModbusReading {
   horimetro_horas?: number;
   horimetro_minutos?: number;
   horimetro_segundos?: number;
+
+  // Instante de captura na VPS (ISO UTC) e trace do ciclo, se amostrado
+  capturado_em?: string;
+  trace_id?: string;
+
+  // true quando um dos blocos Modbus falhou e só parte dos campos veio
+  leitura_parcial?: boolean;
+
+  // true quando a VPS já avaliou os parametros_alerta desta leitura
+  alertas_avaliados_na_vps?: boolean;
+
+  // Identidade da leitura: seq do gerador dentro do fluxo (um por processo do leitor)
+  seq?: number;
+  id_fluxo?: string;
+  // Menor seq do fluxo ainda guardado na VPS (o ack não passa de leituras não confirmadas)
+  seq_min?: number;
+}
+
+// Lote de leituras do mesmo fluxo (leitor com GMG_ENVIO_LOTE > 1)
+interface ReadingBatch {
+  porta_vps: string;
+  tipo: "leituras";
+  id_fluxo: string;
+  seq_min?: number;
+  leituras: ModbusReading[];
+}
+
+// Rollups por janela (1m, 1h) calculados na VPS
+interface RollupBatch {
+  porta_vps: string;
+  tipo: "rollups";
+  rollups: Array<{
+    janela: string;
+    inicio: string;
+    fim: string;
+    amostras: number;
+    estatisticas: Record<string, { min: number; max: number; media: number; ultimo: number; amostras: number }>;
+  }>;
+}
+
+// Alertas detectados e enviados diretamente pela VPS
+interface AlertBatch {
+  porta_vps: string;
+  tipo: "alertas";
+  alertas: Array<{
+    nivel: string;
+    mensagem: string;
+    condicao?: string;
+    chave?: string;
+  }>;
+}
+
+// Formato compacto do leitor (v2.19.0): MessagePack com IDs inteiros no lugar
+// das chaves, capturado_em em epoch e lotes com gzip. A posição é o ID e a
+// tabela é a mesma de CAMPOS_WIRE em docs/vps-modbus-reader.py (só acrescentar no fim).
+const CAMPOS_WIRE: (string | null)[] = [
+  null,
+  "porta_vps", "tipo", "capturado_em", "trace_id", "leitura_parcial",
+  "alertas_avaliados_na_vps",
+  "rollups", "janela", "inicio", "fim", "amostras", "estatisticas",
+  "min", "max", "media", "ultimo",
+  "alertas", "nivel", "mensagem", "condicao",
+  "tensao_rede_rs", "tensao_rede_st", "tensao_rede_tr", "tensao_gmg",
+  "corrente_fase1", "frequencia_gmg", "rpm_motor", "tensao_bateria",
+  "temperatura_agua", "horimetro_horas", "horimetro_minutos",
+  "horimetro_segundos", "horas_trabalhadas", "numero_partidas",
+  "nivel_combustivel",
+  "motor_funcionando", "rede_ok", "gmg_alimentando", "aviso_ativo",
+  "falha_ativa",
+  "seq", "id_fluxo", "seq_min", "leituras", "chave",
+];
+
+const CONTENT_TYPES_MSGPACK = ["application/x-msgpack", "application/msgpack", "application/vnd.msgpack"];
+
+function deWire(valor: unknown): unknown {
+  if (Array.isArray(valor)) return valor.map(deWire);
+  if (valor !== null && typeof valor === "object" && !(valor instanceof Uint8Array)) {
+    const objeto: Record<string, unknown> = {};
+    for (const [chave, v] of Object.entries(valor)) {
+      const id = Number(chave);
+      objeto[Number.isInteger(id) && CAMPOS_WIRE[id] ? CAMPOS_WIRE[id]! : chave] = deWire(v);
+    }
+    return objeto;
+  }
+  return valor;
+}
+
+// JSON (padrão) ou MessagePack, conforme o Content-Type.
+// Retorna null para outro Content-Type: o handler responde 415 e o leitor volta para JSON.
+async function lerCorpo(req: Request): Promise<any> {
+  const contentType = (req.headers.get("content-type") ?? "").split(";")[0].trim().toLowerCase();
+  if (!CONTENT_TYPES_MSGPACK.includes(contentType)) {
+    if (contentType && contentType !== "application/json") {
+      return null;
+    }
+    return await req.json();
+  }
+
+  let stream = req.body;
+  if (stream && req.headers.get("content-encoding") === "gzip") {
+    stream = stream.pipeThrough(new DecompressionStream("gzip"));
+  }
+  const bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+  const body = deWire(decode(bytes)) as Record<string, unknown>;
+  const leituras = Array.isArray(body.leituras) ? body.leituras as Record<string, unknown>[] : [];
+  for (const item of [body, ...leituras]) {
+    if (typeof item.capturado_em === "number") {
+      item.capturado_em = new Date(item.capturado_em * 1000).toISOString();
+    }
+  }
+  return body;
 }
 
 interface AlertParam {
@@ -42,6 +154,146 @@ interface AlertParam {
   habilitado: boolean;
 }
 
+// Linha de leituras_tempo_real a partir da leitura recebida
+function linhaLeitura(geradorId: string, reading: ModbusReading) {
+  return {
+    gerador_id: geradorId,
+    tensao_rede_rs: reading.tensao_rede_rs,
+    tensao_rede_st: reading.tensao_rede_st,
+    tensao_rede_tr: reading.tensao_rede_tr,
+    tensao_gmg: reading.tensao_gmg,
+    corrente_fase1: reading.corrente_fase1,
+    frequencia_gmg: reading.frequencia_gmg,
+    rpm_motor: reading.rpm_motor,
+    temperatura_agua: reading.temperatura_agua,
+    tensao_bateria: reading.tensao_bateria,
+    horas_trabalhadas: reading.horas_trabalhadas,
+    numero_partidas: reading.numero_partidas,
+    nivel_combustivel: reading.nivel_combustivel,
+    motor_funcionando: reading.motor_funcionando,
+    rede_ok: reading.rede_ok,
+    gmg_alimentando: reading.gmg_alimentando,
+    aviso_ativo: reading.aviso_ativo,
+    falha_ativa: reading.falha_ativa,
+    // Novos campos do horímetro separados
+    horimetro_horas: reading.horimetro_horas,
+    horimetro_minutos: reading.horimetro_minutos,
+    horimetro_segundos: reading.horimetro_segundos,
+    capturado_em: reading.capturado_em,
+    trace_id: reading.trace_id,
+    leitura_parcial: reading.leitura_parcial ?? false,
+    seq: reading.seq,
+    id_fluxo: reading.id_fluxo,
+  };
+}
+
+// Check alert parameters and generate alerts for a newly inserted reading
+// (skipped when the VPS already evaluated them from its cached parameters)
+async function gerarAlertas(supabase: any, geradorId: string, reading: ModbusReading, leituraId: string) {
+  if (reading.alertas_avaliados_na_vps) return;
+
+  const { data: alertParams, error: alertError } = await supabase
+    .from("parametros_alerta")
+    .select("*")
+    .eq("gerador_id", geradorId)
+    .eq("habilitado", true);
+
+  if (alertError || !alertParams) return;
+
+  const alertsToInsert: Array<{
+    gerador_id: string;
+    leitura_id: string;
+    nivel: string;
+    mensagem: string;
+    origem: string;
+  }> = [];
+
+  const parameterMap: Record<string, number | undefined> = {
+    "Tensão GMG": reading.tensao_gmg,
+    "Tensão Rede R-S": reading.tensao_rede_rs,
+    "Tensão Rede S-T": reading.tensao_rede_st,
+    "Tensão Rede T-R": reading.tensao_rede_tr,
+    "Corrente Fase 1": reading.corrente_fase1,
+    "Frequência GMG": reading.frequencia_gmg,
+    "RPM Motor": reading.rpm_motor,
+    "Temperatura Água": reading.temperatura_agua,
+    "Tensão Bateria": reading.tensao_bateria,
+    "Nível Combustível": reading.nivel_combustivel,
+  };
+
+  for (const param of alertParams as AlertParam[]) {
+    const value = parameterMap[param.parametro];
+    
+    if (value !== undefined) {
+      let alertMessage: string | null = null;
+
+      if (param.valor_minimo !== null && value < param.valor_minimo) {
+        alertMessage = `${param.parametro} abaixo do limite: ${value} (mínimo: ${param.valor_minimo})`;
+      } else if (param.valor_maximo !== null && value > param.valor_maximo) {
+        alertMessage = `${param.parametro} acima do limite: ${value} (máximo: ${param.valor_maximo})`;
+      }
+
+      if (alertMessage) {
+        alertsToInsert.push({
+          gerador_id: geradorId,
+          leitura_id: leituraId,
+          nivel: param.nivel,
+          mensagem: alertMessage,
+          origem: "rule",
+        });
+      }
+    }
+  }
+
+  // Check status bits for alerts
+  if (reading.aviso_ativo) {
+    alertsToInsert.push({
+      gerador_id: geradorId,
+      leitura_id: leituraId,
+      nivel: "warning",
+      mensagem: "Aviso ativo no controlador K30XL",
+      origem: "rule",
+    });
+  }
+
+  if (reading.falha_ativa) {
+    alertsToInsert.push({
+      gerador_id: geradorId,
+      leitura_id: leituraId,
+      nivel: "critical",
+      mensagem: "Falha ativa no controlador K30XL",
+      origem: "rule",
+    });
+  }
+
+  // Insert all alerts
+  if (alertsToInsert.length > 0) {
+    const { error: insertAlertError } = await supabase
+      .from("alertas")
+      .insert(alertsToInsert);
+
+    if (insertAlertError) {
+      console.error("Error inserting alerts:", insertAlertError);
+    } else {
+      console.log(`Inserted ${alertsToInsert.length} alerts`);
+    }
+  }
+}
+
+// Maior seq contíguo já gravado no fluxo (leituras até ele podem sair da fila da VPS)
+async function avancarAck(supabase: any, geradorId: string, idFluxo: string, seqMin: number | null): Promise<number | null> {
+  const { data, error } = await supabase.rpc("avancar_ack_fluxo", {
+    p_gerador_id: geradorId,
+    p_id_fluxo: idFluxo,
+    p_seq_min: seqMin,
+  });
+  if (error) {
+    console.error("Error advancing stream ack:", error);
+    return null;
+  }
+  return data as number;
+}
+
 Deno.serve(async (req) => {
   // Handle CORS preflight
   if (req.method === "OPTIONS") {
@@ -56,7 +308,14 @@ Deno.serve(async (req) => {
     const supabase = createClient(supabaseUrl, supabaseServiceKey);
 
     if (req.method === "POST") {
-      const reading: ModbusReading = await req.json();
+      const body = await lerCorpo(req);
+      if (body === null) {
+        return new Response(
+          JSON.stringify({ error: `Unsupported Content-Type: ${req.headers.get("content-type")}` }),
+          { status: 415, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+        );
+      }
+      const reading: ModbusReading = body;
       
       console.log("Received Modbus reading:", JSON.stringify(reading));
 
@@ -154,140 +413,165 @@ Deno.serve(async (req) => {
         .update({ status: "online", updated_at: new Date().toISOString() })
         .eq("porta_vps", reading.porta_vps);
 
-      // Insert the reading
-      const { data: leitura, error: leituraError } = await supabase
-        .from("leituras_tempo_real")
-        .insert({
+      // Alerts evaluated on the VPS are pushed as soon as they are detected
+      if (body.tipo === "alertas") {
+        const batch = body as AlertBatch;
+        const alertsToInsert = (batch.alertas ?? []).map((alerta) => ({
           gerador_id: geradorId,
-          tensao_rede_rs: reading.tensao_rede_rs,
-          tensao_rede_st: reading.tensao_rede_st,
-          tensao_rede_tr: reading.tensao_rede_tr,
-          tensao_gmg: reading.tensao_gmg,
-          corrente_fase1: reading.corrente_fase1,
-          frequencia_gmg: reading.frequencia_gmg,
-          rpm_motor: reading.rpm_motor,
-          temperatura_agua: reading.temperatura_agua,
-          tensao_bateria: reading.tensao_bateria,
-          horas_trabalhadas: reading.horas_trabalhadas,
-          numero_partidas: reading.numero_partidas,
-          nivel_combustivel: reading.nivel_combustivel,
-          motor_funcionando: reading.motor_funcionando,
-          rede_ok: reading.rede_ok,
-          gmg_alimentando: reading.gmg_alimentando,
-          aviso_ativo: reading.aviso_ativo,
-          falha_ativa: reading.falha_ativa,
-          // Novos campos do horímetro separados
-          horimetro_horas: reading.horimetro_horas,
-          horimetro_minutos: reading.horimetro_minutos,
-          horimetro_segundos: reading.horimetro_segundos,
-        })
-        .select()
-        .single();
+          nivel: alerta.nivel,
+          mensagem: alerta.mensagem,
+          origem: "rule",
+          chave_envio: alerta.chave ?? null,
+        }));
+
+        if (alertsToInsert.length > 0) {
+          // Reenvio de um alerta já gravado (mesma chave) é ignorado
+          const { error: insertAlertError } = await supabase
+            .from("alertas")
+            .upsert(alertsToInsert, { onConflict: "gerador_id,chave_envio", ignoreDuplicates: true });
+
+          if (insertAlertError) {
+            console.error("Error inserting VPS alerts:", insertAlertError);
+            return new Response(
+              JSON.stringify({ error: "Failed to insert alerts", details: insertAlertError }),
+              { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+            );
+          }
+        }
+
+        console.log(`Inserted ${alertsToInsert.length} alerts from VPS`);
 
-      if (leituraError) {
-        console.error("Error inserting reading:", leituraError);
         return new Response(
-          JSON.stringify({ error: "Failed to insert reading", details: leituraError }),
-          { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+          JSON.stringify({ success: true, gerador_id: geradorId, alerts: alertsToInsert.length }),
+          { status: 200, headers: { ...corsHeaders, "Content-Type": "application/json" } }
         );
       }
 
-      console.log("Reading inserted successfully:", leitura.id);
-
-      // Check alert parameters and generate alerts
-      const { data: alertParams, error: alertError } = await supabase
-        .from("parametros_alerta")
-        .select("*")
-        .eq("gerador_id", geradorId)
-        .eq("habilitado", true);
-
-      if (!alertError && alertParams) {
-        const alertsToInsert: Array<{
-          gerador_id: string;
-          leitura_id: string;
-          nivel: string;
-          mensagem: string;
-          origem: string;
-        }> = [];
-
-        const parameterMap: Record<string, number | undefined> = {
-          "Tensão GMG": reading.tensao_gmg,
-          "Tensão Rede R-S": reading.tensao_rede_rs,
-          "Tensão Rede S-T": reading.tensao_rede_st,
-          "Tensão Rede T-R": reading.tensao_rede_tr,
-          "Corrente Fase 1": reading.corrente_fase1,
-          "Frequência GMG": reading.frequencia_gmg,
-          "RPM Motor": reading.rpm_motor,
-          "Temperatura Água": reading.temperatura_agua,
-          "Tensão Bateria": reading.tensao_bateria,
-          "Nível Combustível": reading.nivel_combustivel,
-        };
-
-        for (const param of alertParams as AlertParam[]) {
-          const value = parameterMap[param.parametro];
-          
-          if (value !== undefined) {
-            let alertMessage: string | null = null;
-
-            if (param.valor_minimo !== null && value < param.valor_minimo) {
-              alertMessage = `${param.parametro} abaixo do limite: ${value} (mínimo: ${param.valor_minimo})`;
-            } else if (param.valor_maximo !== null && value > param.valor_maximo) {
-              alertMessage = `${param.parametro} acima do limite: ${value} (máximo: ${param.valor_maximo})`;
-            }
-
-            if (alertMessage) {
-              alertsToInsert.push({
-                gerador_id: geradorId,
-                leitura_id: leitura.id,
-                nivel: param.nivel,
-                mensagem: alertMessage,
-                origem: "rule",
-              });
-            }
+      // Rollups are a separate upload tier (one row per closed window)
+      if (body.tipo === "rollups") {
+        const batch = body as RollupBatch;
+        const rows = (batch.rollups ?? []).map((rollup) => ({
+          gerador_id: geradorId,
+          janela: rollup.janela,
+          inicio: rollup.inicio,
+          fim: rollup.fim,
+          amostras: rollup.amostras,
+          estatisticas: rollup.estatisticas,
+        }));
+
+        if (rows.length > 0) {
+          const { error: rollupError } = await supabase
+            .from("leituras_agregadas")
+            .upsert(rows, { onConflict: "gerador_id,janela,inicio" });
+
+          if (rollupError) {
+            console.error("Error inserting rollups:", rollupError);
+            return new Response(
+              JSON.stringify({ error: "Failed to insert rollups", details: rollupError }),
+              { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+            );
           }
         }
 
-        // Check status bits for alerts
-        if (reading.aviso_ativo) {
-          alertsToInsert.push({
-            gerador_id: geradorId,
-            leitura_id: leitura.id,
-            nivel: "warning",
-            mensagem: "Aviso ativo no controlador K30XL",
-            origem: "rule",
-          });
-        }
+        console.log(`Upserted ${rows.length} rollups`);
 
-        if (reading.falha_ativa) {
-          alertsToInsert.push({
-            gerador_id: geradorId,
-            leitura_id: leitura.id,
-            nivel: "critical",
-            mensagem: "Falha ativa no controlador K30XL",
-            origem: "rule",
-          });
+        return new Response(
+          JSON.stringify({ success: true, gerador_id: geradorId, rollups: rows.length }),
+          { status: 200, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+        );
+      }
+
+      // Batch of readings from one stream: duplicates (same id_fluxo + seq) are skipped
+      if (body.tipo === "leituras") {
+        const batch = body as ReadingBatch;
+        const leituras = batch.leituras ?? [];
+        if (!batch.id_fluxo || leituras.some((item) => typeof item.seq !== "number")) {
+          return new Response(
+            JSON.stringify({ error: "id_fluxo and seq are required in reading batches" }),
+            { status: 400, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+          );
         }
 
-        // Insert all alerts
-        if (alertsToInsert.length > 0) {
-          const { error: insertAlertError } = await supabase
-            .from("alertas")
-            .insert(alertsToInsert);
+        const rows = leituras.map((item) => linhaLeitura(geradorId, { ...item, id_fluxo: batch.id_fluxo }));
+        const { data: inseridas, error: batchError } = await supabase
+          .from("leituras_tempo_real")
+          .upsert(rows, { onConflict: "gerador_id,id_fluxo,seq", ignoreDuplicates: true })
+          .select("id, seq");
 
-          if (insertAlertError) {
-            console.error("Error inserting alerts:", insertAlertError);
-          } else {
-            console.log(`Inserted ${alertsToInsert.length} alerts`);
-          }
+        if (batchError) {
+          console.error("Error inserting reading batch:", batchError);
+          return new Response(
+            JSON.stringify({ error: "Failed to insert readings", details: batchError }),
+            { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+          );
+        }
+
+        const porSeq = new Map(leituras.map((item) => [item.seq, item]));
+        for (const linha of inseridas ?? []) {
+          await gerarAlertas(supabase, geradorId, porSeq.get(linha.seq)!, linha.id);
         }
+
+        const seqMin = batch.seq_min ?? Math.min(...leituras.map((item) => item.seq!));
+        const ackSeq = await avancarAck(supabase, geradorId, batch.id_fluxo, seqMin);
+        const duplicadas = leituras.length - (inseridas ?? []).length;
+        console.log(`Inserted ${leituras.length - duplicadas} readings (${duplicadas} duplicates), ack ${ackSeq}`);
+
+        return new Response(
+          JSON.stringify({ success: true, gerador_id: geradorId, leituras: leituras.length - duplicadas, duplicadas, ack_seq: ackSeq }),
+          { status: 200, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+        );
       }
 
+      // Insert the reading (readings with seq are idempotent: a resend returns duplicada)
+      const idempotente = typeof reading.seq === "number" && !!reading.id_fluxo;
+      const { data: leitura, error: leituraError } = idempotente
+        ? await supabase
+            .from("leituras_tempo_real")
+            .upsert(linhaLeitura(geradorId, reading), { onConflict: "gerador_id,id_fluxo,seq", ignoreDuplicates: true })
+            .select()
+            .maybeSingle()
+        : await supabase
+            .from("leituras_tempo_real")
+            .insert(linhaLeitura(geradorId, reading))
+            .select()
+            .single();
+
+      if (leituraError) {
+        console.error("Error inserting reading:", leituraError);
+        return new Response(
+          JSON.stringify({ error: "Failed to insert reading", details: leituraError }),
+          { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+        );
+      }
+
+      // Sem seq_min (leitor sem fila) o ack só avança pelo trecho contíguo já gravado
+      const ackSeq = idempotente ? await avancarAck(supabase, geradorId, reading.id_fluxo!, reading.seq_min ?? null) : null;
+
+      if (!leitura) {
+        console.log(`Duplicate reading ignored: ${reading.id_fluxo}:${reading.seq}`);
+        return new Response(
+          JSON.stringify({ success: true, gerador_id: geradorId, reading_id: null, duplicada: true, ack_seq: ackSeq }),
+          { status: 200, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+        );
+      }
+
+      console.log("Reading inserted successfully:", leitura.id);
+
+      // End-to-end ingest lag (VPS capture → row insert)
+      if (reading.capturado_em) {
+        const lagMs = new Date(leitura.created_at).getTime() - new Date(reading.capturado_em).getTime();
+        console.log(`Ingest lag: ${lagMs} ms${reading.trace_id ? ` (trace ${reading.trace_id})` : ""}`);
+      }
+
+      await gerarAlertas(supabase, geradorId, reading, leitura.id);
+
       return new Response(
         JSON.stringify({ 
           success: true, 
           gerador_id: geradorId,
           reading_id: leitura.id,
-          timestamp: leitura.created_at 
+          timestamp: leitura.created_at,
+          ack_seq: ackSeq,
         }),
         { status: 200, headers: { ...corsHeaders, "Content-Type": "application/json" } }
       );
@@ -298,6 +582,7 @@ Deno.serve(async (req) => {
       const url = new URL(req.url);
       const portaVps = url.searchParams.get("porta_vps");
       const geradorId = url.searchParams.get("gerador_id");
+      const recurso = url.searchParams.get("recurso");
 
       if (!portaVps && !geradorId) {
         return new Response(
@@ -325,6 +610,28 @@ Deno.serve(async (req) => {
         targetGeradorId = equipamentoHF.gerador_id;
       }
 
+      // Alert parameters cached by the VPS reader
+      if (recurso === "parametros_alerta") {
+        const { data: parametros, error: paramsError } = await supabase
+          .from("parametros_alerta")
+          .select("parametro, valor_minimo, valor_maximo, nivel, habilitado, updated_at")
+          .eq("gerador_id", targetGeradorId)
+          .eq("habilitado", true);
+
+        if (paramsError) {
+          console.error("Error fetching alert parameters:", paramsError);
+          return new Response(
+            JSON.stringify({ error: "Failed to fetch alert parameters" }),
+            { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+          );
+        }
+
+        return new Response(
+          JSON.stringify({ gerador_id: targetGeradorId, parametros: parametros ?? [] }),
+          { status: 200, headers: { ...corsHeaders, "Content-Type": "application/json" } }
+        );
+      }
+
       const { data, error } = await supabase
         .from("leituras_tempo_real")
         .select("*")
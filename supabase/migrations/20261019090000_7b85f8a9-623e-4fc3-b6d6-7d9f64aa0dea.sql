@@ -0,0 +1,36 @@
+-- Rollups por minuto/hora calculados na VPS (min/max/média/último/amostras por campo)
+CREATE TABLE IF NOT EXISTS public.leituras_agregadas (
+  id UUID NOT NULL DEFAULT gen_random_uuid() PRIMARY KEY,
+  gerador_id UUID NOT NULL REFERENCES public.geradores(id) ON DELETE CASCADE,
+  janela TEXT NOT NULL,
+  inicio TIMESTAMP WITH TIME ZONE NOT NULL,
+  fim TIMESTAMP WITH TIME ZONE NOT NULL,
+  amostras INTEGER NOT NULL DEFAULT 0,
+  estatisticas JSONB NOT NULL DEFAULT '{}'::jsonb,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  UNIQUE (gerador_id, janela, inicio)
+);
+
+COMMENT ON COLUMN public.leituras_agregadas.janela IS 'Tamanho da janela (ex: 1m, 1h)';
+COMMENT ON COLUMN public.leituras_agregadas.estatisticas IS 'Por campo: {min, max, media, ultimo, amostras}';
+
+CREATE INDEX IF NOT EXISTS idx_leituras_agregadas_gerador_inicio
+  ON public.leituras_agregadas (gerador_id, janela, inicio DESC);
+
+ALTER TABLE public.leituras_agregadas ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view aggregated readings via generator" 
+ON public.leituras_agregadas 
+FOR SELECT 
+USING (
+  EXISTS (
+    SELECT 1 FROM geradores 
+    WHERE geradores.id = leituras_agregadas.gerador_id 
+    AND (geradores.user_id = auth.uid() OR geradores.user_id = '00000000-0000-0000-0000-000000000000'::uuid)
+  )
+);
+
+CREATE POLICY "Allow insert aggregated readings from edge function" 
+ON public.leituras_agregadas 
+FOR INSERT 
+WITH CHECK (true);
@@ -0,0 +1,7 @@
+-- Instante de captura na VPS e trace do ciclo, para medir o atraso de ingestão ponta a ponta
+ALTER TABLE public.leituras_tempo_real
+ADD COLUMN IF NOT EXISTS capturado_em TIMESTAMP WITH TIME ZONE,
+ADD COLUMN IF NOT EXISTS trace_id TEXT;
+
+COMMENT ON COLUMN leituras_tempo_real.capturado_em IS 'Instante da leitura Modbus na VPS (UTC); atraso de ingestão = created_at - capturado_em';
+COMMENT ON COLUMN leituras_tempo_real.trace_id IS 'ID do trace do ciclo na VPS (logs/trace-ciclos.json), quando amostrado';
@@ -0,0 +1,5 @@
+-- Leituras em que um dos blocos Modbus falhou (campos do bloco ausentes ficam NULL)
+ALTER TABLE public.leituras_tempo_real
+ADD COLUMN IF NOT EXISTS leitura_parcial BOOLEAN NOT NULL DEFAULT false;
+
+COMMENT ON COLUMN leituras_tempo_real.leitura_parcial IS 'true quando a VPS enviou apenas os campos dos blocos lidos com sucesso no ciclo';
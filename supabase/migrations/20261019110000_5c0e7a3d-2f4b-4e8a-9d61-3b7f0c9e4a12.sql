@@ -0,0 +1,67 @@
+-- Envio idempotente da VPS: cada leitura leva (id_fluxo, seq); reenvios e lotes repetidos não duplicam linhas
+ALTER TABLE public.leituras_tempo_real
+ADD COLUMN IF NOT EXISTS seq BIGINT,
+ADD COLUMN IF NOT EXISTS id_fluxo TEXT;
+
+COMMENT ON COLUMN leituras_tempo_real.seq IS 'Número sequencial da leitura no fluxo do gerador (1, 2, 3...), atribuído na VPS';
+COMMENT ON COLUMN leituras_tempo_real.id_fluxo IS 'Fluxo de envio: um por processo do leitor na VPS; seq recomeça em cada fluxo';
+
+-- NULLs são distintos: leituras antigas (sem seq) não conflitam
+CREATE UNIQUE INDEX IF NOT EXISTS idx_leituras_tempo_real_fluxo_seq
+  ON public.leituras_tempo_real (gerador_id, id_fluxo, seq);
+
+-- Alertas enviados pela VPS: chave da condição + leitura que disparou
+ALTER TABLE public.alertas
+ADD COLUMN IF NOT EXISTS chave_envio TEXT;
+
+COMMENT ON COLUMN alertas.chave_envio IS 'id_fluxo:seq:condicao do alerta enviado pela VPS; reenvios são ignorados';
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alertas_chave_envio
+  ON public.alertas (gerador_id, chave_envio);
+
+-- Maior seq contíguo recebido por fluxo (ack devolvido ao leitor)
+CREATE TABLE IF NOT EXISTS public.fluxos_envio (
+  gerador_id UUID NOT NULL REFERENCES public.geradores(id) ON DELETE CASCADE,
+  id_fluxo TEXT NOT NULL,
+  ack_seq BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (gerador_id, id_fluxo)
+);
+
+ALTER TABLE public.fluxos_envio ENABLE ROW LEVEL SECURITY;
+
+-- Avança o ack do fluxo até o primeiro buraco a partir de max(ack, seq_min - 1).
+-- seq_min é a leitura mais antiga que a VPS ainda guarda: o que ficou abaixo dela
+-- (fila cheia na VPS) não vai chegar e não pode travar o ack.
+CREATE OR REPLACE FUNCTION public.avancar_ack_fluxo(p_gerador_id UUID, p_id_fluxo TEXT, p_seq_min BIGINT)
+RETURNS BIGINT AS $$
+DECLARE
+  v_ack BIGINT;
+  v_novo BIGINT;
+BEGIN
+  INSERT INTO public.fluxos_envio (gerador_id, id_fluxo)
+  VALUES (p_gerador_id, p_id_fluxo)
+  ON CONFLICT (gerador_id, id_fluxo) DO NOTHING;
+
+  SELECT GREATEST(ack_seq, COALESCE(p_seq_min, 1) - 1) INTO v_ack
+  FROM public.fluxos_envio
+  WHERE gerador_id = p_gerador_id AND id_fluxo = p_id_fluxo
+  FOR UPDATE;
+
+  -- Trecho contíguo logo após o ack: seq - posição é constante dentro dele
+  SELECT MAX(seq) INTO v_novo
+  FROM (
+    SELECT seq, seq - ROW_NUMBER() OVER (ORDER BY seq) AS grupo
+    FROM public.leituras_tempo_real
+    WHERE gerador_id = p_gerador_id AND id_fluxo = p_id_fluxo AND seq > v_ack
+  ) AS recebidas
+  WHERE grupo = v_ack;
+
+  v_ack := GREATEST(v_ack, COALESCE(v_novo, v_ack));
+
+  UPDATE public.fluxos_envio SET ack_seq = v_ack, updated_at = now()
+  WHERE gerador_id = p_gerador_id AND id_fluxo = p_id_fluxo;
+
+  RETURN v_ack;
+END;
+$$ LANGUAGE plpgsql SET search_path = public;